@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'students.middleware.flush_delivery_failures',
 ]
 
 ROOT_URLCONF = 'student_manager.urls'
@@ -74,13 +76,57 @@ WSGI_APPLICATION = 'student_manager.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# إعداد SQLite للتشغيل الفعلي: مكتب المسح يكتب بينما لوحة التحكم والتقارير تقرأ والمُرسِل يسجل.
+# - WAL: القراءة لا تحجب الكتابة والعكس، و synchronous=NORMAL آمن مع WAL وأسرع بكثير.
+# - transaction_mode=IMMEDIATE: كل transaction.atomic يحجز قفل الكتابة من بدايته، فينتظر
+#   المعاملات الأخرى حتى timeout بدل الفشل الفوري "database is locked" عند ترقية قفل القراءة.
+# - timeout: مهلة الانتظار (busy timeout) بالثواني قبل إرجاع "database is locked".
+# القياس: manage.py stress_sqlite
+SQLITE_PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'mmap_size=268435456',   # 256MB
+    'cache_size=-32000',     # ~32MB
+    'temp_store=MEMORY',
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in SQLITE_PRAGMAS),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# PostgreSQL لعدة فروع: DATABASE_ENGINE=postgresql ومتغيرات POSTGRES_* من البيئة.
+# POSTGRES_HOST فارغ = الاتصال عبر Unix socket المحلي.
+# POSTGRES_POOL=1 (الافتراضي): مجمع اتصالات Django 5 (يحتاج psycopg[pool])،
+# وإلا اتصالات دائمة لكل خيط لمدة POSTGRES_CONN_MAX_AGE ثانية.
+if os.environ.get('DATABASE_ENGINE') == 'postgresql':
+    POSTGRES_POOL = os.environ.get('POSTGRES_POOL', '1') == '1'
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'students_manager'),
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', ''),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+        # المجمع يدير عمر الاتصالات بنفسه ولا يعمل مع CONN_MAX_AGE
+        'CONN_MAX_AGE': 0 if POSTGRES_POOL else int(os.environ.get('POSTGRES_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            },
+        } if POSTGRES_POOL else {},
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,3 +181,41 @@ CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+
+# مدة صلاحية فهرس المسح (الطلاب ومجموعتا "تم تسجيله اليوم" و"دفع هذا الشهر") بالثواني
+BARCODE_INDEX_TTL = 60
+# مدة صلاحية نسخة Basics (السعر والفرص ووقت التأخير) في كل عملية بالثواني
+BASICS_CACHE_TTL = 60
+
+# وسيلة إرسال WhatsApp: 'selenium' أو 'pywhatkit' أو 'fake' (لقياس الأداء دون هاتف) أو 'http'
+WHATSAPP_TRANSPORT = 'selenium'
+WHATSAPP_TRANSPORT_OPTIONS = {}
+
+# خيارات رسم صور الباركود (ImageWriter في python-barcode)؛ تغييرها ينشئ صوراً جديدة في media/barcodes
+BARCODE_WRITER_OPTIONS = {}
+
+# طريقة رسم الباركود في ملف PDF: 'vector' (أصغر وأسرع) أو 'raster' (صور PNG)
+BARCODE_PDF_MODE = 'vector'
+
+# عدد أرقام الباركود للطلاب الجدد؛ ارفعه إلى 6 عندما يقترب manage.py barcode_capacity من الامتلاء
+BARCODE_LENGTH = 5
+
+# عدد جلسات WhatsApp المتوازية في run_whatsapp_dispatcher (رقم مرتبط وملف تعريف Chrome لكل جلسة)
+WHATSAPP_SESSIONS = 1
+# ملفات التعريف بالترتيب؛ إن كانت أقل من عدد الجلسات تُضاف whatsapp_profile_2 و whatsapp_profile_3 …
+WHATSAPP_SESSION_PROFILES = []
+
+# حد سرعة الإرسال المتكيّف لكل جلسة (رسالة/ثانية): يبدأ من 1 / WHATSAPP_SEND_INTERVAL
+# ويرتفع مع الإرسال السريع الناجح وينخفض للنصف عند الفشل أو البطء
+WHATSAPP_RATE_MIN = 0.05
+WHATSAPP_RATE_MAX = 2
+# إرسال أبطأ من هذا (بالثواني) يُعتبر اختناقاً
+WHATSAPP_SLOW_SEND_SECONDS = 15
+# حد عام لكل الجلسات معاً (None = بلا حد)، وأقل فاصل بين رسالتين لنفس الرقم (0 = بلا حد)
+WHATSAPP_GLOBAL_RATE = None
+WHATSAPP_RECIPIENT_INTERVAL = 0
+
+# واجهة رفع المسحات دون اتصال (attendance/batch/): أقصى عدد أحداث في الطلب الواحد،
+# والرمز المطلوب في Authorization: Bearer <token> (الواجهة معطلة ما لم يُضبط)
+SCAN_BATCH_MAX_EVENTS = 1000
+SCAN_API_TOKEN = os.environ.get('SCAN_API_TOKEN') or None
@@ -2,11 +2,14 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse, NoReverseMatch
+from django.http import FileResponse
 from import_export.admin import ImportExportModelAdmin
-from .models import Students, Attendance, Payment,Basics,NotificationCategory,BroadcastMessage
+from .models import Students, Attendance, Payment,Basics,NotificationCategory,BroadcastMessage,DailyAttendanceStats,MonthlyRevenue,OutboundMessage,DeliveryFailure
 from .resources import StudentsResource
+from .utils.pdf_generator import generate_barcodes_pdf
+from .util import rebuild_monthly_revenue, refresh_daily_attendance_stats
 from django.utils import timezone # استورد timezone
-from .utils.whatsapp_queue import queue_whatsapp_message # استورد queue_whatsapp_message
+from .utils.broadcast import enqueue_broadcast # توزيع الرسائل العامة على الطابور
 from django.contrib import messages # استورد messages
 from import_export.formats import base_formats
 
@@ -39,11 +42,71 @@ class StudentsAdmin(ImportExportModelAdmin):
             return "-"
     print_card.short_description = 'طباعة كرنيه'
 
+    # إجراء لطباعة ملصقات الباركود للطلاب المحددين فقط
+    def print_selected_barcodes(self, request, queryset):
+        return FileResponse(generate_barcodes_pdf(queryset), as_attachment=True, filename='barcodes.pdf')
+    print_selected_barcodes.short_description = 'طباعة ملصقات الباركود للطلاب المحددين'
+    actions = [print_selected_barcodes]
+
 
 # تسجيل بقية الموديلات كما كانت
-admin.site.register(Attendance)
-admin.site.register(Payment)
+@admin.register(Attendance)
+class AttendanceAdmin(admin.ModelAdmin):
+    # الإضافة من لوحة التحكم لا تمر عبر record_presence؛ التعديل والحذف تعالجهما إشارات util.py
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            refresh_daily_attendance_stats(obj.attendance_date)
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('student', 'month', 'amount', 'paid_on')
+    list_select_related = ('student',)
+
+    # التعديل من لوحة التحكم لا يمر عبر record_payment، لذا نعيد حساب الشهر المتأثر
+    def save_model(self, request, obj, form, change):
+        old_month = Payment.objects.filter(pk=obj.pk).values_list('month', flat=True).first() if change else None
+        super().save_model(request, obj, form, change)
+        for month in {obj.month, old_month} - {None}:
+            rebuild_monthly_revenue(month)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_monthly_revenue(obj.month)
+
+    def delete_queryset(self, request, queryset):
+        months = set(queryset.values_list('month', flat=True))
+        super().delete_queryset(request, queryset)
+        for month in months:
+            rebuild_monthly_revenue(month)
+
 admin.site.register(Basics)
+
+@admin.register(MonthlyRevenue)
+class MonthlyRevenueAdmin(admin.ModelAdmin):
+    list_display = ('month', 'total_amount', 'payments_count')
+
+@admin.register(DailyAttendanceStats)
+class DailyAttendanceStatsAdmin(admin.ModelAdmin):
+    list_display = ('date', 'present', 'absent', 'late', 'unmarked')
+    date_hierarchy = 'date'
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'phone', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('phone', 'text')
+    readonly_fields = ('claimed_by', 'claimed_at', 'created_at', 'sent_at')
+
+@admin.register(DeliveryFailure)
+class DeliveryFailureAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'phone', 'student_name', 'message_type', 'error_type', 'reason')
+    list_filter = ('error_type', 'message_type')
+    search_fields = ('phone', 'student_name')
+    raw_id_fields = ('student',)
+    date_hierarchy = 'created_at'
+
 @admin.register(NotificationCategory)
 class NotificationCategoryAdmin(admin.ModelAdmin):
     search_fields = ['name'] # يتيح البحث عن فئات الإشعارات باستخدام حقل الاسم
@@ -52,13 +115,13 @@ class NotificationCategoryAdmin(admin.ModelAdmin):
 @admin.register(BroadcastMessage)
 class BroadcastMessageAdmin(admin.ModelAdmin):
     # الحقول التي ستظهر في قائمة الرسائل في واجهة المشرف
-    list_display = ('title', 'category', 'send_to_all', 'created_at', 'sent_at', 'was_sent')
+    list_display = ('title', 'category', 'send_to_all', 'created_at', 'sent_at', 'was_sent', 'delivery_progress')
     # الفلاتر التي ستظهر في الشريط الجانبي لتصفية الرسائل
     list_filter = ('category', 'send_to_all', 'sent_at')
     # الحقول التي يمكن البحث من خلالها عن الرسائل
     search_fields = ('title', 'content')
     # الحقول التي ستكون للقراءة فقط (لا يمكن تعديلها مباشرة من واجهة المشرف)
-    readonly_fields = ('sent_at',)
+    readonly_fields = ('sent_at', 'queued_count', 'sent_count', 'failed_count')
 
     # دالة مخصصة لعرض أيقونة تشير إلى ما إذا كانت الرسالة قد أُرسلت أم لا
     def was_sent(self, obj):
@@ -68,21 +131,21 @@ class BroadcastMessageAdmin(admin.ModelAdmin):
         return format_html('<img src="/static/admin/img/icon-no.svg" alt="False">') # عرض أيقونة "لا"
     was_sent.short_description = 'تم الإرسال' # النص الذي سيظهر كعنوان للعمود في واجهة المشرف
 
+    # تقدم الإرسال: ما أُرسل من إجمالي ما وُضع في الطابور، وعدد حالات الفشل
+    def delivery_progress(self, obj):
+        return f"✅ {obj.sent_count} / {obj.queued_count} — ❌ {obj.failed_count}"
+    delivery_progress.short_description = 'التقدم (أُرسلت / في الطابور — فشلت)'
+
     # إجراء مخصص لإرسال الرسائل المحددة
     def send_selected_messages(self, request, queryset):
         # request: كائن HttpRequest الحالي
         # queryset: مجموعة الرسائل التي تم تحديدها من قبل المشرف
         for message in queryset: # المرور على كل رسالة محددة
             if message.send_to_all and not message.sent_at: # التحقق مما إذا كانت الرسالة مخصصة للإرسال للجميع ولم تُرسل بعد
-                students_to_notify = Students.objects.all() # جلب جميع الطلاب
-                for student in students_to_notify: # المرور على كل طالب
-                    # التأكد من أن رقم هاتف ولي الأمر موجود قبل محاولة الإرسال
-                    if student.father_phone:
-                        queue_whatsapp_message(student.father_phone, message.content) # إضافة الرسالة إلى طابور الإرسال
-                message.sent_at = timezone.now() # تحديث وقت إرسال الرسالة إلى الوقت الحالي
-                message.save(update_fields=['sent_at']) # حفظ التغيير في حقل sent_at فقط
-                # إعلام المشرف بنجاح عملية الإرسال لهذه الرسالة
-                self.message_user(request, f"الرسالة '{message.title}' تم إرسالها إلى جميع الطلاب.")
+                # وضع الرسائل في الطابور دفعات؛ المُرسِل يرسلها في الخلفية ويحدّث العدادات
+                queued = enqueue_broadcast(message)
+                # إعلام المشرف بنجاح عملية وضع الرسالة في الطابور
+                self.message_user(request, f"الرسالة '{message.title}' وُضعت في طابور الإرسال لـ {queued} ولي أمر.")
             elif message.sent_at: # إذا كانت الرسالة قد أُرسلت مسبقًا
                 # إعلام المشرف بأن الرسالة قد أُرسلت بالفعل
                 self.message_user(request, f"الرسالة '{message.title}' قد تم إرسالها مسبقًا.", messages.WARNING)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class StudentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'students'
+
+    def ready(self):
+        # تسجيل إشارات تحديث الفهرس وإعدادات Basics داخل الذاكرة
+        from . import barcode_index, settings_provider  # noqa: F401
+        # كتابة حالات فشل الإرسال المتراكمة في نهاية كل طلب
+        from .utils import failed_numbers_manager  # noqa: F401
@@ -0,0 +1,138 @@
+# students/barcode_allocator.py
+"""
+توزيع أرقام الباركود دون تكرار ودون حلقة تخمين عشوائي.
+
+مساحة الأرقام ذات الطول L هي [10^(L-1), 10^L). الموضع i في العداد يُحوَّل
+إلى الباركود low + (multiplier * i + offset) mod N حيث gcd(multiplier, N) = 1،
+وهذا تبديل كامل للمساحة: كل موضع يعطي رقماً مختلفاً.
+
+حجز n رقماً = تحديث واحد للعداد (next_index += n) داخل معاملة، وقاعدة البيانات
+تضمن ألا يحصل طلبان متزامنان على نفس المواضع. الأرقام المأخوذة مسبقاً (من
+التوليد العشوائي القديم أو الاستيراد) تُستبعد باستعلام واحد ويُحجز بدلاً منها.
+
+BARCODE_LENGTH في الإعدادات يحدد طول الأرقام الجديدة (5 افتراضياً)، ويمكن
+رفعه إلى 6 أو أكثر عند امتلاء المساحة.
+"""
+import math
+import secrets
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+
+from .models import BarcodeAllocator, Students
+
+DEFAULT_BARCODE_LENGTH = 5
+MAX_BARCODE_LENGTH = 12
+
+
+class BarcodeSpaceExhausted(Exception):
+    """لم يتبقَّ أرقام كافية بهذا الطول؛ ارفع BARCODE_LENGTH."""
+
+
+def barcode_length(length=None):
+    length = length or getattr(settings, 'BARCODE_LENGTH', DEFAULT_BARCODE_LENGTH)
+    if not 1 <= length <= MAX_BARCODE_LENGTH:
+        raise ValueError(f"BARCODE_LENGTH must be between 1 and {MAX_BARCODE_LENGTH}")
+    return length
+
+
+def _space(length):
+    low = 10 ** (length - 1)
+    return low, 10 ** length - low
+
+
+def _get_allocator(length):
+    allocator = BarcodeAllocator.objects.filter(length=length).first()
+    if allocator is not None:
+        return allocator
+    _, size = _space(length)
+    multiplier = secrets.randbelow(size - 1) + 1
+    while math.gcd(multiplier, size) != 1:
+        multiplier = secrets.randbelow(size - 1) + 1
+    try:
+        with transaction.atomic():
+            return BarcodeAllocator.objects.create(
+                length=length, multiplier=multiplier, offset=secrets.randbelow(size)
+            )
+    except IntegrityError:
+        # أنشأه طلب متزامن
+        return BarcodeAllocator.objects.get(length=length)
+
+
+def _code_at(allocator, index):
+    low, size = _space(allocator.length)
+    return str(low + (allocator.multiplier * index + allocator.offset) % size)
+
+
+def _index_of(allocator, code):
+    low, size = _space(allocator.length)
+    inverse = pow(allocator.multiplier, -1, size)
+    return ((int(code) - low - allocator.offset) * inverse) % size
+
+
+def _reserve(length, count):
+    """يحجز count موضعاً متتالياً ويعيد (allocator, start)."""
+    allocator = _get_allocator(length)
+    _, size = _space(length)
+    with transaction.atomic():
+        BarcodeAllocator.objects.filter(pk=allocator.pk).update(next_index=F('next_index') + count)
+        end = BarcodeAllocator.objects.filter(pk=allocator.pk).values_list('next_index', flat=True).get()
+        if end > size:
+            # الخروج بخطأ يلغي زيادة العداد
+            raise BarcodeSpaceExhausted(
+                f"No {length}-digit barcodes left; raise BARCODE_LENGTH to use longer codes."
+            )
+    return allocator, end - count
+
+
+def allocate_barcodes(count, length=None):
+    """
+    يحجز count رقم باركود جديداً وفريداً ويعيدها كقائمة نصوص.
+    يكلف عادةً تحديثاً واحداً للعداد واستعلاماً واحداً لاستبعاد الأرقام المأخوذة.
+    """
+    if count <= 0:
+        return []
+    length = barcode_length(length)
+    codes = []
+    while len(codes) < count:
+        needed = count - len(codes)
+        allocator, start = _reserve(length, needed)
+        candidates = [_code_at(allocator, index) for index in range(start, start + needed)]
+        taken = set(Students.objects.filter(barcode__in=candidates).values_list('barcode', flat=True))
+        codes.extend(code for code in candidates if code not in taken)
+    return codes
+
+
+def assign_barcodes(students, length=None):
+    """يملأ الباركود الفارغ لقائمة طلاب (قبل bulk_create مثلاً) بحجز واحد."""
+    missing = [student for student in students if not student.barcode]
+    for student, code in zip(missing, allocate_barcodes(len(missing), length)):
+        student.barcode = code
+    return missing
+
+
+def barcode_capacity(length=None):
+    """
+    تقرير عن مساحة الأرقام: الإجمالي، المحجوز عبر العداد، المستخدم فعلاً،
+    والمتبقي الذي يمكن توزيعه (بعد استبعاد الأرقام القديمة التي تقع أمام العداد).
+    """
+    length = barcode_length(length)
+    _, size = _space(length)
+    allocator = _get_allocator(length)
+    existing = list(
+        Students.objects.annotate(code_length=Length('barcode'))
+        .filter(code_length=length, barcode__regex=r'^[0-9]+$')
+        .values_list('barcode', flat=True)
+    )
+    ahead = sum(1 for code in existing if _index_of(allocator, code) >= allocator.next_index)
+    remaining = max(size - allocator.next_index - ahead, 0)
+    return {
+        'length': length,
+        'total': size,
+        'allocated': min(allocator.next_index, size),
+        'in_use': len(existing),
+        'remaining': remaining,
+        'used_ratio': (size - remaining) / size,
+    }
@@ -0,0 +1,200 @@
+# students/barcode_index.py
+"""
+فهرس ذاكرة داخل العملية لمسار مسح الباركود.
+
+- barcode -> Students: يُحمَّل باستعلام واحد ويُحدَّث عبر إشارات post_save/post_delete.
+- مجموعة "تم تسجيله اليوم": أرقام الطلاب الذين لهم سجل حضور/غياب في اليوم الحالي.
+- مجموعة "دفع هذا الشهر": أرقام الطلاب الذين لهم Payment للشهر الحالي.
+
+الفهرس خاص بكل عملية (process). الإشارات تصل فقط للعملية التي كتبت البيانات،
+لذلك يُعاد تحميل الطلاب والمجموعتين بعد BARCODE_INDEX_TTL ثانية (تعديل أو حذف من
+عامل آخر أو لوحة الإدارة يظهر خلال هذه المدة)، وأي باركود غير موجود في الفهرس
+يُبحث عنه في قاعدة البيانات ثم يُضاف.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Students, Attendance, Payment
+
+_lock = threading.RLock()
+
+_students_by_barcode = {}   # barcode -> Students
+_barcode_by_id = {}         # student_id -> barcode (لاكتشاف تغيير الباركود)
+_warmed = False
+_warmed_at = 0.0
+
+# {'key': date, 'ids': set(), 'loaded_at': float}
+_scanned = {'key': None, 'ids': set(), 'loaded_at': 0.0}
+_paid = {'key': None, 'ids': set(), 'loaded_at': 0.0}
+
+
+def _ttl():
+    return getattr(settings, 'BARCODE_INDEX_TTL', 60)
+
+
+def warm():
+    """يحمّل جميع الطلاب في الفهرس باستعلام واحد."""
+    global _warmed, _warmed_at
+    students = list(Students.objects.all())
+    with _lock:
+        _students_by_barcode.clear()
+        _barcode_by_id.clear()
+        for student in students:
+            _put(student)
+        _warmed = True
+        _warmed_at = time.monotonic()
+
+
+def ensure_warm():
+    """يحمّل الفهرس إن لم يكن محمّلاً أو انتهت مدته (تستدعيه صفحة المسح قبل بدء الطابور)."""
+    if not _warmed or time.monotonic() - _warmed_at >= _ttl():
+        warm()
+
+
+def clear():
+    """يفرّغ الفهرس والمجموعتين (يُستخدم في الاختبارات أو بعد استيراد جماعي)."""
+    global _warmed
+    with _lock:
+        _students_by_barcode.clear()
+        _barcode_by_id.clear()
+        _warmed = False
+        for entry in (_scanned, _paid):
+            entry['key'] = None
+            entry['ids'] = set()
+            entry['loaded_at'] = 0.0
+
+
+def _put(student):
+    old_barcode = _barcode_by_id.get(student.id)
+    if old_barcode and old_barcode != student.barcode:
+        _students_by_barcode.pop(old_barcode, None)
+    if student.barcode:
+        _students_by_barcode[student.barcode] = student
+        _barcode_by_id[student.id] = student.barcode
+
+
+def _drop(student_id):
+    barcode = _barcode_by_id.pop(student_id, None)
+    if barcode:
+        _students_by_barcode.pop(barcode, None)
+
+
+def forget(student_id):
+    """يحذف طالباً من الفهرس (حُذف من عملية أخرى ولم تصل إشارته لهذه العملية)."""
+    with _lock:
+        _drop(student_id)
+        _scanned['ids'].discard(student_id)
+        _paid['ids'].discard(student_id)
+
+
+def is_gone(student_id):
+    """
+    بعد فشل كتابة لطالب من الفهرس: هل حُذف من عملية أخرى (عامل آخر أو لوحة الإدارة)؟
+    إن كان محذوفاً يُزال من الفهرس.
+    """
+    if Students.objects.filter(pk=student_id).exists():
+        return False
+    forget(student_id)
+    return True
+
+
+def get_student(barcode):
+    """
+    يعيد الطالب صاحب الباركود أو None.
+    لا يلمس قاعدة البيانات إلا عند أول استخدام أو عند عدم وجود الباركود في الفهرس.
+    """
+    ensure_warm()
+    with _lock:
+        student = _students_by_barcode.get(barcode)
+    if student is not None:
+        return student
+    # قد يكون الطالب أُضيف من عملية أخرى
+    student = Students.objects.filter(barcode=barcode).first()
+    if student is not None:
+        with _lock:
+            _put(student)
+    return student
+
+
+def _ids_for(entry, key, loader):
+    with _lock:
+        fresh = entry['key'] == key and time.monotonic() - entry['loaded_at'] < _ttl()
+        if fresh:
+            return entry['ids']
+    ids = set(loader(key))
+    with _lock:
+        entry['key'] = key
+        entry['ids'] = ids
+        entry['loaded_at'] = time.monotonic()
+    return ids
+
+
+def _load_scanned(day):
+    return Attendance.objects.filter(attendance_date=day).values_list('student_id', flat=True)
+
+
+def _load_paid(month_start):
+    return Payment.objects.filter(month=month_start).values_list('student_id', flat=True)
+
+
+def is_scanned(student_id, day):
+    """هل للطالب سجل (حضور أو غياب) في اليوم المحدد؟"""
+    return student_id in _ids_for(_scanned, day, _load_scanned)
+
+
+def has_paid(student_id, month_start):
+    """هل دفع الطالب اشتراك الشهر الذي يبدأ في month_start؟"""
+    return student_id in _ids_for(_paid, month_start, _load_paid)
+
+
+def mark_scanned(student_ids, day):
+    """يضيف الطلاب لمجموعة اليوم (للكتابات الجماعية التي لا تطلق إشارات مثل bulk_create)."""
+    with _lock:
+        if _scanned['key'] == day:
+            _scanned['ids'].update(student_ids)
+
+
+# ---------------------------------------------------------------------------
+# الإشارات
+# ---------------------------------------------------------------------------
+
+@receiver(post_save, sender=Students)
+def _student_saved(sender, instance, **kwargs):
+    with _lock:
+        if _warmed:
+            _put(instance)
+
+
+@receiver(post_delete, sender=Students)
+def _student_deleted(sender, instance, **kwargs):
+    forget(instance.id)
+
+
+@receiver(post_save, sender=Attendance)
+def _attendance_saved(sender, instance, **kwargs):
+    mark_scanned([instance.student_id], instance.attendance_date)
+
+
+@receiver(post_delete, sender=Attendance)
+def _attendance_deleted(sender, instance, **kwargs):
+    with _lock:
+        if _scanned['key'] == instance.attendance_date:
+            _scanned['ids'].discard(instance.student_id)
+
+
+@receiver(post_save, sender=Payment)
+def _payment_saved(sender, instance, **kwargs):
+    with _lock:
+        if _paid['key'] == instance.month:
+            _paid['ids'].add(instance.student_id)
+
+
+@receiver(post_delete, sender=Payment)
+def _payment_deleted(sender, instance, **kwargs):
+    with _lock:
+        if _paid['key'] == instance.month:
+            _paid['ids'].discard(instance.student_id)
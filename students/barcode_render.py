@@ -0,0 +1,24 @@
+# students/barcode_render.py
+"""
+رسم صور الباركود (Code128 / PNG) دون أي اعتماد على Django.
+
+منفصل عن students.utils حتى تستطيع عمليات ProcessPoolExecutor استيراده
+(حتى في وضع spawn على Windows) دون تحميل النماذج أو تهيئة المشروع.
+"""
+import json
+from io import BytesIO
+
+import barcode
+from barcode.writer import ImageWriter
+
+# الباركود أبيض وأسود فقط: تدرج الرمادي يقلل حجم الصورة الخام إلى الثلث
+# (مهم عند تضمين آلاف الصور في PDF لأن ReportLab يعيد ضغط البيانات الخام)
+IMAGE_MODE = 'L'
+
+
+def render_png(barcode_number, options_json='{}'):
+    """يعيد بايتات PNG لقيمة الباركود بخيارات الرسم المعطاة (JSON)."""
+    buffer = BytesIO()
+    code128 = barcode.get('code128', str(barcode_number), writer=ImageWriter(mode=IMAGE_MODE))
+    code128.write(buffer, json.loads(options_json))
+    return buffer.getvalue()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from students.barcode_allocator import barcode_capacity
+
+
+class Command(BaseCommand):
+    help = "يعرض السعة المتبقية في مساحة أرقام الباركود (5 أرقام افتراضياً)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--length', type=int, default=None, help='طول الباركود (الافتراضي BARCODE_LENGTH)')
+        parser.add_argument('--warn-at', type=float, default=0.8, help='نسبة الاستخدام التي يظهر عندها تحذير')
+
+    def handle(self, *args, **options):
+        report = barcode_capacity(options['length'])
+        self.stdout.write(f"length      {report['length']} digits")
+        self.stdout.write(f"total       {report['total']:,}")
+        self.stdout.write(f"allocated   {report['allocated']:,}")
+        self.stdout.write(f"in use      {report['in_use']:,}")
+        self.stdout.write(f"remaining   {report['remaining']:,}  ({report['used_ratio']:.1%} used)")
+        if report['used_ratio'] >= options['warn_at']:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ المساحة تقترب من الامتلاء؛ اضبط BARCODE_LENGTH = {report['length'] + 1} لاستخدام أرقام أطول."
+            ))
@@ -0,0 +1,79 @@
+import time
+
+import tablib
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from import_export.instance_loaders import ModelInstanceLoader
+
+from students import barcode_index
+from students.models import Students
+from students.resources import StudentsResource
+
+
+class RowByRowStudentsResource(StudentsResource):
+    """الطريقة القديمة: تحميل وحفظ كل صف على حدة (للمقارنة فقط)."""
+
+    class Meta(StudentsResource.Meta):
+        instance_loader_class = ModelInstanceLoader
+        use_bulk = False
+
+    def before_import(self, dataset, **kwargs):
+        self._barcode_pool = []
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "يقيس سرعة استيراد الطلاب (صف/ثانية) بالطريقة الجماعية مقارنة بالاستيراد صفاً صفاً، "
+        "للمعاينة (dry run) والاستيراد الفعلي. تعمل داخل معاملة يتم التراجع عنها."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--existing', type=float, default=0.5,
+                            help='نسبة الصفوف التي تعدّل طلاباً موجودين')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['rows'], options['existing'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+        barcode_index.clear()
+
+    def _dataset(self, rows, existing_ratio):
+        n_existing = int(rows * existing_ratio)
+        existing = Students.objects.bulk_create([
+            Students(name=f"bench {i}", father_phone="01000000000", barcode=f"B{i:07d}")
+            for i in range(n_existing)
+        ])
+        headers = ['id', 'name', 'father_phone', 'barcode', 'free_tries', 'آخر إعادة تعيين']
+        data = [
+            (s.id, f"bench {i} updated", "01000000000", s.barcode, 3, '')
+            for i, s in enumerate(existing)
+        ]
+        data += [
+            ('', f"new {i}", "01000000001", '', 3, '')
+            for i in range(rows - n_existing)
+        ]
+        return tablib.Dataset(*data, headers=headers)
+
+    def _run(self, rows, existing_ratio):
+        dataset = self._dataset(rows, existing_ratio)
+        self.stdout.write(f"{rows:,} rows ({existing_ratio:.0%} updates)")
+        for label, resource_class in (('row-by-row', RowByRowStudentsResource), ('bulk', StudentsResource)):
+            for dry_run in (True, False):
+                sid = transaction.savepoint()
+                started = time.perf_counter()
+                result = resource_class().import_data(dataset, dry_run=dry_run, raise_errors=True)
+                elapsed = time.perf_counter() - started
+                transaction.savepoint_rollback(sid)
+                mode = 'dry run' if dry_run else 'import'
+                self.stdout.write(
+                    f"{label:<11} {mode:<8} {elapsed:>7.2f}s  {rows / elapsed:>9,.0f} rows/s  "
+                    f"(new {result.totals['new']}, updated {result.totals['update']})"
+                )
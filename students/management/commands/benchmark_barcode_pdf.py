@@ -0,0 +1,60 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from students.models import Students
+from students.utils.barcode_utils import _render
+from students.utils.pdf_generator import PDF_MODE_RASTER, PDF_MODE_VECTOR, generate_barcodes_pdf
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "يقارن حجم ملف PDF ووقت توليده بين الرسم المتجه وصور PNG. "
+        "تعمل داخل معاملة يتم التراجع عنها، وصور PNG تُحفظ في مجلد مؤقت."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', type=int, nargs='+', default=[500, 5000])
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'students':>9} {'mode':<13} {'time':>9} {'size':>12}")
+        for count in options['counts']:
+            try:
+                with transaction.atomic():
+                    self._run(count, options['workers'])
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+    def _run(self, count, workers):
+        taken = set(Students.objects.values_list('barcode', flat=True))
+        codes = (str(code) for code in range(10000, 100000) if str(code) not in taken)
+        students = Students.objects.bulk_create([
+            Students(name=f"bench {i}", father_phone="01000000000", barcode=code)
+            for i, code in zip(range(count), codes)
+        ])
+        queryset = Students.objects.filter(id__in=[s.id for s in students])
+
+        runs = (
+            (PDF_MODE_VECTOR, 'vector'),
+            (PDF_MODE_RASTER, 'raster cold'),
+            (PDF_MODE_RASTER, 'raster warm'),
+        )
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            _render.cache_clear()
+            for mode, label in runs:
+                started = time.perf_counter()
+                pdf = generate_barcodes_pdf(queryset, workers=workers, mode=mode)
+                elapsed = time.perf_counter() - started
+                size = os.fstat(pdf.fileno()).st_size
+                pdf.close()
+                self.stdout.write(f"{count:>9,} {label:<13} {elapsed:>8.2f}s {size / 1024:>9,.0f} KB")
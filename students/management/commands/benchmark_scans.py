@@ -0,0 +1,79 @@
+import random
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from students import barcode_index
+from students.models import Students, Attendance, Payment, Basics
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "يقيس عدد عمليات المسح في الثانية لقرار المسح (باركود مكرر / غير مدفوع) "
+        "قبل الفهرس وبعده. تعمل داخل معاملة يتم التراجع عنها فلا تُغيّر البيانات."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=2000)
+        parser.add_argument('--scans', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['students'], options['scans'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+        barcode_index.clear()
+
+    def _run(self, n_students, n_scans):
+        today = timezone.localdate()
+        month_start = date(today.year, today.month, 1)
+        taken = set(Students.objects.values_list('barcode', flat=True))
+        free_codes = [str(code) for code in range(10000, 100000) if str(code) not in taken][:n_students]
+
+        students = Students.objects.bulk_create([
+            Students(name=f"bench {i}", father_phone="01000000000", barcode=code)
+            for i, code in enumerate(free_codes)
+        ])
+        # نصف الطلاب حضروا اليوم (مسح مكرر)، والنصف الآخر لم يدفع (مسح غير مدفوع)
+        Attendance.objects.bulk_create([
+            Attendance(student=s, attendance_date=today) for s in students[::2]
+        ])
+        barcodes = [s.barcode for s in students]
+        scans = [random.choice(barcodes) for _ in range(n_scans)]
+
+        def legacy(barcode):
+            student = Students.objects.get(barcode=barcode)
+            if Attendance.objects.filter(student=student, attendance_date=today).exists():
+                return 'duplicate'
+            Payment.objects.filter(student=student, month=month_start).exists()
+            Basics.objects.first()
+            return 'unpaid'
+
+        def indexed(barcode):
+            student = barcode_index.get_student(barcode)
+            if barcode_index.is_scanned(student.id, today):
+                return 'duplicate'
+            barcode_index.has_paid(student.id, month_start)
+            return 'unpaid'
+
+        results = {}
+        for label, decide in (('before (ORM)', legacy), ('after (index)', indexed)):
+            barcode_index.clear()
+            started = time.perf_counter()
+            for barcode in scans:
+                decide(barcode)
+            elapsed = time.perf_counter() - started
+            results[label] = n_scans / elapsed
+            self.stdout.write(f"{label:<15} {results[label]:>12,.0f} scans/s  ({elapsed:.3f}s)")
+
+        speedup = results['after (index)'] / results['before (ORM)']
+        self.stdout.write(self.style.SUCCESS(f"speedup: x{speedup:,.1f}"))
@@ -0,0 +1,64 @@
+import logging
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from students.utils.whatsapp_mock import mock_url, serve_mock_whatsapp
+from students.utils.whatsapp_Sel import SEND_MODE_IN_APP, SEND_MODE_RELOAD, SEND_MODES, WhatsAppSession
+
+
+class Command(BaseCommand):
+    help = (
+        "يقيس زمن إرسال الرسالة الواحدة عبر Selenium على نسخة محلية وهمية من WhatsApp Web: "
+        "إعادة تحميل الصفحة لكل رسالة (reload) مقابل فتح المحادثة داخل التطبيق (in_app). "
+        "يحتاج Chrome، ويستخدم ملف تعريف مؤقت ولا يرسل شيئاً حقيقياً."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10)
+        parser.add_argument('--boot-ms', type=int, default=3000, help='زمن تحميل التطبيق في الصفحة الوهمية')
+        parser.add_argument('--chat-ms', type=int, default=150, help='زمن فتح المحادثة')
+        parser.add_argument('--ack-ms', type=int, default=300, help='زمن تأكيد الإرسال')
+        parser.add_argument('--modes', nargs='+', choices=SEND_MODES, default=[SEND_MODE_RELOAD, SEND_MODE_IN_APP])
+        parser.add_argument('--show-browser', action='store_true')
+
+    def handle(self, *args, **options):
+        server = serve_mock_whatsapp(options['boot_ms'], options['chat_ms'], options['ack_ms'])
+        # رسائل الإرسال العادية لا تُكتب في whatsapp_service.log أثناء القياس
+        logging.disable(logging.INFO)
+        try:
+            self.stdout.write(f"{'mode':<8} {'messages':>8} {'mean':>9} {'p50':>9} {'max':>9}")
+            for mode in options['modes']:
+                durations = self._run(mode, mock_url(server), options)
+                self.stdout.write(
+                    f"{mode:<8} {len(durations):>8} {statistics.mean(durations) * 1000:>7.0f}ms "
+                    f"{statistics.median(durations) * 1000:>7.0f}ms {max(durations) * 1000:>7.0f}ms"
+                )
+        finally:
+            logging.disable(logging.NOTSET)
+            server.shutdown()
+            server.server_close()
+
+    def _run(self, mode, url, options):
+        with tempfile.TemporaryDirectory() as profile:
+            session = WhatsAppSession(
+                profile_dir=profile,
+                send_mode=mode,
+                base_url=url,
+                headless=not options['show_browser'],
+                post_send_timeout=5,
+            )
+            try:
+                if session.get_driver() is None:
+                    raise CommandError("تعذر تشغيل Chrome/Selenium.")
+                durations = []
+                for index in range(options['messages']):
+                    started = time.perf_counter()
+                    if not session.send("01000000000", f"benchmark {index}"):
+                        raise CommandError(f"فشل الإرسال في وضع {mode}.")
+                    durations.append(time.perf_counter() - started)
+                return durations
+            finally:
+                session.close()
@@ -0,0 +1,90 @@
+from datetime import time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from students import barcode_index, util, views
+from students.models import Students
+from students.utils import failed_numbers_manager
+
+
+# استعلامات تمر على كل الطلاب عمداً (الصف كاملاً)؛ المطلوب فيها أن يبحث الاستعلام الفرعي بفهرس
+WHOLE_TABLE_READS = {
+    'daily summary': 'students_students',
+    'unmarked students': 'students_students',
+}
+
+
+def hot_queries():
+    """
+    الاستعلامات المتكررة كما تبنيها الدوال نفسها في util.py و views.py و barcode_index
+    والأرقام الفاشلة، بقيم تجريبية (خطة التنفيذ لا تعتمد على القيم).
+    """
+    today = timezone.localdate()
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    student = Students(pk=1)
+    phones = ['01000000000', '+201000000000']
+    return [
+        ('daily summary', util._students_with_day_status(today).order_by('id')),
+        ('scanned today', barcode_index._load_scanned(today)),
+        ('unmarked students', util._unmarked_students(today)),
+        ('absence streaks', util._absence_streaks(today)),
+        ('daily stats rebuild', util._daily_status_counts(month_start, month_end)),
+        ('daily late arrivals', util._daily_late_counts(month_start, month_end, time(9, 0))),
+        ('monthly attendance rate', util._student_attendance_between(
+            student, month_start, month_end).filter(is_absent=False)),
+        ('paid this month', barcode_index._load_paid(month_start)),
+        ('latest payments', util._latest_payments([student.pk])),
+        ('payment history', util.get_student_payment_history(student)),
+        ('income page', views._income_payments()[:views.INCOME_PAGE_SIZE + 1]),
+        ('income page for month', views._income_payments(
+            today.year, today.month)[:views.INCOME_PAGE_SIZE + 1]),
+        ('income page for year', views._income_payments(today.year)[:views.INCOME_PAGE_SIZE + 1]),
+        ('students by phone', failed_numbers_manager._students_by_phone(phones, ('id', 'name'))),
+        ('failures by phone', failed_numbers_manager._failures_for(phones[0], '-')),
+    ]
+
+
+def explain(queryset):
+    """أسطر EXPLAIN QUERY PLAN لاستعلام (SQLite)."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """الأسطر التي تقرأ جدولاً كاملاً دون فهرس ("SCAN t" وليس "SCAN t USING INDEX")."""
+    return [line for line in plan if line.startswith('SCAN ') and 'INDEX' not in line]
+
+
+class Command(BaseCommand):
+    help = (
+        "يعرض خطة التنفيذ (EXPLAIN QUERY PLAN) لكل استعلام متكرر ويفشل إذا قرأ أي منها "
+        "جدولاً كاملاً بدون فهرس. يعمل على SQLite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='عرض خطة كل استعلام كاملة')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("check_query_plans يدعم SQLite فقط.")
+
+        failures = []
+        for label, queryset in hot_queries():
+            plan = explain(queryset)
+            scans = [line for line in full_scans(plan) if line != f"SCAN {WHOLE_TABLE_READS.get(label)}"]
+            status = self.style.ERROR('FULL SCAN') if scans else self.style.SUCCESS('ok')
+            self.stdout.write(f"{label:<28} {status}")
+            if scans or options['verbose_plans']:
+                for line in plan:
+                    self.stdout.write(f"    {line}")
+            if scans:
+                failures.append(label)
+
+        if failures:
+            raise CommandError(f"full table scan in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("all hot queries use an index"))
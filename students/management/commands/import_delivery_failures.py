@@ -0,0 +1,162 @@
+import csv
+import json
+import os
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from students.models import DeliveryFailure, Students
+from students.utils.failed_numbers_manager import FAILED_NUMBERS_FILE, classify_failure
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# سطر من whatsapp_queue: الطالب ونوع الرسالة (يطابق صف CSV بنفس الثانية)
+STUDENT_LINE = re.compile(
+    r'^(?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d+ - \w+ - Student ID: (?P<student_id>.*?) '
+    r'\(Name: (?P<name>.*?)\) - Message Type: (?P<type>.*?) - Reason: (?P<reason>.*)$'
+)
+# سطر من whatsapp_Sel: فشل محاولة الإرسال عبر المتصفح
+PHONE_LINE = re.compile(
+    r'^(?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d+ - \w+ - Phone: (?P<phone>\S*) - '
+    r'Message Type: (?P<type>.*?) - Reason: (?P<reason>.*?) - Details: (?P<details>.*)$'
+)
+BATCH_SIZE = 500
+
+
+def _parse_time(value):
+    value = (value or '').strip()[:19]
+    try:
+        return timezone.make_aware(datetime.strptime(value, TIMESTAMP_FORMAT))
+    except ValueError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "استيراد لمرة واحدة لسجلات فشل الإرسال القديمة إلى جدول DeliveryFailure: "
+        "failed_whatsapp_deliveries.csv و failed_whatsapp_numbers.json و whatsapp_delivery_issues.log. "
+        "السجلات الموجودة مسبقاً (نفس الرقم والنوع والوقت) لا تُكرر."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', default=os.path.join(settings.BASE_DIR, 'students', 'failed_whatsapp_deliveries.csv'))
+        parser.add_argument('--json', default=FAILED_NUMBERS_FILE)
+        parser.add_argument('--log', default=os.path.join(settings.BASE_DIR, 'whatsapp_delivery_issues.log'))
+        parser.add_argument('--dry-run', action='store_true', help='عرض الأعداد فقط دون كتابة')
+
+    def handle(self, *args, **options):
+        students = self._log_students(options['log'])
+        sources = [
+            ('csv', self._from_csv(options['csv'], students)),
+            ('json', self._from_json(options['json'])),
+            ('log', self._from_log(options['log'])),
+        ]
+        existing = {
+            (phone, message_type, created_at.replace(microsecond=0))
+            for phone, message_type, created_at in DeliveryFailure.objects.values_list(
+                'phone', 'message_type', 'created_at'
+            )
+        }
+        valid_students = set(Students.objects.values_list('id', flat=True))
+
+        total = 0
+        for label, failures in sources:
+            batch, imported, skipped = [], 0, 0
+            for failure in failures:
+                key = (failure.phone, failure.message_type, failure.created_at)
+                if key in existing:
+                    skipped += 1
+                    continue
+                existing.add(key)
+                if failure.student_id not in valid_students:
+                    failure.student_id = None
+                batch.append(failure)
+                if len(batch) >= BATCH_SIZE:
+                    imported += self._save(batch, options['dry_run'])
+                    batch = []
+            imported += self._save(batch, options['dry_run'])
+            total += imported
+            self.stdout.write(f"{label:<5} imported {imported:,}, skipped {skipped:,} duplicates")
+        verb = "would import" if options['dry_run'] else "imported"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total:,} delivery failures"))
+
+    def _save(self, batch, dry_run):
+        if batch and not dry_run:
+            DeliveryFailure.objects.bulk_create(batch)
+        return len(batch)
+
+    def _log_students(self, path):
+        """(الوقت، نوع الرسالة) -> (رقم الطالب، الاسم) من أسطر whatsapp_queue في السجل."""
+        students = {}
+        if not os.path.exists(path):
+            return students
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = STUDENT_LINE.match(line.rstrip('\n'))
+                if match and match['name'] != '-':
+                    student_id = int(match['student_id']) if match['student_id'].isdigit() else None
+                    students[(match['ts'], match['type'])] = (student_id, match['name'])
+        return students
+
+    def _from_csv(self, path, students):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                created_at = _parse_time(row.get('timestamp'))
+                if created_at is None:
+                    continue
+                phone = row.get('phone') or ''
+                reason = row.get('reason') or ''
+                student_id, name = students.get((row['timestamp'].strip(), row.get('message_type')), (None, ''))
+                yield DeliveryFailure(
+                    phone=phone,
+                    student_id=student_id,
+                    student_name=name[:100],
+                    message_type=(row.get('message_type') or '')[:50],
+                    error_type=classify_failure(phone, reason, row.get('details') or ''),
+                    reason=reason[:255],
+                    details=row.get('details') or '',
+                    created_at=created_at,
+                )
+
+    def _from_json(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            records = json.load(f)
+        error_types = dict(DeliveryFailure.ERROR_TYPE_CHOICES)
+        for record in records:
+            created_at = _parse_time(record.get('last_attempt') or record.get('timestamp'))
+            if created_at is None:
+                continue
+            phone = record.get('phone') or ''
+            message = record.get('error_message') or ''
+            error_type = record.get('error_type')
+            yield DeliveryFailure(
+                phone=phone,
+                student_name=(record.get('student_name') or '')[:100],
+                message_type=(record.get('message_type') or '')[:50],
+                error_type=error_type if error_type in error_types else classify_failure(phone, message),
+                reason=message[:255],
+                created_at=created_at,
+            )
+
+    def _from_log(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = PHONE_LINE.match(line.rstrip('\n'))
+                if not match:
+                    continue
+                yield DeliveryFailure(
+                    phone=match['phone'],
+                    message_type=match['type'][:50],
+                    error_type=classify_failure(match['phone'], match['reason'], match['details']),
+                    reason=match['reason'][:255],
+                    details=match['details'],
+                    created_at=_parse_time(match['ts']),
+                )
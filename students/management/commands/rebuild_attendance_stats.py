@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min, Max
+
+from students.models import Attendance, DailyAttendanceStats
+from students.util import rebuild_daily_attendance_stats
+
+
+class Command(BaseCommand):
+    help = "يعيد بناء جدول DailyAttendanceStats من سجلات الحضور (كل التاريخ افتراضياً)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='أول يوم (YYYY-MM-DD)')
+        parser.add_argument('--end', help='آخر يوم (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        bounds = Attendance.objects.aggregate(first=Min('attendance_date'), last=Max('attendance_date'))
+        try:
+            start = self._parse(options['start']) or bounds['first']
+            end = self._parse(options['end']) or bounds['last']
+        except ValueError:
+            raise CommandError("صيغة التاريخ غير صحيحة. استخدم YYYY-MM-DD.")
+        if start is None or end is None:
+            self.stdout.write("لا توجد سجلات حضور.")
+            return
+
+        with transaction.atomic():
+            # حذف أيام النطاق أولاً حتى لا تبقى أيام حُذفت سجلاتها
+            DailyAttendanceStats.objects.filter(date__gte=start, date__lte=end).delete()
+            written = rebuild_daily_attendance_stats(start, end)
+        self.stdout.write(self.style.SUCCESS(f"✅ تمت إعادة بناء {written} يوم من {start} إلى {end}."))
+
+    @staticmethod
+    def _parse(value):
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from students.utils import whatsapp_queue
+from students.utils.whatsapp_pool import run_sender_pool
+from students.utils.whatsapp_transports import build_session_transports, get_transport
+
+
+class Command(BaseCommand):
+    help = (
+        "يشغّل مُرسِل WhatsApp الذي يستهلك طابور OutboundMessage بالترتيب. "
+        "مع --sessions N يعمل N جلسة بالتوازي (ملف تعريف Chrome ورقم مرتبط لكل جلسة). "
+        "شغّل نسخة واحدة فقط من هذا الأمر."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', help='معرّف المُرسِل في عمود claimed_by (جلسة واحدة فقط)')
+        parser.add_argument('--drain', action='store_true', help='الخروج عند فراغ الطابور')
+        parser.add_argument('--sessions', type=int, default=None,
+                            help='عدد الجلسات المتوازية (الافتراضي WHATSAPP_SESSIONS)')
+
+    def handle(self, *args, **options):
+        sessions = options['sessions'] or getattr(settings, 'WHATSAPP_SESSIONS', 1)
+        self.stdout.write(f"📤 بدء مُرسِل WhatsApp ({sessions} جلسة) …")
+        try:
+            if sessions == 1:
+                whatsapp_queue._worker(
+                    worker_id=options['worker_id'], drain=options['drain'], transport=get_transport()
+                )
+            else:
+                run_sender_pool(build_session_transports(sessions), drain=options['drain'])
+        except KeyboardInterrupt:
+            self.stdout.write("⏹️ تم إيقاف المُرسِل.")
@@ -0,0 +1,178 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from students.models import Attendance, DailyAttendanceStats, DeliveryFailure, Students
+
+STRESS_MODELS = (Students, Attendance, DailyAttendanceStats, DeliveryFailure)
+
+
+class Command(BaseCommand):
+    help = (
+        "اختبار ضغط لـ SQLite: مسح باركود متوازٍ (كتابة) مع قراءة التقارير وتسجيل فشل الإرسال، "
+        "على ملف مؤقت بإعدادات SQLite الافتراضية ثم بإعدادات DATABASES['default'] "
+        "(WAL و IMMEDIATE). يعرض أخطاء \"database is locked\" والإنتاجية لكل منهما."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--scanners', type=int, default=4, help='عدد خيوط المسح (كتابة)')
+        parser.add_argument('--readers', type=int, default=4, help='عدد خيوط التقارير (قراءة)')
+        parser.add_argument('--students', type=int, default=2000)
+        parser.add_argument('--timeout', type=float, default=5,
+                            help='مهلة الانتظار بالثواني للإعداد الافتراضي (الإعداد المضبوط يستخدم مهلته)')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("stress_sqlite يعمل على SQLite فقط.")
+        tuned = dict(connections['default'].settings_dict['OPTIONS'])
+        profiles = [
+            ('default', {'timeout': options['timeout']}),
+            ('tuned', tuned),
+        ]
+        self.stdout.write(
+            f"{'profile':<8} {'scans/s':>9} {'reads/s':>9} {'logs/s':>8} {'locked':>7} {'p95 scan':>9}"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, db_options in profiles:
+                result = self._run(label, os.path.join(tmp, f"{label}.sqlite3"), db_options, options)
+                self.stdout.write(
+                    f"{label:<8} {result['scans'] / result['elapsed']:>9,.0f} "
+                    f"{result['reads'] / result['elapsed']:>9,.0f} {result['logs'] / result['elapsed']:>8,.0f} "
+                    f"{result['locked']:>7} {result['p95'] * 1000:>7.0f}ms"
+                )
+
+    def _run(self, label, path, db_options, options):
+        alias = f"stress_{label}"
+        settings_dict = dict(connections['default'].settings_dict)
+        settings_dict.update(NAME=path, OPTIONS=db_options)
+        connections.settings[alias] = settings_dict
+        try:
+            student_ids = self._setup(alias, options['students'])
+            return self._stress(alias, student_ids, options)
+        finally:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def _setup(self, alias, n_students):
+        with connections[alias].schema_editor() as editor:
+            for model in STRESS_MODELS:
+                editor.create_model(model)
+        Students.objects.using(alias).bulk_create([
+            Students(name=f"stress {i}", father_phone="01000000000", barcode=str(10000 + i))
+            for i in range(n_students)
+        ])
+        return list(Students.objects.using(alias).values_list('id', flat=True))
+
+    def _stress(self, alias, student_ids, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        totals = {'scans': 0, 'reads': 0, 'logs': 0, 'locked': 0}
+        scan_times = []
+        today = timezone.localdate()
+
+        def add(key, count=1):
+            with lock:
+                totals[key] += count
+
+        def scanner(ids):
+            # نفس خطوات تسجيل الحضور: تحقق من التكرار ثم سجل الحضور وحدّث الملخص اليومي في معاملة واحدة
+            days = iter(today - timedelta(days=n) for n in range(100000))
+            day = next(days)
+            random.shuffle(ids)
+            position = 0
+            while not stop.is_set():
+                if position == len(ids):
+                    day, position = next(days), 0
+                student_id = ids[position]
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic(using=alias):
+                        attendance = Attendance.objects.using(alias)
+                        if not attendance.filter(student_id=student_id, attendance_date=day).exists():
+                            attendance.create(student_id=student_id, attendance_date=day)
+                            updated = DailyAttendanceStats.objects.using(alias).filter(date=day).update(
+                                present=F('present') + 1
+                            )
+                            if not updated:
+                                DailyAttendanceStats.objects.using(alias).create(date=day, present=1)
+                except OperationalError:
+                    add('locked')
+                except IntegrityError:
+                    pass
+                else:
+                    position += 1
+                    add('scans')
+                    with lock:
+                        scan_times.append(time.perf_counter() - started)
+
+        def reader():
+            # ملخص اليوم (استعلام فرعي لكل طالب) والتجميع اليومي كما في لوحة التحكم والتقارير
+            while not stop.is_set():
+                try:
+                    Students.objects.using(alias).annotate(
+                        day_status=Subquery(
+                            Attendance.objects.using(alias).filter(
+                                student=OuterRef('pk'), attendance_date=today
+                            ).values('is_absent')[:1]
+                        )
+                    ).aggregate(present=Count('id', filter=Q(day_status=False)))
+                    list(
+                        Attendance.objects.using(alias).filter(
+                            attendance_date__gte=today - timedelta(days=31)
+                        ).values('attendance_date').annotate(total=Count('id'))
+                    )
+                except OperationalError:
+                    add('locked')
+                else:
+                    add('reads')
+
+        def logger():
+            # المُرسِل يكتب دفعات فشل الإرسال بالتوازي
+            while not stop.is_set():
+                try:
+                    DeliveryFailure.objects.using(alias).bulk_create([
+                        DeliveryFailure(phone="01000000000", message_type='Attendance', reason='stress')
+                        for _ in range(10)
+                    ])
+                except OperationalError:
+                    add('locked')
+                else:
+                    add('logs', 10)
+                time.sleep(0.05)
+
+        def run(target, *args):
+            try:
+                target(*args)
+            finally:
+                connections[alias].close()
+
+        threads = [
+            threading.Thread(target=run, args=(scanner, student_ids[index::options['scanners']]))
+            for index in range(options['scanners'])
+        ]
+        threads += [threading.Thread(target=run, args=(reader,)) for _ in range(options['readers'])]
+        threads.append(threading.Thread(target=run, args=(logger,)))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        scan_times.sort()
+        totals['elapsed'] = elapsed
+        totals['p95'] = scan_times[int(len(scan_times) * 0.95)] if scan_times else 0
+        return totals
@@ -0,0 +1,164 @@
+import logging
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from students.models import DeliveryFailure, OutboundMessage
+from students.utils import whatsapp_queue
+from students.utils.whatsapp_pool import run_sender_pool
+from students.utils.whatsapp_transports import FakeTransport, build_transport
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def _override(module, **attrs):
+    previous = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "يدفع عدداً كبيراً من الرسائل عبر _worker باستخدام وسيلة نقل وهمية "
+        "ويعرض معدل الإرسال وزمن p50/p99 وتكلفة معالجة الفشل. "
+        "مع جلسة واحدة يعمل داخل معاملة يتم التراجع عنها؛ مع --sessions أكثر من 1 "
+        "تُكتب الرسائل فعلياً ثم تُحذف في النهاية (يتطلب طابوراً فارغاً). "
+        "سجل الأخطاء يُكتب في مجلد مؤقت."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--latency', type=float, default=0.0, help='زمن الإرسال الوهمي بالثواني')
+        parser.add_argument('--jitter', type=float, default=0.0, help='تذبذب عشوائي إضافي بالثواني')
+        parser.add_argument('--failure-rate', type=float, default=0.0)
+        parser.add_argument('--interval', type=float, default=0.0, help='قيمة WHATSAPP_SEND_INTERVAL أثناء القياس')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--sessions', type=int, default=1, help='عدد الجلسات المتوازية')
+        parser.add_argument('--backend', default=None,
+                            help="استخدم وسيلة أخرى بدل الوهمية (مثل 'http' مع خادم وهمي)")
+
+    def _transports(self, options):
+        transports = []
+        for index in range(options['sessions']):
+            if options['backend']:
+                transports.append(build_transport(options['backend']))
+            else:
+                seed = None if options['seed'] is None else options['seed'] + index
+                transports.append(FakeTransport(
+                    latency=options['latency'],
+                    jitter=options['jitter'],
+                    failure_rate=options['failure_rate'],
+                    seed=seed,
+                ))
+        return transports
+
+    def handle(self, *args, **options):
+        transports = self._transports(options)
+        with tempfile.TemporaryDirectory() as tmp:
+            if len(transports) == 1:
+                try:
+                    with transaction.atomic():
+                        self._run(transports, options, tmp)
+                        raise _Rollback()
+                except _Rollback:
+                    pass
+                return
+
+            # الخيوط تستخدم اتصالات مستقلة فلا ترى معاملة غير مثبتة
+            busy = OutboundMessage.objects.filter(
+                status__in=[OutboundMessage.STATUS_PENDING, OutboundMessage.STATUS_SENDING]
+            ).exists()
+            if busy:
+                raise CommandError("الطابور يحتوي رسائل حقيقية؛ أفرغه قبل القياس بعدة جلسات.")
+            first_id = (OutboundMessage.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+            first_failure_id = (DeliveryFailure.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+            try:
+                self._run(transports, options, tmp)
+            finally:
+                OutboundMessage.objects.filter(id__gte=first_id, context__message_type='LoadTest').delete()
+                DeliveryFailure.objects.filter(id__gte=first_failure_id, message_type='LoadTest').delete()
+
+    def _run(self, transports, options, tmp):
+        total = options['messages']
+        durations = {True: [], False: []}
+        process_message = whatsapp_queue.process_message
+
+        def timed(message, transport=None):
+            started = time.perf_counter()
+            ok = process_message(message, transport)
+            durations[ok].append(time.perf_counter() - started)
+            return ok
+
+        issues_logger = logging.getLogger('whatsapp_loadtest')
+        issues_logger.propagate = False
+        handler = logging.FileHandler(os.path.join(tmp, 'issues.log'), encoding='utf-8')
+        issues_logger.addHandler(handler)
+
+        created = whatsapp_queue.queue_whatsapp_messages(
+            ("01000000000", f"load test {i}", {'message_type': 'LoadTest', 'student_id': i})
+            for i in range(total)
+        )
+        messages = OutboundMessage.objects.filter(id__gte=created[0].id) if created else OutboundMessage.objects.none()
+
+        try:
+            with _override(
+                whatsapp_queue,
+                process_message=timed,
+                SEND_INTERVAL_SECONDS=options['interval'],
+                RETRY_DELAY_SECONDS=0,
+                logger=issues_logger,
+            ):
+                started = time.perf_counter()
+                if len(transports) == 1:
+                    whatsapp_queue._worker(worker_id='loadtest', drain=True, transport=transports[0])
+                else:
+                    run_sender_pool(transports, drain=True)
+                elapsed = time.perf_counter() - started
+        finally:
+            issues_logger.removeHandler(handler)
+            handler.close()
+
+        sent = messages.filter(status=OutboundMessage.STATUS_SENT).count()
+        failed = messages.filter(status=OutboundMessage.STATUS_FAILED).count()
+        attempts = sum(len(d) for d in durations.values())
+        all_durations = durations[True] + durations[False]
+
+        transport = transports[0]
+        self.stdout.write(f"transport       {getattr(transport, 'name', type(transport).__name__)} x{len(transports)}")
+        self.stdout.write(f"messages        {total:,}  (sent {sent:,}, failed {failed:,}, attempts {attempts:,})")
+        self.stdout.write(f"elapsed         {elapsed:.2f}s")
+        self.stdout.write(f"throughput      {sent / elapsed if elapsed else 0:,.0f} msg/s delivered, "
+                          f"{attempts / elapsed if elapsed else 0:,.0f} attempts/s")
+        self.stdout.write(f"latency p50     {_percentile(all_durations, 50) * 1000:.2f} ms")
+        self.stdout.write(f"latency p99     {_percentile(all_durations, 99) * 1000:.2f} ms")
+        if durations[True] and durations[False]:
+            ok_mean = statistics.mean(durations[True])
+            fail_mean = statistics.mean(durations[False])
+            self.stdout.write(
+                f"failure cost    {fail_mean * 1000:.2f} ms/attempt vs {ok_mean * 1000:.2f} ms on success "
+                f"(x{fail_mean / ok_mean if ok_mean else 0:.1f}), "
+                f"{sum(durations[False]):.2f}s total spent on failures"
+            )
+        self.stdout.write(self.style.SUCCESS("done (load-test rows removed)"))
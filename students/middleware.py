@@ -0,0 +1,14 @@
+# students/middleware.py
+from .utils.failed_numbers_manager import flush_failures
+
+
+def flush_delivery_failures(get_response):
+    """
+    يكتب حالات فشل الإرسال المتراكمة أثناء الطلب قبل انتهائه، على اتصال الطلب نفسه.
+    (إشارة request_finished تأتي بعد إغلاق Django للاتصال، فكانت الكتابة تفتح اتصالاً لا يُغلق.)
+    """
+    def middleware(request):
+        response = get_response(request)
+        flush_failures()
+        return response
+    return middleware
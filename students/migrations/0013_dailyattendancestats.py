@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0012_students_has_whatsapp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='التاريخ')),
+                ('present', models.PositiveIntegerField(default=0, verbose_name='حاضر')),
+                ('absent', models.PositiveIntegerField(default=0, verbose_name='غائب')),
+                ('late', models.PositiveIntegerField(default=0, verbose_name='متأخر')),
+                ('unmarked', models.PositiveIntegerField(default=0, verbose_name='لم يُسجَّل')),
+            ],
+            options={
+                'verbose_name': 'إحصائية حضور يومية',
+                'verbose_name_plural': 'إحصائيات الحضور اليومية',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:29
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_amounts_and_revenue(apps, schema_editor):
+    # الدفعات القديمة لم تحفظ المبلغ؛ أفضل تقدير متاح هو سعر الشهر الحالي
+    Basics = apps.get_model('students', 'Basics')
+    Payment = apps.get_model('students', 'Payment')
+    MonthlyRevenue = apps.get_model('students', 'MonthlyRevenue')
+
+    basics = Basics.objects.order_by('id').first()
+    price = basics.month_price if basics and basics.month_price else 0
+    Payment.objects.update(amount=price)
+
+    MonthlyRevenue.objects.bulk_create([
+        MonthlyRevenue(month=row['month'], total_amount=row['total'] or 0, payments_count=row['count'])
+        for row in Payment.objects.order_by().values('month').annotate(total=Sum('amount'), count=Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0013_dailyattendancestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='الشهر')),
+                ('total_amount', models.BigIntegerField(default=0, verbose_name='إجمالي المبلغ')),
+                ('payments_count', models.PositiveIntegerField(default=0, verbose_name='عدد الدفعات')),
+            ],
+            options={
+                'verbose_name': 'إيراد شهري',
+                'verbose_name_plural': 'الإيرادات الشهرية',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='amount',
+            field=models.IntegerField(default=0, verbose_name='المبلغ المدفوع'),
+        ),
+        migrations.RunPython(backfill_amounts_and_revenue, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0014_payment_amount_monthlyrevenue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(blank=True, max_length=32, verbose_name='رقم الهاتف')),
+                ('text', models.TextField(verbose_name='نص الرسالة')),
+                ('status', models.CharField(choices=[('pending', 'في الانتظار'), ('sending', 'جاري الإرسال'), ('sent', 'تم الإرسال'), ('failed', 'فشل')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='عدد المحاولات')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='موعد المحاولة التالية')),
+                ('context', models.JSONField(blank=True, default=dict, verbose_name='سياق التسجيل')),
+                ('last_error', models.TextField(blank=True, verbose_name='آخر خطأ')),
+                ('claimed_by', models.CharField(blank=True, max_length=64, verbose_name='المُرسِل')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الحجز')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='وقت الإنشاء')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الإرسال')),
+            ],
+            options={
+                'verbose_name': 'رسالة صادرة',
+                'verbose_name_plural': 'الرسائل الصادرة',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at', 'id'], name='outbox_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0015_outboundmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='فشلت'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='queued_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='في الطابور'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='sent_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='تم إرسالها'),
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='broadcast',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='outbound_messages', to='students.broadcastmessage', verbose_name='الرسالة العامة'),
+        ),
+    ]
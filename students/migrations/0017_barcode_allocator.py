@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0016_broadcast_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BarcodeAllocator',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length', models.PositiveSmallIntegerField(unique=True, verbose_name='عدد الأرقام')),
+                ('next_index', models.BigIntegerField(default=0, verbose_name='الموضع التالي')),
+                ('multiplier', models.BigIntegerField(verbose_name='معامل التبديل')),
+                ('offset', models.BigIntegerField(verbose_name='إزاحة التبديل')),
+            ],
+            options={
+                'verbose_name': 'موزّع الباركود',
+                'verbose_name_plural': 'موزّعات الباركود',
+            },
+        ),
+        migrations.AlterField(
+            model_name='students',
+            name='barcode',
+            field=models.CharField(blank=True, max_length=12, unique=True, verbose_name='الباركود'),
+        ),
+    ]
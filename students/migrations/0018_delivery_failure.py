@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0017_barcode_allocator'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(blank=True, max_length=32, verbose_name='رقم الهاتف')),
+                ('student_name', models.CharField(blank=True, max_length=100, verbose_name='اسم الطالب')),
+                ('message_type', models.CharField(blank=True, max_length=50, verbose_name='نوع الرسالة')),
+                ('error_type', models.CharField(choices=[('invalid_format', 'صيغة الرقم غير صالحة'), ('whatsapp_error', 'خطأ من واتساب (الرقم غير موجود أو غير نشط)'), ('send_failed', 'فشل في الإرسال'), ('no_send_button', 'الرقم غير موجود على واتساب'), ('selenium_error', 'خطأ تقني في المتصفح'), ('retry_failed', 'فشل في إعادة المحاولة'), ('final_check_failed', 'فشل في التحقق النهائي'), ('unknown', 'خطأ غير محدد')], default='unknown', max_length=30, verbose_name='نوع الخطأ')),
+                ('reason', models.CharField(blank=True, max_length=255, verbose_name='السبب')),
+                ('details', models.TextField(blank=True, verbose_name='التفاصيل')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='وقت الفشل')),
+                ('student', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivery_failures', to='students.students', verbose_name='الطالب')),
+            ],
+            options={
+                'verbose_name': 'فشل إرسال',
+                'verbose_name_plural': 'حالات فشل الإرسال',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['phone', 'created_at'], name='failure_phone_idx'), models.Index(fields=['student', 'created_at'], name='failure_student_idx'), models.Index(fields=['error_type', 'created_at'], name='failure_error_idx'), models.Index(fields=['created_at'], name='failure_time_idx')],
+            },
+        ),
+    ]
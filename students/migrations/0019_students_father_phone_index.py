@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0018_delivery_failure'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='students',
+            name='father_phone',
+            field=models.CharField(db_index=True, max_length=15, verbose_name='هاتف ولي الأمر'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0019_students_father_phone_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['attendance_date', 'is_absent', 'student'], name='attendance_day_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['student', 'attendance_date', 'is_absent'], name='attendance_student_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['month', 'student'], name='payment_month_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['paid_on', 'id'], name='payment_paid_on_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='students',
+            index=models.Index(fields=['name'], name='student_name_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0020_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(condition=models.Q(('is_absent', False)), fields=['attendance_date', 'arrival_time'], name='attendance_present_day_idx'),
+        ),
+    ]
@@ -1,5 +1,4 @@
 from django.db import models
-import random
 from django.utils import timezone
 from datetime import date
 
@@ -25,8 +24,8 @@ class Basics(models.Model):
 
 class Students(models.Model):
     name = models.CharField(verbose_name='الاسم', max_length=100)
-    father_phone = models.CharField(verbose_name='هاتف ولي الأمر', max_length=15)
-    barcode = models.CharField(verbose_name='الباركود', max_length=5, unique=True, blank=True)
+    father_phone = models.CharField(verbose_name='هاتف ولي الأمر', max_length=15, db_index=True)
+    barcode = models.CharField(verbose_name='الباركود', max_length=12, unique=True, blank=True)
     free_tries = models.PositiveSmallIntegerField(
         'عدد الفرص المجانية المتبقية',default=3
     )
@@ -39,12 +38,9 @@ class Students(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.barcode:
-            # توليد رقم باركود عشوائي مكون من 5 أرقام
-            while True:
-                code = str(random.randint(10000, 99999))
-                if not Students.objects.filter(barcode=code).exists():
-                    self.barcode = code
-                    break
+            # حجز رقم باركود فريد من موزّع الأرقام (بدون تخمين عشوائي)
+            from .barcode_allocator import allocate_barcodes
+            self.barcode = allocate_barcodes(1)[0]
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -52,6 +48,10 @@ class Students(models.Model):
     class Meta:
         verbose_name = "طالب"
         verbose_name_plural = 'الطلاب'
+        indexes = [
+            # الترتيب بالاسم في التقارير والبحث الدقيق به
+            models.Index(fields=['name'], name='student_name_idx'),
+        ]
 
 class Attendance(models.Model):
     student = models.ForeignKey(Students, on_delete=models.CASCADE)
@@ -73,8 +73,60 @@ class Attendance(models.Model):
                 name='unique_student_attendance_per_day'
             )
         ]
+        # فهارس مغطية للاستعلامات المتكررة (manage.py check_query_plans):
+        # اليوم/الغياب -> الطلاب (ملخص اليوم، تسجيل الغائبين، مجموعة المسح)،
+        # والطالب/الفترة -> الغياب (نسبة الحضور الشهرية، أيام الغياب المتتالية)،
+        # وفهرس جزئي للحاضرين فقط: اليوم -> وقت الوصول (عدّ المتأخرين في الملخص اليومي)
+        indexes = [
+            models.Index(fields=['attendance_date', 'is_absent', 'student'], name='attendance_day_status_idx'),
+            models.Index(fields=['student', 'attendance_date', 'is_absent'], name='attendance_student_day_idx'),
+            models.Index(
+                fields=['attendance_date', 'arrival_time'],
+                condition=models.Q(is_absent=False),
+                name='attendance_present_day_idx',
+            ),
+        ]
 
 
+class DailyAttendanceStats(models.Model):
+    """
+    ملخص يومي مُجمَّع لجدول الحضور، يُحدَّث تزايدياً عند المسح وتسجيل الغياب
+    ويُعاد بناؤه بالأمر rebuild_attendance_stats.
+    """
+    date = models.DateField(verbose_name='التاريخ', unique=True)
+    present = models.PositiveIntegerField(verbose_name='حاضر', default=0)
+    absent = models.PositiveIntegerField(verbose_name='غائب', default=0)
+    late = models.PositiveIntegerField(verbose_name='متأخر', default=0)
+    unmarked = models.PositiveIntegerField(verbose_name='لم يُسجَّل', default=0)
+
+    def __str__(self):
+        return f"{self.date} – {self.present}/{self.absent}"
+
+    class Meta:
+        verbose_name = "إحصائية حضور يومية"
+        verbose_name_plural = 'إحصائيات الحضور اليومية'
+        ordering = ['-date']
+
+class BarcodeAllocator(models.Model):
+    """
+    عدّاد توزيع أرقام الباركود لكل طول (5 أرقام افتراضياً).
+
+    كل موضع في العداد يُحوَّل إلى باركود عبر تبديل ثابت (affine permutation)
+    على مساحة الأرقام كلها، فتبدو الأرقام عشوائية لكنها لا تتكرر أبداً،
+    ويُحجز أي عدد من الأرقام بتحديث واحد للعداد.
+    """
+    length = models.PositiveSmallIntegerField(verbose_name='عدد الأرقام', unique=True)
+    next_index = models.BigIntegerField(verbose_name='الموضع التالي', default=0)
+    multiplier = models.BigIntegerField(verbose_name='معامل التبديل')
+    offset = models.BigIntegerField(verbose_name='إزاحة التبديل')
+
+    def __str__(self):
+        return f"{self.length} أرقام – {self.next_index}"
+
+    class Meta:
+        verbose_name = "موزّع الباركود"
+        verbose_name_plural = 'موزّعات الباركود'
+
 def first_day_of_current_month():
     """
     يُعيد التاريخ ‘YYYY-MM-01’ للشهر الحالي حسب الإعداد الزمني في Django.
@@ -93,6 +145,10 @@ class Payment(models.Model):
     paid_on = models.DateTimeField(
         auto_now_add=True,verbose_name='تاريخ ووقت الدفع'
     )
+    # المبلغ المدفوع فعلياً وقت الدفع (لا يتأثر بتغيير سعر الشهر لاحقاً)
+    amount = models.IntegerField(
+        default=0,verbose_name='المبلغ المدفوع'
+    )
 
     class Meta:
         # قيد فريد: طالب + أوّلي نفس الشهر
@@ -102,6 +158,11 @@ class Payment(models.Model):
                 name='unique_payment_per_month'
             )
         ]
+        # (student, month) يغطيه القيد الفريد؛ هذه لمن دفع في شهر ولصفحات تقرير الدخل
+        indexes = [
+            models.Index(fields=['month', 'student'], name='payment_month_student_idx'),
+            models.Index(fields=['paid_on', 'id'], name='payment_paid_on_idx'),
+        ]
         ordering = ['-month']
         verbose_name = 'دفعة'
         verbose_name_plural = 'الدفعات'
@@ -109,6 +170,121 @@ class Payment(models.Model):
     def __str__(self):
         # مثال: "أحمد – 2025-05"
         return f"{self.student.name} – {self.month:%Y-%m}"
+class MonthlyRevenue(models.Model):
+    """
+    إجمالي الإيرادات لكل شهر دفع، يُحدَّث في نفس معاملة تسجيل الدفعة.
+    """
+    month = models.DateField(verbose_name='الشهر', unique=True)
+    total_amount = models.BigIntegerField(verbose_name='إجمالي المبلغ', default=0)
+    payments_count = models.PositiveIntegerField(verbose_name='عدد الدفعات', default=0)
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} – {self.total_amount}"
+
+    class Meta:
+        verbose_name = "إيراد شهري"
+        verbose_name_plural = 'الإيرادات الشهرية'
+        ordering = ['-month']
+
+class OutboundMessage(models.Model):
+    """
+    طابور رسائل WhatsApp الدائم: كل رسالة صف في قاعدة البيانات يستهلكه
+    المُرسِل (manage.py run_whatsapp_dispatcher) بالترتيب، فلا تضيع الرسائل
+    عند إعادة تشغيل الخادم.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'في الانتظار'),
+        (STATUS_SENDING, 'جاري الإرسال'),
+        (STATUS_SENT, 'تم الإرسال'),
+        (STATUS_FAILED, 'فشل'),
+    ]
+
+    phone = models.CharField(verbose_name='رقم الهاتف', max_length=32, blank=True)
+    text = models.TextField(verbose_name='نص الرسالة')
+    status = models.CharField(verbose_name='الحالة', max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(verbose_name='عدد المحاولات', default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='موعد المحاولة التالية', default=timezone.now)
+    # سياق التسجيل: student_id, student_name, message_type, reason, details
+    context = models.JSONField(verbose_name='سياق التسجيل', default=dict, blank=True)
+    last_error = models.TextField(verbose_name='آخر خطأ', blank=True)
+    claimed_by = models.CharField(verbose_name='المُرسِل', max_length=64, blank=True)
+    claimed_at = models.DateTimeField(verbose_name='وقت الحجز', null=True, blank=True)
+    created_at = models.DateTimeField(verbose_name='وقت الإنشاء', auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name='وقت الإرسال', null=True, blank=True)
+    # الرسالة العامة التي أنشأت هذه الرسالة (لتحديث عدادات التقدم)
+    broadcast = models.ForeignKey(
+        'BroadcastMessage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='outbound_messages',
+        verbose_name='الرسالة العامة',
+    )
+
+    def __str__(self):
+        return f"{self.phone} – {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = "رسالة صادرة"
+        verbose_name_plural = 'الرسائل الصادرة'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id'], name='outbox_claim_idx'),
+        ]
+
+
+class DeliveryFailure(models.Model):
+    """
+    سجل فشل إرسال رسالة WhatsApp (بدل ملفات CSV و JSON). يُكتب على دفعات عبر
+    utils.failed_numbers_manager.record_failure ويُستعلم عنه بالفهارس أدناه.
+    """
+    ERROR_TYPE_CHOICES = [
+        ('invalid_format', 'صيغة الرقم غير صالحة'),
+        ('whatsapp_error', 'خطأ من واتساب (الرقم غير موجود أو غير نشط)'),
+        ('send_failed', 'فشل في الإرسال'),
+        ('no_send_button', 'الرقم غير موجود على واتساب'),
+        ('selenium_error', 'خطأ تقني في المتصفح'),
+        ('retry_failed', 'فشل في إعادة المحاولة'),
+        ('final_check_failed', 'فشل في التحقق النهائي'),
+        ('unknown', 'خطأ غير محدد'),
+    ]
+
+    phone = models.CharField(verbose_name='رقم الهاتف', max_length=32, blank=True)
+    student = models.ForeignKey(
+        Students,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='delivery_failures',
+        verbose_name='الطالب',
+        db_index=False,  # يغطيه الفهرس (student, created_at)
+    )
+    # الاسم وقت الفشل، يبقى حتى لو حُذف الطالب
+    student_name = models.CharField(verbose_name='اسم الطالب', max_length=100, blank=True)
+    message_type = models.CharField(verbose_name='نوع الرسالة', max_length=50, blank=True)
+    error_type = models.CharField(verbose_name='نوع الخطأ', max_length=30, choices=ERROR_TYPE_CHOICES, default='unknown')
+    reason = models.CharField(verbose_name='السبب', max_length=255, blank=True)
+    details = models.TextField(verbose_name='التفاصيل', blank=True)
+    created_at = models.DateTimeField(verbose_name='وقت الفشل', default=timezone.now)
+
+    def __str__(self):
+        return f"{self.phone} – {self.get_error_type_display()}"
+
+    class Meta:
+        verbose_name = "فشل إرسال"
+        verbose_name_plural = 'حالات فشل الإرسال'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['phone', 'created_at'], name='failure_phone_idx'),
+            models.Index(fields=['student', 'created_at'], name='failure_student_idx'),
+            models.Index(fields=['error_type', 'created_at'], name='failure_error_idx'),
+            models.Index(fields=['created_at'], name='failure_time_idx'),
+        ]
+
 class NotificationCategory(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name="اسم فئة الإشعار") # اسم الفئة، يجب أن يكون فريداً
     def __str__(self):
@@ -133,6 +309,10 @@ class BroadcastMessage(models.Model):
     send_to_all = models.BooleanField(default=True, verbose_name="إرسال للجميع") # علامة لتحديد ما إذا كانت الرسالة سترسل لجميع الطلاب
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="وقت الإنشاء") # تاريخ ووقت إنشاء الرسالة (يُضبط تلقائياً عند الإنشاء)
     sent_at = models.DateTimeField(null=True, blank=True, verbose_name="وقت الإرسال") # تاريخ ووقت إرسال الرسالة (يُضبط عند الإرسال الفعلي)
+    # سجل التسليم: يُحدّث أثناء وضع الرسائل في الطابور ثم بواسطة المُرسِل
+    queued_count = models.PositiveIntegerField(default=0, verbose_name="في الطابور") # عدد الرسائل التي وُضعت في الطابور
+    sent_count = models.PositiveIntegerField(default=0, verbose_name="تم إرسالها") # عدد الرسائل التي أُرسلت فعلاً
+    failed_count = models.PositiveIntegerField(default=0, verbose_name="فشلت") # بدون رقم هاتف أو فشلت بعد كل المحاولات
 
     def __str__(self):
         return self.title # التمثيل النصي للنموذج هو عنوان الرسالة
@@ -1,9 +1,15 @@
 # students/resources.py
 
 from import_export import resources, fields
+from import_export.instance_loaders import CachedInstanceLoader
 from import_export.widgets import DateWidget
+from . import barcode_index
+from .barcode_allocator import allocate_barcodes
 from .models import Students
 
+IMPORT_BATCH_SIZE = 1000
+
+
 class StudentsResource(resources.ModelResource):
     # مثال على تخصيص حقل التاريخ لو اردت تضمين "last_reset_month"
     last_reset_month = fields.Field(
@@ -37,3 +43,44 @@ class StudentsResource(resources.ModelResource):
         report_skipped = True
         # يستخدم الحقل 'id' كمفتاح للتعريف عند الاستيراد
         import_id_fields = ('id',)
+        # الاستيراد الجماعي: تحميل الطلاب الموجودين باستعلام واحد ثم الكتابة
+        # بـ bulk_create / bulk_update على دفعات (المعاينة بدون استعلام لكل صف)
+        instance_loader_class = CachedInstanceLoader
+        use_bulk = True
+        batch_size = IMPORT_BATCH_SIZE
+
+    def before_import(self, dataset, **kwargs):
+        # bulk_create لا يستدعي Students.save، لذلك نحجز أرقام الباركود
+        # لكل الصفوف التي بدون باركود دفعة واحدة
+        barcode_column = self.fields['barcode'].column_name
+        if barcode_column in dataset.headers:
+            missing = sum(1 for value in dataset[barcode_column] if value in (None, ''))
+        else:
+            # بدون عمود الباركود يحتفظ الطلاب الموجودون بأرقامهم، فالحجز للصفوف الجديدة فقط
+            missing = len(dataset) - self._existing_rows(dataset)
+        self._barcode_pool = allocate_barcodes(missing)
+
+    def _existing_rows(self, dataset):
+        """عدد الصفوف التي يطابق رقمها طالباً موجوداً (استعلام واحد)."""
+        id_field = self.fields['id']
+        if id_field.column_name not in dataset.headers:
+            return 0
+        ids = []
+        for value in dataset[id_field.column_name]:
+            try:
+                ids.append(id_field.widget.clean(value))
+            except (ValueError, ArithmeticError):
+                continue
+        existing = set(Students.objects.filter(id__in=[i for i in ids if i is not None]).values_list('id', flat=True))
+        return sum(1 for i in ids if i in existing)
+
+    def before_save_instance(self, instance, row, **kwargs):
+        if not instance.barcode:
+            pool = getattr(self, '_barcode_pool', None)
+            instance.barcode = pool.pop() if pool else allocate_barcodes(1)[0]
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        # الكتابة الجماعية لا تطلق إشارات post_save، فنعيد تحميل فهرس المسح
+        if not kwargs.get('dry_run'):
+            barcode_index.clear()
@@ -0,0 +1,223 @@
+# students/scan_batch.py
+"""
+تطبيق دفعة مسحات مسجلة دون اتصال (مكتب انقطعت عنه الشبكة أو قارئ محمول).
+
+كل حدث {"barcode", "action", "scanned_at"} حيث action واحد من scan / free / pay كما في
+صفحة المسح. تُرتب الأحداث بوقت المسح وتُطبق بنفس قواعد barcode_attendance_view لكن
+بالوقت الأصلي: يوم الحضور ووقت الوصول والتأخير من scanned_at، والشهر المدفوع شهر ذلك اليوم.
+
+- الحضور والدفع الموجودان لطلاب الدفعة وأيامها وشهورها يُحملان باستعلام واحد لكل منهما؛
+  الأيام السابقة لا تمر بفهرس barcode_index (يحمل يوماً واحداً هو اليوم الحالي لصفحة المسح).
+- مسح طالب دفع (أغلب الأحداث): إدخال جماعي واحد لكل الدفعة وتحديث واحد للملخص اليومي لكل يوم.
+- free و pay: consume_free_try و pay_and_record_presence لكل حدث (تحديثات مشروطة ذرية).
+
+النتيجة لكل حدث بنفس ترتيب الطلب: status أحد RESULT_STATUSES مع بيانات الطالب.
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import barcode_index, settings_provider
+from .models import Attendance, Payment, Students
+from .util import bump_daily_attendance_stats, consume_free_try, pay_and_record_presence
+
+ACTIONS = ('scan', 'free', 'pay')
+# مسح "من المستقبل" أكثر من هذا يعني ساعة جهاز خاطئة
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+RESULT_STATUSES = (
+    'present',            # حضور طالب دفع
+    'free',               # حضور بفرصة مجانية
+    'paid',               # دفع (وحضور إن لم يكن مسجلاً)
+    'duplicate',          # حضور اليوم مسجل مسبقاً
+    'unpaid',             # مسح طالب لم يدفع: يحتاج free أو pay
+    'no_free_tries',      # free بدون فرص متبقية
+    'invalid_barcode',
+    'invalid_action',
+    'invalid_timestamp',
+)
+
+
+def _parse_scanned_at(value, now):
+    if value in (None, ''):
+        return now
+    try:
+        scanned_at = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        # صيغة صحيحة بتاريخ مستحيل مثل 2025-02-30
+        return None
+    if scanned_at is None:
+        return None
+    if timezone.is_naive(scanned_at):
+        scanned_at = timezone.make_aware(scanned_at)
+    if scanned_at > now + MAX_CLOCK_SKEW:
+        return None
+    return scanned_at
+
+
+def _validate(index, event, now):
+    """يعيد (النتيجة، الطالب، action، الوقت المحلي)؛ الطالب None إن كان الحدث غير صالح."""
+    if not isinstance(event, dict):
+        event = {}
+    result = {'index': index, 'id': event.get('id'), 'barcode': str(event.get('barcode') or '').strip()}
+    action = event.get('action', 'scan')
+    if action not in ACTIONS:
+        result['status'] = 'invalid_action'
+        return result, None, action, None
+    scanned_at = _parse_scanned_at(event.get('scanned_at'), now)
+    if scanned_at is None:
+        result['status'] = 'invalid_timestamp'
+        return result, None, action, None
+    student = barcode_index.get_student(result['barcode']) if result['barcode'] else None
+    if student is None:
+        result['status'] = 'invalid_barcode'
+        return result, None, action, None
+    result.update(student_id=student.id, student_name=student.name, action=action)
+    return result, student, action, timezone.localtime(scanned_at)
+
+
+def apply_scan_events(events):
+    """
+    يطبق أحداث المسح ويعيد نتيجة لكل حدث بنفس الترتيب.
+    النتائج الناجحة تحمل 'student' و 'scanned_at' (وقت محلي) لبناء الإشعارات.
+    """
+    now = timezone.now()
+    late_arrival_time = settings_provider.get_late_arrival_time()
+    results = []
+    valid = []
+    for index, event in enumerate(events):
+        result, student, action, local = _validate(index, event, now)
+        results.append(result)
+        if student is not None:
+            valid.append((local, index, result, student, action))
+    valid.sort(key=lambda item: (item[0], item[1]))
+    valid = _drop_deleted_students(valid)
+
+    # (student_id, day) له سجل حضور/غياب، و (student_id, month) دفع؛ ويُضاف لهما ما يُسجل في هذه الدفعة
+    seen, paid_months = _existing_records(valid)
+    pending = []         # مسحات طلاب دفعوا، تُدرج معاً في النهاية
+    for local, _, result, student, action in valid:
+        day = local.date()
+        month_start = day.replace(day=1)
+        result.update(
+            student=student,
+            scanned_at=local,
+            late=bool(late_arrival_time and local.time() > late_arrival_time),
+        )
+        if (student.id, day) in seen:
+            result['status'] = 'duplicate'
+            continue
+        paid = (student.id, month_start) in paid_months
+
+        if action == 'scan':
+            if paid:
+                seen.add((student.id, day))
+                pending.append(result)
+            else:
+                result.update(status='unpaid', free_tries=student.free_tries)
+        elif action == 'free':
+            try:
+                remaining = consume_free_try(student, day, local.time())
+            except IntegrityError:
+                result['status'] = 'invalid_barcode' if barcode_index.is_gone(student.id) else 'duplicate'
+                continue
+            if remaining is None:
+                result.update(status='no_free_tries', free_tries=0)
+            else:
+                seen.add((student.id, day))
+                result.update(status='free', free_tries=remaining)
+        else:
+            payment, created, present = pay_and_record_presence(student, month_start, day, local.time())
+            paid_months.add((student.id, month_start))
+            if present:
+                seen.add((student.id, day))
+            result.update(status='paid', payment=payment, created=created, present=present)
+
+    _insert_present(pending)
+    return results
+
+
+def _drop_deleted_students(valid):
+    """
+    يستبعد طلاب الفهرس الذين حُذفوا من عملية أخرى (استعلام واحد)، بدل فشل الإدخال الجماعي
+    بقيد المفتاح الأجنبي.
+    """
+    if not valid:
+        return valid
+    live = set(
+        Students.objects.filter(id__in={student.id for _, _, _, student, _ in valid}).values_list('id', flat=True)
+    )
+    kept = []
+    for item in valid:
+        result, student = item[2], item[3]
+        if student.id in live:
+            kept.append(item)
+            continue
+        barcode_index.forget(student.id)
+        for key in ('student_id', 'student_name', 'action'):
+            result.pop(key, None)
+        result['status'] = 'invalid_barcode'
+    return kept
+
+
+def _existing_records(valid):
+    """أزواج الحضور والدفع الموجودة لطلاب الدفعة وأيامها وشهورها (استعلام واحد لكل منهما)."""
+    if not valid:
+        return set(), set()
+    student_ids = {student.id for _, _, _, student, _ in valid}
+    days = {local.date() for local, _, _, _, _ in valid}
+    scanned = set(
+        Attendance.objects.filter(student_id__in=student_ids, attendance_date__in=days)
+        .values_list('student_id', 'attendance_date')
+    )
+    paid = set(
+        Payment.objects.filter(student_id__in=student_ids, month__in={day.replace(day=1) for day in days})
+        .values_list('student_id', 'month')
+    )
+    return scanned, paid
+
+
+def _insert_present(pending):
+    """إدخال جماعي لمسحات الحضور وتحديث الملخص اليومي مرة لكل يوم."""
+    if not pending:
+        return
+    with transaction.atomic():
+        # سجلات من مكتب آخر منذ بداية الدفعة
+        existing = set(
+            Attendance.objects.filter(
+                student_id__in={result['student'].id for result in pending},
+                attendance_date__in={result['scanned_at'].date() for result in pending},
+            ).values_list('student_id', 'attendance_date')
+        )
+        new = []
+        for result in pending:
+            if (result['student'].id, result['scanned_at'].date()) in existing:
+                result['status'] = 'duplicate'
+            else:
+                result['status'] = 'present'
+                new.append(result)
+        Attendance.objects.bulk_create(
+            [
+                Attendance(
+                    student=result['student'],
+                    attendance_date=result['scanned_at'].date(),
+                    arrival_time=result['scanned_at'].time(),
+                )
+                for result in new
+            ],
+            ignore_conflicts=True,
+        )
+        by_day = {}
+        for result in new:
+            by_day.setdefault(result['scanned_at'].date(), []).append(result)
+        for day, day_results in by_day.items():
+            bump_daily_attendance_stats(
+                day,
+                present=len(day_results),
+                late=sum(result['late'] for result in day_results),
+            )
+    # bulk_create لا يطلق post_save (لا يغير الفهرس إلا إن كان اليوم هو يومه الحالي)
+    for day, day_results in by_day.items():
+        barcode_index.mark_scanned([result['student'].id for result in day_results], day)
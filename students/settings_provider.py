@@ -0,0 +1,80 @@
+# students/settings_provider.py
+"""
+مزوّد إعدادات Basics (صف واحد يتغير نادراً).
+
+يُقرأ الصف مرة واحدة لكل عملية ثم يُحفظ في الذاكرة، ويُمسح تلقائياً عبر
+post_save/post_delete عند تعديله من لوحة التحكم. الإشارات تصل فقط للعملية التي
+كتبت البيانات، لذلك يُعاد التحميل أيضاً بعد BASICS_CACHE_TTL ثانية حتى يصل التعديل
+لباقي العمليات (السعر والفرص المجانية ووقت التأخير).
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Basics
+
+DEFAULT_MONTH_PRICE = 0
+DEFAULT_FREE_TRIES = 3
+
+_MISSING = object()
+_lock = threading.Lock()
+_cached = _MISSING
+_loaded_at = 0.0
+_generation = 0     # يزيد مع كل clear() حتى لا يحفظ تحميل قديم فوق مسح أحدث منه
+
+
+def _ttl():
+    return getattr(settings, 'BASICS_CACHE_TTL', 60)
+
+
+def get_basics():
+    """يعيد صف Basics أو None إذا لم يُنشأ بعد."""
+    global _cached, _loaded_at
+    with _lock:
+        if _cached is not _MISSING and time.monotonic() - _loaded_at < _ttl():
+            return _cached
+        generation = _generation
+    basics = Basics.objects.first()
+    with _lock:
+        if generation == _generation:
+            _cached = basics
+            _loaded_at = time.monotonic()
+    return basics
+
+
+def clear():
+    """يمسح النسخة المحفوظة ليُعاد تحميلها عند الطلب التالي."""
+    global _cached, _generation
+    with _lock:
+        _cached = _MISSING
+        _generation += 1
+
+
+def get_late_arrival_time():
+    """وقت اعتبار التأخير (datetime.time) أو None إذا لم يُحدد."""
+    basics = get_basics()
+    return basics.late_arrival_time if basics else None
+
+
+def get_month_price():
+    """سعر الشهر، أو DEFAULT_MONTH_PRICE إذا لم تُضبط الإعدادات."""
+    basics = get_basics()
+    if basics is None or basics.month_price is None:
+        return DEFAULT_MONTH_PRICE
+    return basics.month_price
+
+
+def get_free_tries():
+    """عدد الفرص المجانية الشهرية، أو DEFAULT_FREE_TRIES إذا لم تُضبط الإعدادات."""
+    basics = get_basics()
+    return basics.free_tries if basics else DEFAULT_FREE_TRIES
+
+
+@receiver(post_save, sender=Basics)
+@receiver(post_delete, sender=Basics)
+def _basics_changed(sender, **kwargs):
+    clear()
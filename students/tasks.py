@@ -1,11 +1,13 @@
 from celery import shared_task
 
+from .utils.whatsapp_transports import build_transport
+
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def send_whatsapp_task(self, phone, message):
+def send_whatsapp_task(self, phone, message, backend=None):
     try:
-        import pywhatkit
-        # تأخير لتحميل WhatsApp Web
-        pywhatkit.sendwhatmsg_instantly(phone, message, wait_time=20, tab_close=True)
+        # الوسيلة من WHATSAPP_TRANSPORT ما لم تُحدد صراحةً
+        if not build_transport(backend).send(phone, message):
+            raise RuntimeError(f"WhatsApp transport failed for {phone}")
     except Exception as exc:
         # إعادة المحاولة تلقائياً
         raise self.retry(exc=exc)
@@ -1,70 +1,312 @@
 from django.utils import timezone
-from .models import Students, Attendance, Payment, Basics
+from .models import Students, Attendance, Payment, DailyAttendanceStats, MonthlyRevenue
+from . import barcode_index, settings_provider
 from datetime import date, timedelta # timedelta added
-from django.db.models import Count, Sum, Avg, F, ExpressionWrapper, fields # Added
-from django.db.models.functions import TruncMonth, TruncWeek, TruncDay # Added
+from django.db.models import Count, Sum, Avg, F, Q, Value, Exists, OuterRef, Subquery, ExpressionWrapper, fields # Added
+from django.db import connection, transaction, IntegrityError
+from django.db.models.functions import TruncMonth, TruncWeek, TruncDay, TruncYear, Greatest # Added
 import calendar # Added
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+def _students_with_day_status(target_date):
+    # is_absent of the student's record for the day; NULL means no record (unmarked)
+    return Students.objects.annotate(
+        day_status=Subquery(
+            Attendance.objects.filter(
+                student=OuterRef('pk'),
+                attendance_date=target_date,
+            ).values('is_absent')[:1]
+        )
+    )
+
 
-def get_daily_attendance_summary(target_date=None):
+def get_daily_attendance_summary(target_date=None, counts_only=False):
     """
     Calculates the attendance summary for a given date.
 
+    Every student is annotated with the `is_absent` flag of their attendance record for the
+    day (NULL when unmarked) through a correlated subquery, so the whole summary is built
+    from a single query and partitioned in Python without per-row lookups.
+
     Args:
         target_date (datetime.date, optional): The date for which to calculate the summary.
                                              Defaults to the current local date if None.
+        counts_only (bool, optional): When True, only the counts are computed with one
+                                      aggregate query and the student lists are None.
+                                      Defaults to False.
 
     Returns:
         dict: A dictionary containing:
             - 'date' (datetime.date): The date of the summary.
             - 'present_count' (int): Count of students marked as present.
             - 'absent_count' (int): Count of students marked as absent (is_absent=True).
-            - 'present_students' (list[Students]): List of Student objects who were present.
-            - 'absent_students' (list[Students]): List of Student objects who were marked absent.
+            - 'present_students' (list[Students] | None): List of Student objects who were present.
+            - 'absent_students' (list[Students] | None): List of Student objects who were marked absent.
             - 'unmarked_students_count' (int): Count of students with no attendance record for the day.
-            - 'unmarked_students' (list[Students]): List of Student objects with no record for the day.
+            - 'unmarked_students' (list[Students] | None): List of Student objects with no record for the day.
     """
     if target_date is None:
         target_date = timezone.localdate()  # Default to today if no date is specified
 
-    # Query for students marked as present (is_absent=False) on the target_date
-    present_attendance_records = Attendance.objects.filter(
-        attendance_date=target_date,
-        is_absent=False
-    )
-    present_students = [record.student for record in present_attendance_records]
-    
-    # Query for students marked as absent (is_absent=True) on the target_date
-    absent_attendance_records = Attendance.objects.filter(
-        attendance_date=target_date,
-        is_absent=True
-    )
-    absent_students = [record.student for record in absent_attendance_records]
-
-    # Identify all students who have any attendance record (present or absent) on the target_date
-    students_with_record_today_ids = Attendance.objects.filter(
-        attendance_date=target_date
-    ).values_list('student_id', flat=True)
-    
-    # Retrieve all students in the system.
-    # Consider adding an 'is_active' flag to the Students model for more precise filtering in large systems.
-    all_students = Students.objects.all()
-
-    # Determine unmarked students: those who are in `all_students` but not in `students_with_record_today_ids`
-    unmarked_students = [
-        student for student in all_students 
-        if student.id not in students_with_record_today_ids
-    ]
+    students = _students_with_day_status(target_date)
+
+    if counts_only:
+        counts = students.aggregate(
+            present_count=Count('id', filter=Q(day_status=False)),
+            absent_count=Count('id', filter=Q(day_status=True)),
+            unmarked_students_count=Count('id', filter=Q(day_status__isnull=True)),
+        )
+        return {
+            'date': target_date,
+            'present_count': counts['present_count'],
+            'absent_count': counts['absent_count'],
+            'present_students': None,
+            'absent_students': None,
+            'unmarked_students_count': counts['unmarked_students_count'],
+            'unmarked_students': None,
+        }
+
+    present_students, absent_students, unmarked_students = [], [], []
+    for student in students.order_by('id'):
+        if student.day_status is None:
+            unmarked_students.append(student)
+        elif student.day_status:
+            absent_students.append(student)
+        else:
+            present_students.append(student)
 
     return {
         'date': target_date,
-        'present_count': present_attendance_records.count(),
-        'absent_count': absent_attendance_records.count(),
+        'present_count': len(present_students),
+        'absent_count': len(absent_students),
         'present_students': present_students,
         'absent_students': absent_students,
         'unmarked_students_count': len(unmarked_students),
         'unmarked_students': unmarked_students,
     }
 
+def record_presence(student, attendance_date=None, arrival_time=None):
+    """
+    Creates a present `Attendance` record for a scan and updates the daily rollup.
+
+    Args:
+        student (Students): The student who scanned in.
+        attendance_date (datetime.date, optional): Defaults to the current local date.
+        arrival_time (datetime.time, optional): Actual arrival time. Defaults to the current local time.
+
+    Returns:
+        Attendance: The created record.
+    """
+    now = timezone.localtime()
+    attendance_date = attendance_date or now.date()
+    arrival_time = arrival_time or now.time()
+    attendance = Attendance.objects.create(
+        student=student,
+        attendance_date=attendance_date,
+        arrival_time=arrival_time,
+    )
+    late_arrival_time = settings_provider.get_late_arrival_time()
+    is_late = bool(late_arrival_time and arrival_time > late_arrival_time)
+    bump_daily_attendance_stats(attendance_date, present=1, late=int(is_late))
+    return attendance
+
+
+def consume_free_try(student, attendance_date=None, arrival_time=None):
+    """
+    Spends one free try of `student` and records their presence in the same transaction.
+
+    The decrement is a conditional `UPDATE ... SET free_tries = free_tries - 1 WHERE free_tries > 0`
+    evaluated by the database, so two desks scanning the same card cannot both spend the last
+    try, whatever `student.free_tries` holds in memory (the barcode index may be stale). If the
+    attendance insert fails because the day is already recorded, the decrement is rolled back too.
+
+    Args:
+        student (Students): The scanned student; its `free_tries` is refreshed from the database.
+        attendance_date (datetime.date, optional): Defaults to the current local date.
+        arrival_time (datetime.time, optional): Actual arrival time. Defaults to the current local time.
+
+    Returns:
+        int | None: The remaining free tries, or None when none were left (nothing is recorded).
+
+    Raises:
+        IntegrityError: The student already has an attendance record for the day.
+    """
+    with transaction.atomic():
+        spent = Students.objects.filter(pk=student.pk, free_tries__gt=0).update(
+            free_tries=F('free_tries') - 1
+        )
+        if not spent:
+            student.free_tries = 0
+            return None
+        record_presence(student, attendance_date, arrival_time)
+        remaining = Students.objects.filter(pk=student.pk).values_list('free_tries', flat=True).get()
+    student.free_tries = remaining
+    return remaining
+
+
+def pay_and_record_presence(student, payment_month, attendance_date=None, arrival_time=None):
+    """
+    Records the payment of `payment_month` and the student's presence in one transaction.
+
+    A new payment resets `free_tries` and `last_reset_month` (saved with `update_fields`).
+    The presence insert runs in a savepoint: if another desk already recorded the student
+    today, the payment is still kept.
+
+    Args:
+        student (Students): The paying student.
+        payment_month (datetime.date): The first day of the paid month.
+        attendance_date (datetime.date, optional): Defaults to the current local date.
+        arrival_time (datetime.time, optional): Actual arrival time. Defaults to the current local time.
+
+    Returns:
+        tuple[Payment, bool, bool]: The payment, whether it was created by this call, and
+                                    whether the presence was recorded by this call.
+    """
+    with transaction.atomic():
+        payment, created = record_payment(student, payment_month)
+        if created:
+            student.free_tries = settings_provider.get_free_tries()
+            student.last_reset_month = payment_month
+            student.save(update_fields=['free_tries', 'last_reset_month'])
+        try:
+            with transaction.atomic():
+                record_presence(student, attendance_date, arrival_time)
+            present = True
+        except IntegrityError:
+            present = False
+    return payment, created, present
+
+
+def bump_daily_attendance_stats(target_date, present=0, absent=0, late=0):
+    """
+    Incrementally updates the `DailyAttendanceStats` row of `target_date`.
+
+    The common case is a single `UPDATE ... SET present = present + 1`. When the day has no
+    row yet it is built from the raw `Attendance` rows instead, which already include the
+    record that triggered the call.
+
+    Args:
+        target_date (datetime.date): The day to update.
+        present (int, optional): Number of new present records.
+        absent (int, optional): Number of new absence records.
+        late (int, optional): Number of the new present records that arrived late.
+    """
+    updated = DailyAttendanceStats.objects.filter(date=target_date).update(
+        present=F('present') + present,
+        absent=F('absent') + absent,
+        late=F('late') + late,
+        unmarked=Greatest(F('unmarked') - (present + absent), Value(0)),
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                rebuild_daily_attendance_stats(target_date, target_date)
+        except IntegrityError:
+            # أنشأ طلب متزامن الصف من البيانات الخام وهي تشمل سجلنا بالفعل
+            pass
+
+
+# استعلامان يقرآن الفهارس فقط: الحضور/الغياب من (attendance_date, is_absent, ...)
+# والمتأخرون من الفهرس الجزئي للحاضرين (attendance_date, arrival_time)
+def _daily_status_counts(start_date, end_date):
+    return Attendance.objects.filter(
+        attendance_date__gte=start_date,
+        attendance_date__lte=end_date,
+    ).values('attendance_date').annotate(
+        present_count=Count('id', filter=Q(is_absent=False)),
+        absent_count=Count('id', filter=Q(is_absent=True)),
+    ).order_by('attendance_date')
+
+
+def _daily_late_counts(start_date, end_date, late_arrival_time):
+    return Attendance.objects.filter(
+        attendance_date__gte=start_date,
+        attendance_date__lte=end_date,
+        is_absent=False,
+        arrival_time__gt=late_arrival_time,
+    ).values_list('attendance_date').annotate(late_count=Count('id')).order_by()
+
+
+def rebuild_daily_attendance_stats(start_date, end_date):
+    """
+    Recomputes `DailyAttendanceStats` for every day in [start_date, end_date] that has attendance.
+
+    Lateness is judged against the current `late_arrival_time`, and `unmarked` against the
+    current number of students, since neither is stored historically.
+
+    Args:
+        start_date (datetime.date): First day to rebuild (inclusive).
+        end_date (datetime.date): Last day to rebuild (inclusive).
+
+    Returns:
+        int: Number of days written.
+    """
+    late_arrival_time = settings_provider.get_late_arrival_time()
+    total_students = Students.objects.count()
+
+    rows = _daily_status_counts(start_date, end_date)
+    late_counts = dict(_daily_late_counts(start_date, end_date, late_arrival_time)) if late_arrival_time else {}
+
+    stats = [
+        DailyAttendanceStats(
+            date=row['attendance_date'],
+            present=row['present_count'],
+            absent=row['absent_count'],
+            late=late_counts.get(row['attendance_date'], 0),
+            unmarked=max(total_students - row['present_count'] - row['absent_count'], 0),
+        )
+        for row in rows
+    ]
+    DailyAttendanceStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=['present', 'absent', 'late', 'unmarked'],
+    )
+    return len(stats)
+
+
+def refresh_daily_attendance_stats(target_date):
+    """
+    Rebuilds the `DailyAttendanceStats` row of one day from the raw `Attendance` rows.
+
+    Used after edits and deletes, which the incremental `bump_daily_attendance_stats` does not
+    see. The row is removed when the day has no attendance left.
+
+    Args:
+        target_date (datetime.date): The day to rebuild.
+    """
+    if not rebuild_daily_attendance_stats(target_date, target_date):
+        DailyAttendanceStats.objects.filter(date=target_date).delete()
+
+
+# التسجيل الجديد يحدّث الملخص تزايدياً (record_presence و mark_absentees)؛ التعديل والحذف
+# (لوحة الإدارة أو shell) يعيدان بناء اليوم المتأثر
+
+@receiver(pre_save, sender=Attendance)
+def _attendance_changing(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._previous_attendance_date = (
+        Attendance.objects.filter(pk=instance.pk).values_list('attendance_date', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Attendance)
+def _attendance_changed(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    previous = getattr(instance, '_previous_attendance_date', None)
+    for day in {instance.attendance_date, previous} - {None}:
+        refresh_daily_attendance_stats(day)
+
+
+@receiver(post_delete, sender=Attendance)
+def _attendance_removed(sender, instance, **kwargs):
+    refresh_daily_attendance_stats(instance.attendance_date)
+
+
 def get_absent_students_today():
     """
     Determines students considered "absent" for reporting purposes on the current day.
@@ -84,6 +326,91 @@ def get_absent_students_today():
     return absent_for_report
 
 
+def _unmarked_students(target_date):
+    # الطلاب الذين ليس لهم أي سجل (حضور أو غياب) في هذا اليوم
+    return Students.objects.filter(
+        ~Exists(Attendance.objects.filter(student=OuterRef('pk'), attendance_date=target_date))
+    ).only('id', 'name', 'father_phone', 'has_whatsapp', 'barcode')
+
+
+def _absence_streaks(target_date):
+    # استعلام تجميعي واحد: إجمالي غياب الشهر + غياب الأمس وما قبله لكل طالب غائب اليوم
+    month_start = target_date.replace(day=1)
+    yesterday = target_date - timedelta(days=1)
+    day_before = target_date - timedelta(days=2)
+    return Attendance.objects.filter(
+        is_absent=True,
+        attendance_date__gte=min(month_start, day_before),
+        attendance_date__lte=target_date,
+        student_id__in=Attendance.objects.filter(
+            attendance_date=target_date, is_absent=True
+        ).values('student_id'),
+    ).values('student_id').annotate(
+        total_absences=Count('id', filter=Q(attendance_date__gte=month_start)),
+        absent_yesterday=Count('id', filter=Q(attendance_date=yesterday)),
+        absent_day_before=Count('id', filter=Q(attendance_date=day_before)),
+    )
+
+
+def mark_absentees(target_date=None):
+    """
+    Marks every student without an attendance record on `target_date` as absent.
+
+    The work is set-based so the number of queries does not grow with the class size:
+    one query selects the unmarked students, the absence rows are inserted with
+    `bulk_create(ignore_conflicts=True)` (the `unique_student_attendance_per_day`
+    constraint protects against a concurrent scan for the same student), and one grouped
+    aggregate computes every absentee's consecutive-day streak and monthly total.
+
+    Args:
+        target_date (datetime.date, optional): The day to close. Defaults to the current local date.
+
+    Returns:
+        list[dict]: One entry per newly marked student, containing:
+            - 'student' (Students): The student (only the fields needed for notifications are loaded).
+            - 'consecutive_days' (int): Absence streak ending on `target_date`, capped at 3.
+            - 'total_absences' (int): Absences recorded since the first day of the month.
+    """
+    if target_date is None:
+        target_date = timezone.localdate()
+
+    with transaction.atomic():
+        absentees = list(_unmarked_students(target_date))
+        if not absentees:
+            return []
+
+        Attendance.objects.bulk_create(
+            [Attendance(student=student, attendance_date=target_date, is_absent=True) for student in absentees],
+            ignore_conflicts=True,
+        )
+        # bulk_create لا يطلق post_save، لذا نحدّث مجموعة "تم تسجيله اليوم" يدوياً،
+        # بعد نجاح المعاملة فقط كي لا يبقى الفهرس خاطئاً إن تراجعت
+        absentee_ids = [student.id for student in absentees]
+        transaction.on_commit(lambda: barcode_index.mark_scanned(absentee_ids, target_date))
+
+        stats = {row['student_id']: row for row in _absence_streaks(target_date)}
+
+    results = []
+    for student in absentees:
+        row = stats.get(student.id)
+        if row is None:
+            # سجل آخر (مسح باركود متزامن مثلاً) سبق الإدخال الجماعي
+            continue
+        consecutive_days = 1
+        if row['absent_yesterday']:
+            consecutive_days += 1
+            if row['absent_day_before']:
+                consecutive_days += 1
+        results.append({
+            'student': student,
+            'consecutive_days': consecutive_days,
+            'total_absences': row['total_absences'],
+        })
+    if results:
+        bump_daily_attendance_stats(target_date, absent=len(results))
+    return results
+
+
 def get_student_remaining_free_tries(student):
     """
     Retrieves the number of remaining free attendance tries for a given student.
@@ -185,15 +512,11 @@ def process_student_payment(student, payment_month=None):
     if not isinstance(student, Students):
         raise ValueError("Input `student` must be a Students model instance.")
 
-    # Retrieve system-wide settings (like default free_tries)
-    try:
-        basics = Basics.objects.first() # Assuming a single Basics record
-        if not basics:
-            # Critical configuration missing, cannot reliably reset free_tries.
-            # Depending on policy, could raise an error or log this.
-            return None 
-    except Basics.DoesNotExist:
-        # Same as above: critical configuration missing.
+    # Retrieve system-wide settings (like default free_tries) from the per-process cache
+    basics = settings_provider.get_basics()
+    if not basics:
+        # Critical configuration missing, cannot reliably reset free_tries.
+        # Depending on policy, could raise an error or log this.
         return None
 
     # Determine the target payment month (ensure it's the first day of that month)
@@ -206,26 +529,97 @@ def process_student_payment(student, payment_month=None):
     else:
         raise ValueError("`payment_month` must be a datetime.date object or None.")
 
-    # Attempt to create or retrieve the payment record.
-    # `get_or_create` ensures idempotency for payments for the same student and month.
-    payment_record, created = Payment.objects.get_or_create(
-        student=student,
-        month=payment_month,
-        # `defaults` are used only if a new record is created.
-        # `paid_on` is auto_now_add=True in model, so it's set on creation.
-        # Explicitly setting it here in defaults is more for clarity if model changes.
-        defaults={'paid_on': timezone.now()} 
-    )
+    with transaction.atomic():
+        # Attempt to create or retrieve the payment record (idempotent per student and month);
+        # the monthly revenue rollup is updated in the same transaction.
+        payment_record, created = record_payment(student, payment_month, amount=basics.month_price)
 
-    if created:
-        # If a new payment record was actually created (not just retrieved)
-        student.last_reset_month = payment_month
-        student.free_tries = basics.free_tries  # Reset free_tries based on system settings
-        student.save(update_fields=['last_reset_month', 'free_tries'])
+        if created:
+            # If a new payment record was actually created (not just retrieved)
+            student.last_reset_month = payment_month
+            student.free_tries = basics.free_tries  # Reset free_tries based on system settings
+            student.save(update_fields=['last_reset_month', 'free_tries'])
     
     return payment_record
 
 
+def record_payment(student, payment_month, amount=None):
+    """
+    Creates the `Payment` of `student` for `payment_month` if it does not exist yet and
+    adds it to the `MonthlyRevenue` rollup in the same transaction.
+
+    Args:
+        student (Students): The paying student.
+        payment_month (datetime.date): The first day of the paid month.
+        amount (int, optional): The amount actually paid. Defaults to the current month price.
+
+    Returns:
+        tuple[Payment, bool]: The payment record and whether it was created by this call.
+    """
+    if amount is None:
+        amount = settings_provider.get_month_price()
+
+    with transaction.atomic():
+        # `get_or_create` ensures idempotency for payments for the same student and month.
+        # `paid_on` is auto_now_add=True in model, so it's set on creation.
+        payment_record, created = Payment.objects.get_or_create(
+            student=student,
+            month=payment_month,
+            defaults={'amount': amount},
+        )
+        if created:
+            bump_monthly_revenue(payment_month, amount)
+    return payment_record, created
+
+
+def bump_monthly_revenue(month, amount, count=1):
+    """
+    Adds `count` payments totalling `amount` to the `MonthlyRevenue` row of `month`.
+
+    Args:
+        month (datetime.date): The first day of the paid month.
+        amount (int): Amount to add (negative to remove).
+        count (int, optional): Number of payments to add (negative to remove). Defaults to 1.
+    """
+    updated = MonthlyRevenue.objects.filter(month=month).update(
+        total_amount=F('total_amount') + amount,
+        payments_count=F('payments_count') + count,
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                MonthlyRevenue.objects.create(month=month, total_amount=amount, payments_count=count)
+        except IntegrityError:
+            # Created concurrently between our UPDATE and INSERT
+            MonthlyRevenue.objects.filter(month=month).update(
+                total_amount=F('total_amount') + amount,
+                payments_count=F('payments_count') + count,
+            )
+
+
+def rebuild_monthly_revenue(month):
+    """
+    Recomputes the `MonthlyRevenue` row of `month` from its `Payment` records.
+    Used after edits that bypass `record_payment` (e.g. the admin).
+
+    Args:
+        month (datetime.date): The first day of the month to rebuild.
+    """
+    totals = Payment.objects.filter(month=month).aggregate(total=Sum('amount'), count=Count('id'))
+    MonthlyRevenue.objects.update_or_create(
+        month=month,
+        defaults={'total_amount': totals['total'] or 0, 'payments_count': totals['count']},
+    )
+
+
+def _student_attendance_between(student, start_date, end_date):
+    return Attendance.objects.filter(
+        student=student,
+        attendance_date__gte=start_date,
+        attendance_date__lte=end_date
+    )
+
+
 def get_monthly_attendance_rate(student, year, month):
     """
     Calculates the attendance rate for a specific student for a given calendar month and year.
@@ -261,11 +655,7 @@ def get_monthly_attendance_rate(student, year, month):
 
 
     # Retrieve all attendance records for the student within the specified month
-    attendance_records_in_month = Attendance.objects.filter(
-        student=student,
-        attendance_date__gte=start_date_month,
-        attendance_date__lte=end_date_month
-    )
+    attendance_records_in_month = _student_attendance_between(student, start_date_month, end_date_month)
 
     # Count days marked present
     days_present_count = attendance_records_in_month.filter(is_absent=False).count()
@@ -286,6 +676,11 @@ def get_attendance_trends(start_date, end_date, period='day'):
     Calculates overall attendance trends (count of present students)
     grouped by a specified period (day, week, or month) within a given date range.
 
+    Reads the `DailyAttendanceStats` rollup (one row per day) instead of the raw
+    `Attendance` table, so the cost depends on the number of days, not on the number
+    of attendance records. Days missing from the rollup can be filled with
+    `manage.py rebuild_attendance_stats`.
+
     Args:
         start_date (datetime.date): The beginning of the date range (inclusive).
         end_date (datetime.date): The end of the date range (inclusive).
@@ -302,30 +697,28 @@ def get_attendance_trends(start_date, end_date, period='day'):
     Raises:
         ValueError: If `period` is not one of 'day', 'week', or 'month'.
     """
-    # Filter for attendance records of present students within the date range
-    queryset = Attendance.objects.filter(
-        attendance_date__gte=start_date,
-        attendance_date__lte=end_date,
-        is_absent=False  # Consider only students marked as present
+    queryset = DailyAttendanceStats.objects.filter(
+        date__gte=start_date,
+        date__lte=end_date,
     )
 
     # Determine the truncation function based on the specified period
     if period == 'day':
-        trunc_function = TruncDay('attendance_date')
+        trunc_function = TruncDay('date')
     elif period == 'week':
-        trunc_function = TruncWeek('attendance_date') # Note: Week start depends on DB settings (e.g., Sunday or Monday)
+        trunc_function = TruncWeek('date') # Note: Week start depends on DB settings (e.g., Sunday or Monday)
     elif period == 'month':
-        trunc_function = TruncMonth('attendance_date')
+        trunc_function = TruncMonth('date')
     else:
         raise ValueError("Invalid `period`. Choose from 'day', 'week', 'month'.")
 
-    # Annotate the queryset to group by the chosen period and count present students
+    # Group the daily rows by the chosen period and add up the present counts
     trends = queryset.annotate(
         period_start=trunc_function  # Create a new field 'period_start' with the truncated date
     ).values(
         'period_start'  # Group by this truncated date
     ).annotate(
-        present_count=Count('id')  # Count the number of attendance records (i.e., present students) in each group
+        present_count=Sum('present')
     ).order_by(
         'period_start'  # Order the results chronologically
     )
@@ -354,101 +747,75 @@ def get_student_payment_history(student):
     return student.payments.all().order_by('-month')
 
 
+def get_latest_payments(student_ids=None):
+    """
+    Retrieves the most recent payment (by `month`) of each student in one query.
+
+    On PostgreSQL this is a `SELECT DISTINCT ON (student_id) ... ORDER BY student_id, month DESC`
+    that reads the `unique_payment_per_month` index once. Other backends keep the latest row of
+    each student with a correlated subquery on the same index.
+
+    Args:
+        student_ids (Iterable[int] | QuerySet, optional): Restrict to these students
+                                                          (a `values('id')` queryset stays a subquery).
+                                                          Defaults to all students.
+
+    Returns:
+        dict[int, Payment]: The latest payment keyed by student id; students who never paid are absent.
+    """
+    return {payment.student_id: payment for payment in _latest_payments(student_ids)}
+
+
+def _latest_payments(student_ids=None):
+    payments = Payment.objects.all()
+    if student_ids is not None:
+        payments = payments.filter(student_id__in=student_ids)
+
+    if connection.features.can_distinct_on_fields:
+        return payments.order_by('student_id', '-month').distinct('student_id')
+    latest = Payment.objects.filter(student=OuterRef('student')).order_by('-month').values('id')[:1]
+    return payments.filter(id=Subquery(latest))
+
+
 def get_revenue_trends(start_date, end_date, period='month'):
     """
-    Calculates total estimated revenue from payments, grouped by a specified period (month or year)
+    Calculates total revenue from payments, grouped by a specified period (month or year)
     within a given date range.
 
-    Important Assumption:
-    This function currently estimates revenue based on the *current* `month_price`
-    stored in the `Basics` model. This is a simplification. For accurate historical
-    revenue tracking, the actual price paid should be stored with each `Payment` record,
-    and this function should sum those actual amounts.
+    Revenue is read from the `MonthlyRevenue` rollup, which sums the amounts actually
+    stored on each `Payment`, so past months are not affected by later price changes.
 
     Args:
         start_date (datetime.date): The beginning of the date range for payments (inclusive, based on Payment.month).
         end_date (datetime.date): The end of the date range for payments (inclusive, based on Payment.month).
         period (str, optional): The period to group revenue by. Can be 'month' or 'year'.
-                                Defaults to 'month'.
+                                Defaults to 'month'; any other value is treated as 'month'.
 
     Returns:
         list[dict]: A list of dictionaries, where each dictionary represents a period
                     and contains:
                     - 'period_start' (datetime.date): The start date of the period
                                                      (first day of month or first day of year).
-                    - 'total_revenue' (Decimal/float): The estimated total revenue for that period.
-                    Returns an empty list if `Basics` settings or `month_price` is not found.
+                    - 'total_revenue' (int): The total revenue for that period.
     """
-    # Retrieve the current standard month price from Basics.
-    # This is a simplification; ideally, price_paid would be on Payment model.
-    try:
-        basics = Basics.objects.first()
-        if not basics or basics.month_price is None:
-            # If no price is set, revenue calculation is not possible.
-            return [] 
-        current_month_price = basics.month_price # Assuming month_price is a Decimal or float
-    except Basics.DoesNotExist:
-        # If Basics settings don't exist, cannot calculate revenue.
-        return []
-
-    # Filter payments within the specified date range (based on the 'month' field of Payment model)
-    queryset = Payment.objects.filter(
-        month__gte=start_date, 
-        month__lte=end_date
+    queryset = MonthlyRevenue.objects.filter(
+        month__gte=start_date,
+        month__lte=end_date,
     )
 
-    # Determine truncation strategy based on the period
-    if period == 'month':
-        trunc_function = TruncMonth('month')
-    elif period == 'year':
-        # For year, we group by month first, then aggregate in Python.
-        # Django's TruncYear isn't universally supported or might behave differently across DBs.
-        # A common approach is to truncate to month, then process.
-        trunc_function = TruncMonth('month') # Will be further processed for 'year'
+    if period == 'year':
+        rows = queryset.annotate(
+            period_start=TruncYear('month')
+        ).values('period_start').annotate(
+            total_revenue=Sum('total_amount')
+        ).order_by('period_start')
     else:
-        # Default to month or raise an error for invalid period
-        # For now, defaulting to month for simplicity if period is invalid.
-        trunc_function = TruncMonth('month')
-
+        rows = queryset.annotate(
+            period_start=F('month'),
+            total_revenue=F('total_amount'),
+        ).values('period_start', 'total_revenue').order_by('period_start')
 
-    # Annotate queryset to group by the period and count payments
-    # This count will then be multiplied by `current_month_price`.
-    payment_counts_by_period = queryset.annotate(
-        period_group=trunc_function  # Group by the truncated date (month or start of month for year)
-    ).values(
-        'period_group'  # Select the grouping period
-    ).annotate(
-        num_payments=Count('id')  # Count payments in each group
-    ).order_by(
-        'period_group'  # Order chronologically
-    )
-    
-    # Process the grouped data to calculate revenue
-    revenue_trends_data = []
-    if period == 'year':
-        yearly_aggregated_revenue = {} # {<year_int>: <total_revenue_for_year>}
-        for entry in payment_counts_by_period:
-            year_of_payment = entry['period_group'].year
-            revenue_for_entry = entry['num_payments'] * current_month_price
-            
-            if year_of_payment not in yearly_aggregated_revenue:
-                yearly_aggregated_revenue[year_of_payment] = 0
-            yearly_aggregated_revenue[year_of_payment] += revenue_for_entry
-        
-        # Convert aggregated yearly data to the list format
-        for year_val, total_revenue in sorted(yearly_aggregated_revenue.items()):
-            revenue_trends_data.append({
-                'period_start': date(year_val, 1, 1), # Represent year by its first day
-                'total_revenue': total_revenue
-            })
-    else: # For 'month' period
-        for entry in payment_counts_by_period:
-            revenue_trends_data.append({
-                'period_start': entry['period_group'], # This is already the first of the month
-                'total_revenue': entry['num_payments'] * current_month_price
-            })
-            
-    return revenue_trends_data
+    return list(rows)
 
 def process_message_template(template_string, context_dict):
     '''
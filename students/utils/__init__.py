@@ -10,13 +10,23 @@ from .whatsapp_Sel import send_whatsapp_message
 from ..util import (
     get_daily_attendance_summary,
     get_absent_students_today,
+    mark_absentees,
+    record_presence,
+    consume_free_try,
+    pay_and_record_presence,
+    bump_daily_attendance_stats,
+    rebuild_daily_attendance_stats,
+    refresh_daily_attendance_stats,
     get_student_remaining_free_tries,
     get_students_paid_current_month,
     get_students_with_overdue_payments,
     process_student_payment,
+    record_payment,
+    rebuild_monthly_revenue,
     get_monthly_attendance_rate,
     get_attendance_trends,
     get_student_payment_history,
+    get_latest_payments,
     get_revenue_trends,
     process_message_template, # تصدير الدالة الجديدة
     get_default_template_context, # تصدير الدالة الجديدة
@@ -32,13 +42,23 @@ __all__ = [
     'send_whatsapp_message',
     'get_daily_attendance_summary',
     'get_absent_students_today',
+    'mark_absentees',
+    'record_presence',
+    'consume_free_try',
+    'pay_and_record_presence',
+    'bump_daily_attendance_stats',
+    'rebuild_daily_attendance_stats',
+    'refresh_daily_attendance_stats',
     'get_student_remaining_free_tries',
     'get_students_paid_current_month',
     'get_students_with_overdue_payments',
     'process_student_payment',
+    'record_payment',
+    'rebuild_monthly_revenue',
     'get_monthly_attendance_rate',
     'get_attendance_trends',
     'get_student_payment_history',
+    'get_latest_payments',
     'get_revenue_trends',
     'process_message_template', # إضافة الدالة الجديدة إلى __all__
     'get_default_template_context', # إضافة الدالة الجديدة إلى __all__
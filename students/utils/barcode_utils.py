@@ -1,13 +1,96 @@
+import hashlib
+import json
 import os
+import tempfile
+from functools import lru_cache
+
 import barcode
-from barcode.writer import ImageWriter
 from django.conf import settings
 
-def generate_barcode_image(barcode_number):
-    barcode_folder = os.path.join(settings.MEDIA_ROOT, 'barcodes')
+from ..barcode_render import IMAGE_MODE, render_png
+
+# الصور تُخزن باسم يعتمد على قيمة الباركود وخيارات الرسم، فلا تُعاد كتابتها ما دامت موجودة
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+RENDER_CACHE_SIZE = 512
+
+
+def _writer_options(writer_options=None):
+    if writer_options is None:
+        writer_options = getattr(settings, 'BARCODE_WRITER_OPTIONS', {})
+    return dict(writer_options)
+
+
+def barcode_cache_key(barcode_number, writer_options=None):
+    """مفتاح ثابت للصورة: قيمة الباركود + خيارات الرسم + نسخة مكتبة python-barcode."""
+    payload = json.dumps(
+        [str(barcode_number), _writer_options(writer_options), IMAGE_MODE, barcode.version],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def barcode_cache_path(barcode_number, writer_options=None):
+    key = barcode_cache_key(barcode_number, writer_options)
+    return os.path.join(settings.MEDIA_ROOT, 'barcodes', f"{barcode_number}-{key}.png")
+
+
+def _is_valid_png(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+    except OSError:
+        return False
+
+
+def writer_options_json(writer_options=None):
+    return json.dumps(_writer_options(writer_options), sort_keys=True)
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render(barcode_number, options_json):
+    return render_png(barcode_number, options_json)
+
+
+def render_barcode_png(barcode_number, writer_options=None):
+    """يرسم الباركود كـ PNG في الذاكرة ويعيد البايتات (دون المرور بالقرص)."""
+    return _render(str(barcode_number), writer_options_json(writer_options))
+
+
+def read_cached_barcode_png(barcode_number, writer_options=None):
+    """يعيد بايتات الصورة المحفوظة إن كانت صالحة، وإلا None."""
+    try:
+        with open(barcode_cache_path(barcode_number, writer_options), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data if data.startswith(PNG_SIGNATURE) else None
+
+
+def store_barcode_png(barcode_number, data, writer_options=None):
+    """يحفظ بايتات صورة مرسومة مسبقاً في مكانها في الـ cache ويعيد المسار."""
+    full_path = barcode_cache_path(barcode_number, writer_options)
+    barcode_folder = os.path.dirname(full_path)
     os.makedirs(barcode_folder, exist_ok=True)
+    # كتابة ذرية: ملف مؤقت ثم استبدال، حتى لا يقرأ طلب آخر صورة نصف مكتوبة
+    fd, tmp_path = tempfile.mkstemp(dir=barcode_folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return full_path
+
 
-    filepath = os.path.join(barcode_folder, f"{barcode_number}")
-    code128 = barcode.get('code128', barcode_number, writer=ImageWriter())
-    full_path = code128.save(filepath)  # يحفظ كـ .png تلقائيًا
-    return full_path  
\ No newline at end of file
+def generate_barcode_image(barcode_number, writer_options=None):
+    """
+    يعيد مسار صورة الباركود في MEDIA_ROOT/barcodes، ويرسمها فقط إذا لم
+    يكن هناك ملف صالح بنفس المفتاح.
+    """
+    full_path = barcode_cache_path(barcode_number, writer_options)
+    if _is_valid_png(full_path):
+        return full_path
+    return store_barcode_png(barcode_number, render_barcode_png(barcode_number, writer_options), writer_options)
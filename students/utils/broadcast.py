@@ -0,0 +1,85 @@
+# students/utils/broadcast.py
+"""
+توزيع الرسائل العامة على أولياء الأمور.
+
+يقرأ الطلاب بدفعات (iterator + only) ويضع الرسائل المخصصة في الطابور الدائم
+بإدخالات جماعية، ويحدّث عدادات BroadcastMessage (queued/sent/failed) حتى يتابع
+المشرف التقدم بينما يرسلها المُرسِل في الخلفية.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import Students, BroadcastMessage
+from ..util import process_message_template, get_default_template_context
+from .whatsapp_queue import queue_whatsapp_messages, log_failed_delivery
+
+BROADCAST_HEADER = "📢 *رسالة عامة من الإدارة:*\n\n"
+BROADCAST_SIGNATURE = "\n\nمع تحيات،\n*م. عبدالله عمر وفريق العمل* 👨‍🏫"
+BROADCAST_MESSAGE_TYPE = 'Broadcast Message'
+BROADCAST_CHUNK_SIZE = 500
+
+RECIPIENT_FIELDS = ('id', 'name', 'father_phone', 'has_whatsapp', 'barcode')
+
+
+def render_broadcast_text(content, base_context, student):
+    """يبني نص الرسالة لطالب واحد (السياق العام يُحسب مرة واحدة للرسالة كلها)."""
+    context = dict(base_context)
+    context['student_name'] = student.name
+    context['barcode'] = student.barcode
+    context['father_phone'] = student.father_phone
+    return BROADCAST_HEADER + process_message_template(content, context) + BROADCAST_SIGNATURE
+
+
+def _flush(broadcast, chunk, skipped):
+    with transaction.atomic():
+        if chunk:
+            queue_whatsapp_messages(chunk, broadcast=broadcast)
+        BroadcastMessage.objects.filter(pk=broadcast.pk).update(
+            queued_count=F('queued_count') + len(chunk),
+            failed_count=F('failed_count') + skipped,
+        )
+
+
+def enqueue_broadcast(broadcast, students=None, chunk_size=BROADCAST_CHUNK_SIZE):
+    """
+    يضع رسالة عامة في الطابور لكل الطلاب (أو لمجموعة students المحددة).
+    الطلاب بدون رقم هاتف أو بدون WhatsApp يُسجلون كفشل فوراً ولا تُنشأ لهم رسائل.
+    يعيد عدد الرسائل التي وُضعت في الطابور.
+    """
+    if students is None:
+        students = Students.objects.all()
+    recipients = students.only(*RECIPIENT_FIELDS).order_by('id').iterator(chunk_size=chunk_size)
+    base_context = get_default_template_context()
+
+    queued = 0
+    chunk, skipped = [], 0
+    for student in recipients:
+        phone = student.father_phone or ''
+        if not phone or not student.has_whatsapp:
+            # المُرسِل لا يقرأ السبب: لو دخلت الطابور لأُعيدت محاولتها حتى WHATSAPP_MAX_ATTEMPTS
+            log_failed_delivery(phone, BROADCAST_MESSAGE_TYPE, 'No WhatsApp or Missing phone', '',
+                                student_id=student.id, student_name=student.name)
+            skipped += 1
+        else:
+            ctx = {
+                'student_id': student.id,
+                'student_name': student.name,
+                'message_type': BROADCAST_MESSAGE_TYPE,
+                'reason': '',
+            }
+            chunk.append((phone, render_broadcast_text(broadcast.content, base_context, student), ctx))
+
+        if len(chunk) + skipped >= chunk_size:
+            _flush(broadcast, chunk, skipped)
+            queued += len(chunk)
+            chunk, skipped = [], 0
+
+    if chunk or skipped:
+        _flush(broadcast, chunk, skipped)
+        queued += len(chunk)
+
+    broadcast.sent_at = timezone.now()
+    broadcast.save(update_fields=['sent_at'])
+    broadcast.refresh_from_db(fields=['queued_count', 'sent_count', 'failed_count'])
+    return queued
@@ -1,131 +1,306 @@
 # students/utils/failed_numbers_manager.py
+"""
+سجل الأرقام التي فشل الإرسال إليها، في جدول DeliveryFailure بدل ملفات CSV/JSON.
 
-import os
-import json
+الكتابة على دفعات: record_failure يضيف السجل لذاكرة مؤقتة تُكتب بإدخال جماعي
+واحد عند امتلائها (FAILURE_BATCH_SIZE) أو بعد FAILURE_FLUSH_SECONDS، وفي نهاية
+كل طلب HTTP (students.middleware) وعند توقف المُرسِل وعند خروج العملية. دوال القراءة تكتب المتبقي أولاً.
+
+لاستيراد السجلات القديمة من الملفات: manage.py import_delivery_failures
+"""
+import atexit
 import csv
+import os
+import re
+import threading
+import time
 from datetime import datetime
+
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse
-from ..models import Students
+from django.core.paginator import Paginator
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from ..models import DeliveryFailure, Students
 
 FAILED_NUMBERS_FILE = os.path.abspath("./failed_whatsapp_numbers.json")
 
-def get_failed_numbers_summary():
+FAILURE_BATCH_SIZE = 50
+FAILURE_FLUSH_SECONDS = 5
+
+_buffer = []
+_buffer_started = None
+_buffer_lock = threading.Lock()
+
+
+def classify_failure(phone, reason='', details=''):
+    """يستنتج نوع الخطأ (أحد مفاتيح DeliveryFailure.ERROR_TYPE_CHOICES) من السبب."""
+    text = f"{reason} {details}".lower()
+    if not phone:
+        return 'invalid_format'
+    if 'retry send failed' in text:
+        return 'retry_failed'
+    if 'initial send failed' in text or 'send button' in text:
+        return 'no_send_button'
+    if 'no whatsapp' in text:
+        return 'whatsapp_error'
+    if 'stacktrace' in text or 'webdriver' in text or 'selenium' in text:
+        return 'selenium_error'
+    return 'send_failed'
+
+
+def record_failure(phone, message_type='', reason='', details='', student_id=None, student_name='',
+                   error_type=None, created_at=None):
+    """يضيف حالة فشل للدفعة الحالية؛ تُكتب في قاعدة البيانات مع الدفعة."""
+    global _buffer_started
+    failure = DeliveryFailure(
+        phone=phone or '',
+        student_id=student_id,
+        student_name=(student_name or '')[:100],
+        message_type=(message_type or '')[:50],
+        error_type=error_type or classify_failure(phone, reason, details),
+        reason=(reason or '')[:255],
+        details=details or '',
+        created_at=created_at or timezone.now(),
+    )
+    with _buffer_lock:
+        _buffer.append(failure)
+        if _buffer_started is None:
+            _buffer_started = time.monotonic()
+        due = (
+            len(_buffer) >= FAILURE_BATCH_SIZE
+            or time.monotonic() - _buffer_started >= FAILURE_FLUSH_SECONDS
+        )
+    if due:
+        flush_failures()
+
+
+def flush_failures():
+    """يكتب الحالات المتراكمة بإدخال جماعي واحد. يعيد عددها."""
+    global _buffer, _buffer_started
+    with _buffer_lock:
+        batch, _buffer, _buffer_started = _buffer, [], None
+    if not batch:
+        return 0
+    # طالب حُذف بعد تسجيل الفشل: نحتفظ بالاسم فقط
+    student_ids = {failure.student_id for failure in batch if failure.student_id}
+    if student_ids:
+        existing = set(Students.objects.filter(id__in=student_ids).values_list('id', flat=True))
+        for failure in batch:
+            if failure.student_id not in existing:
+                failure.student_id = None
+    DeliveryFailure.objects.bulk_create(batch)
+    return len(batch)
+
+
+atexit.register(flush_failures)
+
+
+def failed_number_groups():
     """
-    يعيد ملخص شامل للأرقام الفاشلة مع معلومات الطلاب
+    حالة لكل (رقم، اسم طالب): عدد المحاولات، آخر محاولة، ونوع وسبب آخر خطأ.
+    استعلام تجميعي واحد؛ آخر خطأ بـ Subquery على الفهرس (phone, created_at).
     """
-    try:
-        if not os.path.exists(FAILED_NUMBERS_FILE):
-            return {
-                'total_failed': 0,
-                'failed_records': [],
-                'summary_by_error': {},
-                'students_with_issues': []
-            }
-        
-        with open(FAILED_NUMBERS_FILE, 'r', encoding='utf-8') as f:
-            failed_data = json.load(f)
-        
-        # إحصائيات الأخطاء
-        error_summary = {}
-        students_with_issues = []
-        
-        for record in failed_data:
-            error_type = record.get('error_type', 'unknown')
-            if error_type in error_summary:
-                error_summary[error_type] += 1
-            else:
-                error_summary[error_type] = 1
-            
-            # محاولة جلب معلومات الطالب من قاعدة البيانات
-            if record.get('student_name'):
-                try:
-                    student = Students.objects.get(name=record['student_name'])
-                    student_info = {
-                        'id': student.id,
-                        'name': student.name,
-                        'phone': record['phone'],
-                        'barcode': student.barcode,
-                        'error_type': error_type,
-                        'attempts': record.get('attempts', 1),
-                        'last_attempt': record.get('last_attempt', record.get('timestamp')),
-                        'error_message': record.get('error_message', '')
-                    }
-                    students_with_issues.append(student_info)
-                except Students.DoesNotExist:
-                    # الطالب لم يعد موجوداً في قاعدة البيانات
-                    student_info = {
-                        'id': None,
-                        'name': record['student_name'],
-                        'phone': record['phone'],
-                        'barcode': 'غير متوفر',
-                        'error_type': error_type,
-                        'attempts': record.get('attempts', 1),
-                        'last_attempt': record.get('last_attempt', record.get('timestamp')),
-                        'error_message': record.get('error_message', ''),
-                        'note': 'الطالب لم يعد موجوداً في النظام'
-                    }
-                    students_with_issues.append(student_info)
-        
-        return {
-            'total_failed': len(failed_data),
-            'failed_records': failed_data,
-            'summary_by_error': error_summary,
-            'students_with_issues': students_with_issues
-        }
-        
-    except Exception as e:
-        return {
-            'error': f"خطأ في قراءة البيانات: {str(e)}",
-            'total_failed': 0,
-            'failed_records': [],
-            'summary_by_error': {},
-            'students_with_issues': []
+    latest = DeliveryFailure.objects.filter(
+        phone=OuterRef('phone'), student_name=OuterRef('student_name')
+    ).order_by('-created_at')
+    return (
+        DeliveryFailure.objects.values('phone', 'student_name')
+        .annotate(
+            attempts=Count('id'),
+            last_attempt=Max('created_at'),
+            student_pk=Max('student'),
+            last_error_type=Subquery(latest.values('error_type')[:1]),
+            last_reason=Subquery(latest.values('reason')[:1]),
+        )
+        .order_by('-last_attempt')
+    )
+
+
+def _phone_keys(phone):
+    """صيغ الرقم المحتملة في father_phone: كما هو، و 01xxxxxxxxx بدل +201xxxxxxxxx."""
+    digits = re.sub(r'\D', '', phone or '')
+    if not digits:
+        return set()
+    local = digits[2:] if digits.startswith('20') and len(digits) > 11 else digits.lstrip('0')
+    return {phone, digits, local, f"0{local}"}
+
+
+def _students_by_phone(keys, fields):
+    return Students.objects.only(*fields).filter(father_phone__in=keys).order_by('id')
+
+
+def _resolve_students(groups):
+    """
+    طالب كل مجموعة باستعلامين على الأكثر: in_bulk بالمعرّف المسجل وقت الفشل، ثم
+    للسجلات بدون معرّف (المستوردة من السجلات القديمة) بحث واحد في father_phone المفهرس.
+    عند تشارك الإخوة في الرقم يُفضل من يطابق اسمه الاسم المسجل.
+    """
+    fields = ('id', 'name', 'father_phone', 'barcode')
+    by_id = Students.objects.only(*fields).in_bulk(
+        {group['student_pk'] for group in groups if group['student_pk']}
+    )
+
+    keys = set()
+    for group in groups:
+        if group['student_pk'] is None:
+            keys |= _phone_keys(group['phone'])
+    by_phone = {}
+    if keys:
+        for student in _students_by_phone(keys, fields):
+            by_phone.setdefault(student.father_phone, []).append(student)
+
+    resolved = []
+    for group in groups:
+        student = by_id.get(group['student_pk'])
+        if student is None and group['student_pk'] is None:
+            candidates = [s for key in _phone_keys(group['phone']) for s in by_phone.get(key, [])]
+            named = [s for s in candidates if s.name == group['student_name']]
+            if named or (candidates and not group['student_name']):
+                student = min(named or candidates, key=lambda s: s.id)
+        resolved.append(student)
+    return resolved
+
+
+def _record(group):
+    return {
+        'phone': group['phone'],
+        'student_name': group['student_name'],
+        'error_type': group['last_error_type'],
+        'attempts': group['attempts'],
+        'last_attempt': group['last_attempt'],
+        'error_message': group['last_reason'],
+    }
+
+
+def _student_info(group, student):
+    info = {
+        'id': student.id if student else None,
+        'name': student.name if student else group['student_name'],
+        'phone': group['phone'],
+        'barcode': student.barcode if student else 'غير متوفر',
+        'error_type': group['last_error_type'],
+        'attempts': group['attempts'],
+        'last_attempt': group['last_attempt'],
+        'error_message': group['last_reason'],
+    }
+    if student is None and group['student_name']:
+        info['note'] = 'الطالب لم يعد موجوداً في النظام'
+    return info
+
+
+# الملخص محفوظ في الذاكرة حتى يتغير الجدول: (آخر معرّف، عدد السجلات) يتغيران مع
+# أي إضافة أو حذف ولو من عملية أخرى (المُرسِل)، وفحصهما استعلام واحد سريع.
+# تعديل بيانات الطالب نفسه لا يظهر إلا مع أول فشل جديد أو حذف سجل.
+SUMMARY_PAGE_SIZE = 50
+
+_summary_cache = {'version': None, 'summary': None}
+_summary_lock = threading.Lock()
+
+
+def _summary_version():
+    stats = DeliveryFailure.objects.aggregate(last=Max('id'), total=Count('id'))
+    return stats['last'], stats['total']
+
+
+def _build_summary():
+    groups = list(failed_number_groups())
+    students = _resolve_students(groups)
+    summary_by_error = dict(
+        DeliveryFailure.objects.order_by().values_list('error_type').annotate(total=Count('id'))
+    )
+    return {
+        'total_failed': len(groups),
+        'total_failures': sum(summary_by_error.values()),
+        'failed_records': [_record(group) for group in groups],
+        'summary_by_error': summary_by_error,
+        'students_with_issues': [
+            _student_info(group, student)
+            for group, student in zip(groups, students)
+            if student or group['student_name']
+        ],
+    }
+
+
+def get_failed_numbers_summary(page=None, page_size=SUMMARY_PAGE_SIZE):
+    """
+    يعيد ملخص شامل للأرقام الفاشلة مع معلومات الطلاب.
+    مع page تُقسم students_with_issues إلى صفحات بحجم page_size ويضاف مفتاح pagination.
+    """
+    flush_failures()
+    version = _summary_version()
+    with _summary_lock:
+        if _summary_cache['version'] != version:
+            _summary_cache['summary'] = _build_summary()
+            _summary_cache['version'] = version
+        cached = _summary_cache['summary']
+
+    # نسخ سطحية حتى لا يعدّل المستدعي النسخة المحفوظة
+    summary = {
+        **cached,
+        'failed_records': list(cached['failed_records']),
+        'summary_by_error': dict(cached['summary_by_error']),
+        'students_with_issues': list(cached['students_with_issues']),
+    }
+    if page is not None:
+        page_obj = Paginator(cached['students_with_issues'], page_size).get_page(page)
+        summary['students_with_issues'] = list(page_obj.object_list)
+        summary['pagination'] = {
+            'page': page_obj.number,
+            'num_pages': page_obj.paginator.num_pages,
+            'page_size': page_size,
+            'total': page_obj.paginator.count,
+            'has_next': page_obj.has_next(),
+            'has_previous': page_obj.has_previous(),
         }
+    return summary
+
+
+def clear_summary_cache():
+    """يلغي الملخص المحفوظ (في الاختبارات)."""
+    with _summary_lock:
+        _summary_cache['version'] = None
+        _summary_cache['summary'] = None
+
 
 def export_failed_numbers_to_csv():
     """
     يصدر الأرقام الفاشلة إلى ملف CSV
     """
-    summary = get_failed_numbers_summary()
-    
-    if summary['total_failed'] == 0:
+    students = get_failed_numbers_summary()['students_with_issues']
+    if not students:
         return None
-    
+
     # إنشاء ملف CSV
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"failed_whatsapp_numbers_{timestamp}.csv"
     filepath = os.path.join(settings.MEDIA_ROOT, filename)
-    
+
     # التأكد من وجود المجلد
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    
-    try:
-        with open(filepath, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            fieldnames = [
-                'اسم الطالب', 'رقم الهاتف', 'الباركود', 'نوع الخطأ', 
-                'رسالة الخطأ', 'عدد المحاولات', 'آخر محاولة', 'ملاحظات'
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            writer.writeheader()
-            for student in summary['students_with_issues']:
-                writer.writerow({
-                    'اسم الطالب': student['name'],
-                    'رقم الهاتف': student['phone'],
-                    'الباركود': student.get('barcode', 'غير متوفر'),
-                    'نوع الخطأ': student['error_type'],
-                    'رسالة الخطأ': student.get('error_message', ''),
-                    'عدد المحاولات': student.get('attempts', 1),
-                    'آخر محاولة': student.get('last_attempt', ''),
-                    'ملاحظات': student.get('note', '')
-                })
-        
-        return filepath
-        
-    except Exception as e:
-        print(f"خطأ في إنشاء ملف CSV: {e}")
-        return None
+
+    with open(filepath, 'w', newline='', encoding='utf-8-sig') as csvfile:
+        fieldnames = [
+            'اسم الطالب', 'رقم الهاتف', 'الباركود', 'نوع الخطأ',
+            'رسالة الخطأ', 'عدد المحاولات', 'آخر محاولة', 'ملاحظات'
+        ]
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+
+        writer.writeheader()
+        for student in students:
+            writer.writerow({
+                'اسم الطالب': student['name'],
+                'رقم الهاتف': student['phone'],
+                'الباركود': student['barcode'],
+                'نوع الخطأ': get_error_type_description(student['error_type']),
+                'رسالة الخطأ': student['error_message'],
+                'عدد المحاولات': student['attempts'],
+                'آخر محاولة': timezone.localtime(student['last_attempt']).strftime('%Y-%m-%d %H:%M:%S'),
+                'ملاحظات': student.get('note', ''),
+            })
+
+    return filepath
+
 
 def fix_student_phone_number(student_id, new_phone):
     """
@@ -135,75 +310,46 @@ def fix_student_phone_number(student_id, new_phone):
         student = Students.objects.get(id=student_id)
         old_phone = student.father_phone
         student.father_phone = new_phone
-        student.save()
-        
+        student.save(update_fields=['father_phone'])
+
         # إزالة السجل من الأرقام الفاشلة
         remove_failed_number_record(old_phone, student.name)
-        
+
         return True, f"تم تحديث رقم هاتف {student.name} من {old_phone} إلى {new_phone}"
-        
+
     except Students.DoesNotExist:
         return False, "الطالب غير موجود"
     except Exception as e:
         return False, f"خطأ في التحديث: {str(e)}"
 
+
 def remove_failed_number_record(phone, student_name=None):
     """
-    يزيل سجل رقم فاشل من الملف
+    يزيل سجلات رقم فاشل (لطالب محدد إن أُعطي الاسم)
     """
-    try:
-        if not os.path.exists(FAILED_NUMBERS_FILE):
-            return True
-        
-        with open(FAILED_NUMBERS_FILE, 'r', encoding='utf-8') as f:
-            failed_data = json.load(f)
-        
-        # فلترة البيانات لإزالة السجل المطلوب
-        if student_name:
-            failed_data = [
-                record for record in failed_data 
-                if not (record.get('phone') == phone and record.get('student_name') == student_name)
-            ]
-        else:
-            failed_data = [
-                record for record in failed_data 
-                if record.get('phone') != phone
-            ]
-        
-        # حفظ البيانات المحدثة
-        with open(FAILED_NUMBERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(failed_data, f, ensure_ascii=False, indent=2)
-        
-        return True
-        
-    except Exception as e:
-        print(f"خطأ في إزالة السجل: {e}")
-        return False
+    flush_failures()
+    _failures_for(phone, student_name).delete()
+    return True
+
+
+def _failures_for(phone, student_name=None):
+    failures = DeliveryFailure.objects.filter(phone=phone)
+    if student_name:
+        failures = failures.filter(student_name=student_name)
+    return failures
+
 
 def clear_all_failed_records():
     """
     يمسح جميع سجلات الأرقام الفاشلة
     """
-    try:
-        if os.path.exists(FAILED_NUMBERS_FILE):
-            os.remove(FAILED_NUMBERS_FILE)
-        return True
-    except Exception as e:
-        print(f"خطأ في مسح السجلات: {e}")
-        return False
+    flush_failures()
+    DeliveryFailure.objects.all().delete()
+    return True
+
 
 def get_error_type_description(error_type):
     """
     يعيد وصف مفهوم لنوع الخطأ
     """
-    descriptions = {
-        'invalid_format': 'صيغة الرقم غير صالحة',
-        'whatsapp_error': 'خطأ من واتساب (الرقم غير موجود أو غير نشط)',
-        'send_failed': 'فشل في الإرسال',
-        'no_send_button': 'الرقم غير موجود على واتساب',
-        'selenium_error': 'خطأ تقني في المتصفح',
-        'retry_failed': 'فشل في إعادة المحاولة',
-        'final_check_failed': 'فشل في التحقق النهائي',
-        'unknown': 'خطأ غير محدد'
-    }
-    return descriptions.get(error_type, error_type)
\ No newline at end of file
+    return dict(DeliveryFailure.ERROR_TYPE_CHOICES).get(error_type, error_type)
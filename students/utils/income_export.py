@@ -0,0 +1,53 @@
+# students/utils/income_export.py
+"""
+تصدير سجل المدفوعات كاملاً دون تحميله في الذاكرة مرة واحدة.
+"""
+import csv
+import tempfile
+
+EXPORT_HEADERS = ['اسم الطالب', 'شهر الدفع', 'المبلغ المدفوع', 'تاريخ ووقت الدفع']
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """ملف وهمي يعيد ما يُكتب فيه بدلاً من تخزينه (للاستخدام مع csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def _ledger_rows(payments):
+    rows = payments.values_list('student__name', 'month', 'amount', 'paid_on')
+    for name, month, amount, paid_on in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [name, month.strftime('%Y-%m'), amount, paid_on.strftime('%Y-%m-%d %H:%M')]
+
+
+def iter_income_csv(payments):
+    """
+    يولّد أسطر CSV سطراً بسطر لاستخدامها مع StreamingHttpResponse.
+    يبدأ بـ BOM حتى يفتح Excel النص العربي بشكل صحيح.
+    """
+    writer = csv.writer(_Echo())
+    yield '\ufeff'
+    yield writer.writerow(EXPORT_HEADERS)
+    for row in _ledger_rows(payments):
+        yield writer.writerow(row)
+
+
+def write_income_xlsx(payments):
+    """
+    يكتب السجل إلى ملف XLSX مؤقت بوضع write_only (لا يحتفظ بالصفوف في الذاكرة)
+    ويعيد الملف مفتوحاً ومؤشره في البداية، جاهزاً لـ FileResponse.
+    """
+    from openpyxl import Workbook  # اعتماد اختياري، مطلوب أيضاً لاستيراد XLSX في لوحة التحكم
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('الدخل')
+    sheet.append(EXPORT_HEADERS)
+    for row in _ledger_rows(payments):
+        sheet.append(row)
+
+    tmp = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook.save(tmp)
+    tmp.seek(0)
+    return tmp
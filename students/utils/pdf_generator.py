@@ -1,33 +1,156 @@
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from .barcode_utils import generate_barcode_image
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from contextlib import contextmanager, nullcontext
+from itertools import repeat
+
 from django.conf import settings
+from reportlab import rl_config
+from reportlab.graphics.barcode.code128 import Code128
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from ..barcode_render import render_png
 from ..models import Students
-import os
+from .barcode_utils import read_cached_barcode_png, store_barcode_png, writer_options_json
 
-def generate_barcodes_pdf():
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+# شبكة الملصقات في صفحة A4
+PAGE_MARGIN = 36
+LABEL_COLUMNS = 3
+LABEL_HEIGHT = 100
+BARCODE_WIDTH = 160
+BARCODE_HEIGHT = 50
 
-    students = Students.objects.all()
-    x, y = 50, height - 100
+# طريقة رسم الباركود: 'vector' (رسم مباشر بأدوات ReportLab) أو 'raster' (صور PNG)
+PDF_MODE_VECTOR = 'vector'
+PDF_MODE_RASTER = 'raster'
+PDF_MODES = (PDF_MODE_VECTOR, PDF_MODE_RASTER)
+VECTOR_BAR_WIDTH = 1.0  # عرض أنحف خط بالنقاط
 
-    for student in students:
-        # توليد الصورة في media/barcodes/
-        full_path = generate_barcode_image(student.barcode)
+# عدد الصور الناقصة الذي يستحق تشغيل عمليات متوازية (تشغيل العمليات له تكلفة ثابتة)
+PARALLEL_THRESHOLD = 200
+RENDER_CHUNK_SIZE = 64
+
+
+def _pdf_workers():
+    return getattr(settings, 'BARCODE_PDF_WORKERS', None) or os.cpu_count() or 1
+
+
+def _render_missing(barcodes, options_json, workers):
+    """يرسم الصور غير الموجودة في الـ cache، بعمليات متوازية إذا كان عددها كبيراً."""
+    if workers > 1 and len(barcodes) >= PARALLEL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            images = pool.map(render_png, barcodes, repeat(options_json), chunksize=RENDER_CHUNK_SIZE)
+            return dict(zip(barcodes, images))
+    return {value: render_png(value, options_json) for value in barcodes}
+
+
+def _load_images(barcodes, workers):
+    images = {}
+    missing = []
+    for value in barcodes:
+        data = read_cached_barcode_png(value)
+        if data is None:
+            missing.append(value)
+        else:
+            images[value] = data
+
+    rendered = _render_missing(missing, writer_options_json(), workers)
+    for value, data in rendered.items():
+        store_barcode_png(value, data)
+    images.update(rendered)
+    return images
 
-        # رسم الاسم والباركود في الـ PDF
-        c.drawString(x, y, f"{student.name} - {student.barcode}")
-        c.drawImage(full_path, x, y - 50, width=200, height=50)
 
-        y -= 120
-        
-        if y < 100:
+# rl_config.useA85 إعداد عام للعملية كلها (لا يوجد خيار لكل Canvas)، يُقرأ عند إضافة كل صورة
+# وعند حفظ الملف. القفل يُمسك لهاتين الخطوتين فقط وفي وضع الصور فقط، حتى لا ينتظر تنزيل
+# ملفاً كبيراً آخر
+_binary_streams_lock = threading.Lock()
+
+
+@contextmanager
+def _binary_streams():
+    # ترميز ASCII85 للصور يتم بلغة بايثون بطيئة ويكبّر الملف بنسبة 25%،
+    # لذلك نكتب الصور كبيانات ثنائية مضغوطة أثناء توليد هذا الملف فقط
+    with _binary_streams_lock:
+        previous = rl_config.useA85
+        rl_config.useA85 = 0
+        try:
+            yield
+        finally:
+            rl_config.useA85 = previous
+
+
+def _pdf_mode(mode=None):
+    mode = mode or getattr(settings, 'BARCODE_PDF_MODE', PDF_MODE_VECTOR)
+    if mode not in PDF_MODES:
+        raise ValueError(f"Unknown barcode PDF mode: {mode}")
+    return mode
+
+
+def _draw_vector(c, value, x, y):
+    # خطوط PDF مباشرة: لا صور ولا Pillow، والملف أصغر بكثير
+    symbol = Code128(value, barHeight=BARCODE_HEIGHT, barWidth=VECTOR_BAR_WIDTH, humanReadable=True)
+    if symbol.width > BARCODE_WIDTH:
+        symbol = Code128(value, barHeight=BARCODE_HEIGHT, humanReadable=True,
+                         barWidth=VECTOR_BAR_WIDTH * BARCODE_WIDTH / symbol.width)
+    symbol.drawOn(c, x, y + 10)
+
+
+def _raster_drawer(barcodes, workers):
+    images = _load_images(barcodes, workers)
+
+    def draw(c, value, x, y):
+        data = images.get(value)
+        if data:
+            with _binary_streams():
+                c.drawImage(ImageReader(BytesIO(data)), x, y + 10, width=BARCODE_WIDTH, height=BARCODE_HEIGHT)
+    return draw
+
+
+def generate_barcodes_pdf(students=None, output=None, workers=None, mode=None):
+    """
+    يولّد ملف PDF بملصقات الباركود في شبكة من LABEL_COLUMNS أعمدة.
+
+    students: QuerySet اختياري لطباعة جزء من الطلاب (الافتراضي: الجميع).
+    output: ملف مفتوح للكتابة؛ الافتراضي ملف مؤقت على القرص بدلاً من الذاكرة.
+    mode: 'vector' أو 'raster' (الافتراضي BARCODE_PDF_MODE في الإعدادات).
+    يعيد الملف ومؤشره في البداية، جاهزاً لـ FileResponse.
+    """
+    mode = _pdf_mode(mode)
+    if students is None:
+        students = Students.objects.all()
+    rows = list(students.order_by('id').values_list('name', 'barcode'))
+    if mode == PDF_MODE_RASTER:
+        barcodes = [barcode for _, barcode in rows if barcode]
+        draw_barcode = _raster_drawer(barcodes, workers or _pdf_workers())
+    else:
+        draw_barcode = _draw_vector
+
+    if output is None:
+        output = tempfile.TemporaryFile(suffix='.pdf')
+    width, height = A4
+    column_width = (width - 2 * PAGE_MARGIN) / LABEL_COLUMNS
+    rows_per_page = int((height - 2 * PAGE_MARGIN) // LABEL_HEIGHT)
+    per_page = rows_per_page * LABEL_COLUMNS
+
+    c = canvas.Canvas(output, pagesize=A4)
+    for index, (name, barcode_value) in enumerate(rows):
+        slot = index % per_page
+        if index and slot == 0:
             c.showPage()
-            y = height - 100
+        x = PAGE_MARGIN + (slot % LABEL_COLUMNS) * column_width
+        y = height - PAGE_MARGIN - (slot // LABEL_COLUMNS + 1) * LABEL_HEIGHT
 
-    c.save()
-    buffer.seek(0)
-    return buffer
+        # رسم الاسم والباركود في الـ PDF
+        c.drawString(x, y + BARCODE_HEIGHT + 20, f"{name} - {barcode_value}")
+        if barcode_value:
+            draw_barcode(c, barcode_value, x, y)
+    # وضع الخطوط بلا صور: لا حاجة لتغيير useA85
+    with _binary_streams() if mode == PDF_MODE_RASTER else nullcontext():
+        c.save()
+    output.seek(0)
+    return output
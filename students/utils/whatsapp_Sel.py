@@ -6,6 +6,7 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 # from webdriver_manager.chrome import ChromeDriverManager
 from urllib.parse import quote
 
@@ -29,8 +30,32 @@ if not sel_whatsapp_issue_logger.handlers:
 PROFILE_DIR = os.path.abspath("./whatsapp_profile")
 os.makedirs(PROFILE_DIR, exist_ok=True)
 
-_driver = None
-_lock = threading.Lock()
+SEND_BUTTON_XPATH = "//span[@data-icon='send']/parent::button"
+# أيقونة الساعة على الرسالة الصادرة: ما زالت في انتظار الإرسال
+PENDING_ICON_CSS = "span[data-icon='msg-time']"
+POST_SEND_TIMEOUT = 20
+WHATSAPP_URL = "https://web.whatsapp.com"
+# روابط المحادثات التي يفتحها WhatsApp Web داخل التطبيق عند النقر عليها
+IN_APP_LINK = "https://api.whatsapp.com/send"
+COMPOSE_CSS = "div[contenteditable='true']"
+
+# طريقة فتح المحادثة لكل رسالة:
+# 'in_app': التطبيق يبقى محمّلاً ونفتح المحادثة بنقر رابط داخل الصفحة (أسرع بكثير)
+# 'reload': driver.get لعنوان send?phone= (يعيد تحميل WhatsApp Web كاملاً كل مرة)
+SEND_MODE_IN_APP = 'in_app'
+SEND_MODE_RELOAD = 'reload'
+SEND_MODES = (SEND_MODE_IN_APP, SEND_MODE_RELOAD)
+IN_APP_TIMEOUT = 10
+CHAT_READY_TIMEOUT = 30
+
+OPEN_CHAT_JS = """
+const link = document.createElement('a');
+link.href = arguments[0];
+link.style.display = 'none';
+(document.getElementById('app') || document.body).appendChild(link);
+link.click();
+link.remove();
+"""
 
 def is_valid_phone(phone):
     """تحقق من صحة رقم الجوال الدولي (بصيغة واتساب)."""
@@ -44,97 +69,186 @@ def format_phone(raw):
         digits = digits[1:]
     return f"+20{digits}"
 
-def get_driver():
-    """إنشاء أو استرجاع الجلسة الدائمة لـ Chrome/Selenium."""
-    global _driver
-    with _lock:
-        if _driver is None:
-            print(_driver)
-            options = Options()
-            options.add_argument(f"--user-data-dir={PROFILE_DIR}")
-            options.add_argument("--start-maximized")
-            # أول مرة بدون headless حتى تسجل QR
-            try:
-                _driver = webdriver.Chrome(
-                    # service=Service(ChromeDriverManager().install()),
-                    options=options
-                )
-                _driver.get("https://web.whatsapp.com/")
-                logging.info("⌛ انتظر مسح QR في WhatsApp Web …")
-                # ننتظر حتى يظهر مربع الكتابة في أي محادثة (يشير للدخول الناجح)
-                WebDriverWait(_driver, 300).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div[contenteditable='true']"))
-                )
-                logging.info("✅ جاهز لإرسال الرسائل.")
-            except Exception as e:
-                logging.error(f"فشل إنشاء جلسة WhatsApp Web: {e}")
-                if _driver:
-                    try: _driver.quit()
-                    except: pass
-                _driver = None
-        return _driver
 
-def send_whatsapp_message(phone, message):
+class WhatsAppSession:
     """
-    يرسل رسالة عبر الجلسة الدائمة:
-    - يتنقل للمحادثة.
-    - ينتظر زر الإرسال ثم ينقره.
-    - يعيد بدء الجلسة إذا تعطّلت.
+    جلسة WhatsApp Web واحدة (ملف تعريف Chrome واحد = رقم WhatsApp مرتبط واحد).
+    يمكن تشغيل عدة جلسات بملفات تعريف مختلفة بالتوازي، ولكل جلسة قفلها الخاص.
     """
-    if not is_valid_phone(phone):
-        logging.error(f"🚫 رقم غير صالح: {phone}")
-        return False
-    driver = get_driver()
-    if not driver:
-        logging.error("🚨 لا توجد جلسة جاهزة للرسائل.")
-        return False
-
-    to = format_phone(phone)
-    encoded_message = quote(message,safe='')  # ترميز الرسالة لتكون صالحة في URL
-    url = f"https://web.whatsapp.com/send?phone={to}&text={encoded_message}"
-
-
-    try:
-        driver.get(url)
-        send_btn = WebDriverWait(driver, 30).until(
-                EC.element_to_be_clickable((By.XPATH, "//span[@data-icon='send']/parent::button"))
-            )
+
+    def __init__(self, profile_dir=PROFILE_DIR, post_send_timeout=POST_SEND_TIMEOUT,
+                 send_mode=SEND_MODE_IN_APP, base_url=WHATSAPP_URL, headless=False):
+        if send_mode not in SEND_MODES:
+            raise ValueError(f"Unknown WhatsApp send mode: {send_mode}")
+        self.profile_dir = os.path.abspath(profile_dir)
+        self.post_send_timeout = post_send_timeout
+        self.send_mode = send_mode
+        self.base_url = base_url.rstrip('/')
+        self.headless = headless
+        self._driver = None
+        self._lock = threading.Lock()
+        # إشارات الاختناق لحد السرعة المتكيّف (whatsapp_rate)
+        self.congestion = 0
+
+    def get_driver(self):
+        """إنشاء أو استرجاع الجلسة الدائمة لـ Chrome/Selenium."""
+        with self._lock:
+            if self._driver is None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                options = Options()
+                options.add_argument(f"--user-data-dir={self.profile_dir}")
+                options.add_argument("--start-maximized")
+                # أول مرة بدون headless حتى تسجل QR
+                if self.headless:
+                    options.add_argument("--headless=new")
+                try:
+                    self._driver = webdriver.Chrome(
+                        # service=Service(ChromeDriverManager().install()),
+                        options=options
+                    )
+                    self._driver.get(f"{self.base_url}/")
+                    logging.info(f"⌛ انتظر مسح QR في WhatsApp Web ({self.profile_dir}) …")
+                    # ننتظر حتى يظهر مربع الكتابة في أي محادثة (يشير للدخول الناجح)
+                    WebDriverWait(self._driver, 300).until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, COMPOSE_CSS))
+                    )
+                    logging.info("✅ جاهز لإرسال الرسائل.")
+                except Exception as e:
+                    logging.error(f"فشل إنشاء جلسة WhatsApp Web: {e}")
+                    self._quit_locked()
+            return self._driver
+
+    def _quit_locked(self):
+        if self._driver:
+            try: self._driver.quit()
+            except: pass
+        self._driver = None
+
+    def restart(self):
+        """يغلق المتصفح؛ يُعاد فتحه عند الإرسال التالي."""
+        with self._lock:
+            self._quit_locked()
+
+    close = restart
+
+    def _note_congestion(self):
+        with self._lock:
+            self.congestion += 1
+
+    def pop_congestion(self):
+        with self._lock:
+            count, self.congestion = self.congestion, 0
+        return count
+
+    def is_healthy(self):
+        """فحص سريع: هل المتصفح يعمل وما زال على WhatsApp Web؟"""
+        driver = self.get_driver()
+        if not driver:
+            return False
+        try:
+            return driver.current_url.startswith(self.base_url)
+        except Exception as e:
+            logging.warning(f"⚠️ الجلسة {self.profile_dir} لا تستجيب: {e}")
+            self.restart()
+            return False
+
+    def _app_ready(self, driver):
+        """التطبيق محمّل ولا توجد رسالة معلّقة في مربع الكتابة (وإلا قد نرسلها للمحادثة الخطأ)."""
+        return (
+            driver.current_url.startswith(self.base_url)
+            and bool(driver.find_elements(By.CSS_SELECTOR, COMPOSE_CSS))
+            and not driver.find_elements(By.XPATH, SEND_BUTTON_XPATH)
+        )
+
+    def _open_chat(self, driver, to, encoded_message):
+        """
+        يفتح المحادثة مع نص الرسالة ويعيد زر الإرسال عندما يصبح جاهزاً.
+        في وضع in_app ننقر رابطاً داخل الصفحة، وإن لم يظهر زر الإرسال خلال
+        IN_APP_TIMEOUT نرجع لإعادة تحميل الصفحة.
+        """
+        query = f"phone={to}&text={encoded_message}"
+        if self.send_mode == SEND_MODE_IN_APP and self._app_ready(driver):
+            try:
+                driver.execute_script(OPEN_CHAT_JS, f"{IN_APP_LINK}?{query}")
+                return WebDriverWait(driver, IN_APP_TIMEOUT, poll_frequency=0.1).until(
+                    EC.element_to_be_clickable((By.XPATH, SEND_BUTTON_XPATH))
+                )
+            except TimeoutException:
+                logging.warning(f"↩️ لم تُفتح المحادثة داخل التطبيق لـ {to}، إعادة تحميل الصفحة")
+        driver.get(f"{self.base_url}/send?{query}")
+        return WebDriverWait(driver, CHAT_READY_TIMEOUT, poll_frequency=0.1).until(
+            EC.element_to_be_clickable((By.XPATH, SEND_BUTTON_XPATH))
+        )
+
+    def _send_once(self, driver, to, encoded_message):
+        send_btn = self._open_chat(driver, to, encoded_message)
         send_btn.click()
-        logging.info(f"📩 أرسلنا رسالة إلى {to} في {datetime.now().strftime('%H:%M:%S')}")
-        time.sleep(2)
-        return True
-
-    except Exception as e:
-        log_extra = {'phone_number': to, 'message_type': 'Selenium Send', 'reason': 'Initial send failed, possibly invalid number/no WhatsApp', 'details': str(e)}
-        sel_whatsapp_issue_logger.warning("Initial WhatsApp send attempt failed.", extra=log_extra)
-        logging.warning(f"⚠️ تعطل الإرسال إلى {to}: {e} — المحاولة بإعادة تشغيل الجلسة")
-        # إعادة محاولة بإعادة إنشاء الجلسة
+        # بدل انتظار ثابت: ننتظر حتى تختفي أيقونة الساعة أي حتى يؤكد WhatsApp الإرسال
         try:
-            with _lock:
-                if _driver:
-                    _driver.quit()
-                _driver = None
-        except:
-            pass
-        # محاولة ثانية
-        driver = get_driver()
+            wait = WebDriverWait(driver, self.post_send_timeout, poll_frequency=0.2)
+            # زر الإرسال يختفي عندما تنتقل الرسالة إلى المحادثة
+            wait.until(EC.staleness_of(send_btn))
+            wait.until_not(EC.presence_of_element_located((By.CSS_SELECTOR, PENDING_ICON_CSS)))
+        except TimeoutException:
+            self._note_congestion()
+            logging.warning(f"⏳ لم يؤكد WhatsApp الإرسال خلال {self.post_send_timeout} ثانية")
+
+    def send(self, phone, message):
+        """
+        يرسل رسالة عبر الجلسة الدائمة:
+        - يفتح المحادثة (داخل التطبيق أو بإعادة التحميل حسب send_mode).
+        - ينتظر زر الإرسال ثم ينقره.
+        - يعيد بدء الجلسة إذا تعطّلت.
+        """
+        if not is_valid_phone(phone):
+            logging.error(f"🚫 رقم غير صالح: {phone}")
+            return False
+        driver = self.get_driver()
         if not driver:
+            logging.error("🚨 لا توجد جلسة جاهزة للرسائل.")
             return False
+
+        to = format_phone(phone)
+        encoded_message = quote(message,safe='')  # ترميز الرسالة لتكون صالحة في URL
+
         try:
-            print('try selm')
-            driver.get(url)
-            send_btn = WebDriverWait(driver, 30).until(
-                EC.element_to_be_clickable((By.XPATH, "//span[@data-icon='send']/parent::button"))
-            )
-            send_btn.click()
-            logging.info(f"🔁 resending succesful {to}")
-            time.sleep(2)
+            self._send_once(driver, to, encoded_message)
+            logging.info(f"📩 أرسلنا رسالة إلى {to} في {datetime.now().strftime('%H:%M:%S')}")
             return True
-        except Exception as e2:
-            log_extra_retry = {'phone_number': to, 'message_type': 'Selenium Send Retry', 'reason': 'Retry send failed, possibly invalid number/no WhatsApp', 'details': str(e2)}
-            sel_whatsapp_issue_logger.error("Retry WhatsApp send attempt failed.", extra=log_extra_retry)
-            logging.error(f"❌ we couldn`t resend the message {to}: {e2}")
-            return False
+
+        except Exception as e:
+            # انتهاء مهلة زر الإرسال وإعادة تشغيل الجلسة كلاهما إشارة اختناق
+            self._note_congestion()
+            log_extra = {'phone_number': to, 'message_type': 'Selenium Send', 'reason': 'Initial send failed, possibly invalid number/no WhatsApp', 'details': str(e)}
+            sel_whatsapp_issue_logger.warning("Initial WhatsApp send attempt failed.", extra=log_extra)
+            logging.warning(f"⚠️ تعطل الإرسال إلى {to}: {e} — المحاولة بإعادة تشغيل الجلسة")
+            # إعادة محاولة بإعادة إنشاء الجلسة
+            self.restart()
+            # محاولة ثانية
+            driver = self.get_driver()
+            if not driver:
+                return False
+            try:
+                self._send_once(driver, to, encoded_message)
+                logging.info(f"🔁 resending succesful {to}")
+                return True
+            except Exception as e2:
+                log_extra_retry = {'phone_number': to, 'message_type': 'Selenium Send Retry', 'reason': 'Retry send failed, possibly invalid number/no WhatsApp', 'details': str(e2)}
+                sel_whatsapp_issue_logger.error("Retry WhatsApp send attempt failed.", extra=log_extra_retry)
+                logging.error(f"❌ we couldn`t resend the message {to}: {e2}")
+                return False
+
+
+# الجلسة الافتراضية (ملف التعريف whatsapp_profile) للاستخدام المباشر
+_default_session = WhatsAppSession(PROFILE_DIR)
+
+def get_driver():
+    """إنشاء أو استرجاع الجلسة الدائمة الافتراضية."""
+    return _default_session.get_driver()
+
+def send_whatsapp_message(phone, message):
+    """يرسل عبر الجلسة الافتراضية."""
+    return _default_session.send(phone, message)
 # import os, re, time, threading, logging
 # from datetime import datetime
 # from selenium import webdriver
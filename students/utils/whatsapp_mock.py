@@ -0,0 +1,100 @@
+# students/utils/whatsapp_mock.py
+"""
+نسخة محلية وهمية من WhatsApp Web لقياس أداء WhatsAppSession دون رقم حقيقي.
+
+الصفحة تحاكي ما يعتمد عليه المُرسِل فقط: زمن إقلاع التطبيق (boot_ms)، مربع
+الكتابة، فتح المحادثة من /send?phone=&text= أو بالنقر على رابط داخل التطبيق
+(chat_ms)، زر الإرسال، وأيقونة الساعة حتى تأكيد الإرسال (ack_ms).
+
+    server = serve_mock_whatsapp(boot_ms=3000)
+    session = WhatsAppSession(base_url=mock_url(server), ...)
+    ...
+    server.shutdown()
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_PAGE = """<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>WhatsApp mock</title></head>
+<body>
+<div id="app"></div>
+<script>
+const BOOT_MS = %(boot_ms)d, CHAT_MS = %(chat_ms)d, ACK_MS = %(ack_ms)d;
+const app = document.getElementById('app');
+
+function openChat(phone, text) {
+  const main = document.getElementById('main');
+  main.innerHTML = '';
+  setTimeout(() => {
+    main.innerHTML = '<header></header><div id="messages"></div><footer><div contenteditable="true"></div></footer>';
+    main.querySelector('header').textContent = phone;
+    main.querySelector('footer div').textContent = text;
+    if (text) {
+      const button = document.createElement('button');
+      button.innerHTML = '<span data-icon="send"></span>';
+      button.onclick = () => send(main, button);
+      main.querySelector('footer').appendChild(button);
+    }
+  }, CHAT_MS);
+}
+
+function send(main, button) {
+  const box = main.querySelector('footer div');
+  const message = document.createElement('div');
+  message.innerHTML = '<span></span><span data-icon="msg-time"></span>';
+  message.firstChild.textContent = box.textContent;
+  main.querySelector('#messages').appendChild(message);
+  box.textContent = '';
+  button.remove();
+  setTimeout(() => message.lastChild.setAttribute('data-icon', 'msg-check'), ACK_MS);
+}
+
+app.addEventListener('click', (event) => {
+  const link = event.target.closest('a');
+  if (!link || !link.href.includes('/send?')) return;
+  event.preventDefault();
+  const params = new URL(link.href).searchParams;
+  openChat(params.get('phone'), params.get('text') || '');
+});
+
+setTimeout(() => {
+  app.innerHTML = '<div id="side"><div contenteditable="true" data-tab="3"></div></div><div id="main"></div>';
+  const params = new URLSearchParams(location.search);
+  if (location.pathname.endsWith('/send') && params.get('phone')) {
+    openChat(params.get('phone'), params.get('text') || '');
+  }
+}, BOOT_MS);
+</script>
+</body>
+</html>
+"""
+
+
+def _handler(page):
+    body = page.encode('utf-8')
+
+    class MockWhatsAppHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockWhatsAppHandler
+
+
+def serve_mock_whatsapp(boot_ms=3000, chat_ms=150, ack_ms=300, port=0):
+    """يشغّل الصفحة الوهمية على 127.0.0.1 في خيط خلفي ويعيد الخادم."""
+    page = MOCK_PAGE % {'boot_ms': boot_ms, 'chat_ms': chat_ms, 'ack_ms': ack_ms}
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(page))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def mock_url(server):
+    return f"http://127.0.0.1:{server.server_port}"
@@ -0,0 +1,74 @@
+# students/utils/whatsapp_pool.py
+"""
+مجموعة مُرسِلين متوازية: حلقة _worker لكل جلسة WhatsApp (رقم مرتبط واحد).
+
+كل جلسة تحجز دفعات صغيرة من نفس الطابور الدائم عبر claim_batch، فتتوزع الرسائل
+على الجلسات تلقائياً دون أن تُرسل رسالة مرتين، ولكل جلسة حد سرعة خاص بها
+(WHATSAPP_SEND_INTERVAL) وفحص جاهزية قبل كل دفعة. الإنتاجية تزيد بعدد الجلسات
+بينما يبقى معدل الإرسال من كل رقم كما هو.
+"""
+import os
+import socket
+import threading
+import time
+
+from django.db import OperationalError, connection
+
+from . import whatsapp_queue
+
+SESSION_BATCH_SIZE = 5
+DB_RETRY_SECONDS = 0.5
+
+
+def _session_loop(worker_id, transport, stop_event, drain, batch_size):
+    try:
+        while not stop_event.is_set():
+            try:
+                whatsapp_queue._worker(
+                    worker_id=worker_id,
+                    stop_event=stop_event,
+                    drain=drain,
+                    transport=transport,
+                    batch_size=batch_size,
+                )
+                break
+            except OperationalError:
+                # قاعدة البيانات مقفلة مؤقتاً (SQLite): لا نوقف الجلسة، نعيد تشغيل الحلقة
+                whatsapp_queue.logger.warning("Database busy, restarting session.", extra={'reason': worker_id})
+                connection.close()
+                time.sleep(DB_RETRY_SECONDS)
+    except Exception:
+        whatsapp_queue.logger.exception("WhatsApp session stopped.", extra={'reason': worker_id})
+    finally:
+        transport.close()
+        # كل خيط يفتح اتصال قاعدة بيانات خاصاً به
+        connection.close()
+
+
+def run_sender_pool(transports, stop_event=None, drain=False, batch_size=SESSION_BATCH_SIZE):
+    """
+    يشغّل حلقة لكل وسيلة نقل في transports وينتظر انتهاءها
+    (عند فراغ الطابور مع drain=True، أو عند ضبط stop_event / Ctrl+C).
+    """
+    stop_event = stop_event or threading.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    threads = [
+        threading.Thread(
+            target=_session_loop,
+            args=(f"{prefix}-s{index}", transport, stop_event, drain, batch_size),
+            name=f"whatsapp-session-{index}",
+            daemon=True,
+        )
+        for index, transport in enumerate(transports, 1)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        raise
@@ -1,31 +1,31 @@
 import os
-import csv
 import logging
-import threading
-import queue
+import socket
 import time
-from datetime import datetime
-from .whatsapp_Sel import send_whatsapp_message  # وحدّد هذا المسار بدقّة حسب مشروعك
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from ..models import OutboundMessage, BroadcastMessage
+from .whatsapp_transports import send_whatsapp_message  # الوسيلة تُحدد عبر WHATSAPP_TRANSPORT
+from .whatsapp_rate import build_rate_limiter, recipient_throttle
+from .failed_numbers_manager import flush_failures, record_failure
 
 # إعداد سجلّ الأخطاء
 logger = logging.getLogger('whatsapp_issues')
 logger.setLevel(logging.INFO)
 
-# مسار ملف CSV لحفظ محاولات الإرسال الفاشلة
-FAILED_CSV = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'failed_whatsapp_deliveries.csv'))
-# التأكد من وجود الملف وكتابة العناوين إذا لم يكن موجودًا
-if not os.path.exists(FAILED_CSV):
-    os.makedirs(os.path.dirname(FAILED_CSV), exist_ok=True)
-    with open(FAILED_CSV, mode='w', encoding='utf-8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp', 'phone', 'message_type', 'reason', 'details'])
-
-# دالة مساعدة لتسجيل الفشل في ملف CSV
-def log_failed_delivery(phone, message_type, reason, details=""):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(FAILED_CSV, mode='a', encoding='utf-8', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([timestamp, phone, message_type, reason, details])
+# تسجيل الفشل في جدول DeliveryFailure (على دفعات، انظر failed_numbers_manager)
+def log_failed_delivery(phone, message_type, reason, details="", student_id=None, student_name=''):
+    record_failure(
+        phone,
+        message_type=message_type,
+        reason=reason,
+        details=details,
+        student_id=student_id,
+        student_name=student_name,
+    )
 
 # إذا أردت حقول إضافية دائماً
 class ContextFilter(logging.Filter):
@@ -42,40 +42,263 @@ if not logger.handlers:
     logger.addHandler(fh)
     logger.addFilter(ContextFilter())
 
-# طابور الرسائل وخيط المعالجة
-_message_queue = queue.Queue()
+# إعدادات المُرسِل (يمكن تجاوزها من settings.py)
+MAX_ATTEMPTS = getattr(settings, 'WHATSAPP_MAX_ATTEMPTS', 3)
+RETRY_DELAY_SECONDS = getattr(settings, 'WHATSAPP_RETRY_DELAY', 60)
+SEND_INTERVAL_SECONDS = getattr(settings, 'WHATSAPP_SEND_INTERVAL', 1)
+STALE_CLAIM_SECONDS = getattr(settings, 'WHATSAPP_STALE_CLAIM', 300)
+BATCH_SIZE = 20
+IDLE_SLEEP_SECONDS = 2
+HEALTH_RETRY_SECONDS = 30
+STATUS_LOG_SECONDS = 60
+
+
+def _build_message(phone, text, log_context, broadcast=None):
+    return OutboundMessage(phone=phone or '', text=text, context=dict(log_context), broadcast=broadcast)
+
 
 def queue_whatsapp_message(phone, text, **log_context):
-    """أضف رسالة إلى الطابور باستخدام سياق تسجيل (student_id, message_type, …)."""
-    _message_queue.put((phone, text, log_context))
+    """أضف رسالة إلى الطابور الدائم (إدخال واحد) مع سياق التسجيل (student_id, message_type, …)."""
+    message = _build_message(phone, text, log_context)
+    message.save()
+    return message
+
+
+def queue_whatsapp_messages(items, broadcast=None):
+    """
+    إدخال جماعي لعدة رسائل: items عناصر (phone, text, log_context).
+    يُستخدم عند تسجيل الغياب أو الرسائل العامة بدلاً من إدخال لكل رسالة.
+    """
+    return OutboundMessage.objects.bulk_create(
+        [_build_message(phone, text, ctx, broadcast) for phone, text, ctx in items]
+    )
+
+
+def _bump_broadcast(message, field):
+    if message.broadcast_id:
+        BroadcastMessage.objects.filter(pk=message.broadcast_id).update(**{field: F(field) + 1})
+
 
+def release_stale_claims():
+    """
+    يعيد للطابور الرسائل المحجوزة من مُرسِل توقف أثناء الإرسال.
+    المُرسِل الحي يجدد claimed_at لحجوزاته قبل كل رسالة (_heartbeat)، فدفعة بطيئة
+    (20 رسالة بمعدل 0.05/ث ≈ 400 ثانية) لا تُعتبر متروكة مهما طالت.
+    """
+    cutoff = timezone.now() - timedelta(seconds=STALE_CLAIM_SECONDS)
+    return OutboundMessage.objects.filter(
+        status=OutboundMessage.STATUS_SENDING,
+        claimed_at__lt=cutoff,
+    ).update(status=OutboundMessage.STATUS_PENDING, claimed_by='', claimed_at=None)
 
-def _worker():
-    # استدعِ الدالة هنا لتفادي دوائر الاستيراد
-    from .whatsapp_queue import send_whatsapp_message
+
+def claim_batch(worker_id, limit=BATCH_SIZE):
+    """
+    يحجز دفعة من الرسائل المستحقة بالترتيب عبر انتقال حالة ذري
+    (pending -> sending بشرط أن تكون ما زالت pending)، فلا يرسل مُرسِلان نفس الرسالة.
+    """
+    now = timezone.now()
+    if connection.features.has_select_for_update_skip_locked:
+        ids = _claim_skip_locked(worker_id, limit, now)
+    else:
+        ids = _claim_conditional(worker_id, limit, now)
+    if not ids:
+        return []
+    return list(
+        OutboundMessage.objects.filter(
+            id__in=ids,
+            status=OutboundMessage.STATUS_SENDING,
+            claimed_by=worker_id,
+        ).order_by('id')
+    )
+
+
+def _claim_skip_locked(worker_id, limit, now):
+    """
+    PostgreSQL: يقفل الصفوف المستحقة ويتخطى ما قفله مُرسِل آخر (FOR UPDATE SKIP LOCKED)،
+    فلا يتنافس المُرسِلون على نفس الرسائل ولا تحتاج إعادة الاختيار.
+    """
+    with transaction.atomic():
+        ids = list(
+            OutboundMessage.objects.select_for_update(skip_locked=True).filter(
+                status=OutboundMessage.STATUS_PENDING,
+                next_attempt_at__lte=now,
+            ).order_by('id').values_list('id', flat=True)[:limit]
+        )
+        if ids:
+            OutboundMessage.objects.filter(id__in=ids).update(
+                status=OutboundMessage.STATUS_SENDING, claimed_by=worker_id, claimed_at=now
+            )
+    return ids
+
+
+def _claim_conditional(worker_id, limit, now):
+    """SQLite: اختيار ثم تحديث مشروط بأن الرسائل ما زالت pending."""
     while True:
-        phone, text, ctx = _message_queue.get()
-        success = False
-        try:
-            if send_whatsapp_message(phone, text):
-                success = True
-            else:
-                ctx.setdefault('reason', 'Unknown failure')
-        except Exception as e:
-            ctx.setdefault('reason', str(e))
-        finally:
-            if not success:
-                # سجل في لوج
-                logger.info("WhatsApp not sent.", extra=ctx)
-                # سجل في CSV
-                log_failed_delivery(
-                    phone,
-                    ctx.get('message_type', 'Unknown'),
-                    ctx.get('reason', 'Unknown failure'),
-                    ctx.get('details', '')
-                )
-            _message_queue.task_done()
-            time.sleep(1)
-
-# إطلاق الخيط عند استيراد الوحدة
-threading.Thread(target=_worker, daemon=True).start()
+        # بدون معاملة تغلّف القراءة والكتابة: في SQLite يفشل ترقية قفل القراءة فوراً
+        # عند تزامن مُرسِلين، بينما التحديث المشروط وحده ذري وينتظر القفل
+        ids = list(
+            OutboundMessage.objects.filter(
+                status=OutboundMessage.STATUS_PENDING,
+                next_attempt_at__lte=now,
+            ).order_by('id').values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        claimed = OutboundMessage.objects.filter(
+            id__in=ids,
+            status=OutboundMessage.STATUS_PENDING,
+        ).update(status=OutboundMessage.STATUS_SENDING, claimed_by=worker_id, claimed_at=now)
+        # إذا سبقنا مُرسِل آخر إلى كل الرسائل المختارة نعيد الاختيار بدل إرجاع دفعة فارغة
+        if claimed:
+            return ids
+
+
+def _heartbeat(worker_id):
+    """يجدد وقت حجز الرسائل المتبقية من دفعة هذا المُرسِل."""
+    OutboundMessage.objects.filter(
+        status=OutboundMessage.STATUS_SENDING,
+        claimed_by=worker_id,
+    ).update(claimed_at=timezone.now())
+
+
+def _mark_sent(message):
+    message.status = OutboundMessage.STATUS_SENT
+    message.attempts += 1
+    message.sent_at = timezone.now()
+    message.save(update_fields=['status', 'attempts', 'sent_at'])
+    _bump_broadcast(message, 'sent_count')
+
+
+def _mark_failed(message, reason):
+    message.attempts += 1
+    message.last_error = reason
+    if message.attempts < MAX_ATTEMPTS:
+        # إعادة المحاولة لاحقاً
+        message.status = OutboundMessage.STATUS_PENDING
+        message.next_attempt_at = timezone.now() + timedelta(seconds=RETRY_DELAY_SECONDS * message.attempts)
+        message.claimed_by = ''
+        message.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'claimed_by'])
+        return
+
+    message.status = OutboundMessage.STATUS_FAILED
+    message.save(update_fields=['status', 'attempts', 'last_error'])
+    _bump_broadcast(message, 'failed_count')
+    ctx = dict(message.context)
+    ctx['reason'] = ctx.get('reason') or reason
+    # سجل في لوج
+    logger.info("WhatsApp not sent.", extra=ctx)
+    # سجل في جدول حالات الفشل
+    log_failed_delivery(
+        message.phone,
+        ctx.get('message_type', 'Unknown'),
+        ctx.get('reason', 'Unknown failure'),
+        ctx.get('details', ''),
+        student_id=ctx.get('student_id'),
+        student_name=ctx.get('student_name', ''),
+    )
+
+
+def release_claims(worker_id):
+    """يعيد للطابور الرسائل التي حجزها هذا المُرسِل ولم يرسلها (عند الإيقاف)."""
+    return OutboundMessage.objects.filter(
+        status=OutboundMessage.STATUS_SENDING,
+        claimed_by=worker_id,
+    ).update(status=OutboundMessage.STATUS_PENDING, claimed_by='', claimed_at=None)
+
+
+def process_message(message, transport=None):
+    """يرسل رسالة محجوزة ويحدّث حالتها. يعيد True عند النجاح."""
+    send = transport.send if transport is not None else send_whatsapp_message
+    reason = 'Unknown failure'
+    try:
+        if send(message.phone, message.text):
+            _mark_sent(message)
+            return True
+    except Exception as e:
+        reason = str(e)
+    _mark_failed(message, reason)
+    return False
+
+
+def queue_depth():
+    """عدد الرسائل المنتظرة في الطابور (المستحقة الآن والمؤجلة)."""
+    return OutboundMessage.objects.filter(status=OutboundMessage.STATUS_PENDING).count()
+
+
+def _defer(message, delay):
+    """يعيد الرسالة للطابور بعد delay ثانية دون احتسابها محاولة فاشلة."""
+    message.status = OutboundMessage.STATUS_PENDING
+    message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    message.claimed_by = ''
+    message.save(update_fields=['status', 'next_attempt_at', 'claimed_by'])
+
+
+def _pause(seconds, stop_event):
+    if seconds <= 0:
+        return
+    if stop_event:
+        stop_event.wait(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def _worker(worker_id=None, stop_event=None, drain=False, transport=None, batch_size=BATCH_SIZE, limiter=None):
+    """
+    حلقة المُرسِل: تحجز دفعات من الطابور الدائم وترسلها بالترتيب.
+    drain=True: تخرج عندما لا يتبقى شيء مستحق (للاختبارات وقياس الأداء).
+    transport: وسيلة نقل خاصة بهذه الحلقة (جلسة واحدة في مجموعة المُرسِلين)،
+    ويُفحص جاهزيتها قبل كل دفعة.
+    limiter: حد السرعة المتكيّف للجلسة (انظر whatsapp_rate)، يبدأ من
+    SEND_INTERVAL_SECONDS بين رسالتين ويتغير حسب زمن الإرسال والفشل.
+    يُسجل المعدل الحالي وعمق الطابور في السجل كل STATUS_LOG_SECONDS.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    limiter = limiter or build_rate_limiter(SEND_INTERVAL_SECONDS)
+    recipients = recipient_throttle()
+    release_stale_claims()
+    # حجوزات متبقية بنفس المعرّف من تشغيل سابق انقطع (خطأ قاعدة بيانات مثلاً)
+    release_claims(worker_id)
+    next_status = time.monotonic() + STATUS_LOG_SECONDS
+    try:
+        while not (stop_event and stop_event.is_set()):
+            if transport is not None and not transport.health_check():
+                logger.warning("WhatsApp session unhealthy.", extra={'reason': worker_id})
+                limiter.penalize()
+                if drain:
+                    return
+                _pause(HEALTH_RETRY_SECONDS, stop_event)
+                continue
+            batch = claim_batch(worker_id, limit=batch_size)
+            if not batch:
+                flush_failures()
+                if drain:
+                    return
+                _pause(IDLE_SLEEP_SECONDS, stop_event)
+                continue
+            for message in batch:
+                if stop_event and stop_event.is_set():
+                    break
+                delay = recipients.reserve(message.phone)
+                if delay:
+                    _defer(message, delay)
+                    continue
+                _pause(limiter.reserve(), stop_event)
+                _heartbeat(worker_id)
+                started = time.monotonic()
+                ok = process_message(message, transport)
+                congestion = transport.pop_congestion() if transport is not None else 0
+                limiter.record(ok, time.monotonic() - started, congestion)
+            if time.monotonic() >= next_status:
+                # queue_depth استعلام COUNT: لا يُنفذ إن كان مستوى INFO معطلاً
+                if logger.isEnabledFor(logging.INFO):
+                    stats = limiter.stats()
+                    logger.info(
+                        "📊 %s: rate=%.2f/s sent=%s failed=%s backoffs=%s queue=%s",
+                        worker_id, stats['rate'] or 0, stats['sent'], stats['failed'], stats['backoffs'],
+                        queue_depth(), extra={'reason': worker_id},
+                    )
+                next_status = time.monotonic() + STATUS_LOG_SECONDS
+    finally:
+        release_claims(worker_id)
+        flush_failures()
@@ -0,0 +1,193 @@
+# students/utils/whatsapp_rate.py
+"""
+ضبط سرعة الإرسال بدل الانتظار الثابت.
+
+لكل جلسة AdaptiveRateLimiter: دلو رموز (token bucket) يبدأ بمعدل
+1 / WHATSAPP_SEND_INTERVAL رسالة في الثانية، ثم يرتفع تدريجياً مع كل إرسال ناجح
+وسريع، وينخفض للنصف عند بطء الإرسال أو إشارات الاختناق من الوسيلة
+(انتهاء مهلة زر الإرسال، إعادة تشغيل الجلسة، فشل فحص الجاهزية). المعدل يبقى بين
+WHATSAPP_RATE_MIN و WHATSAPP_RATE_MAX.
+
+حدود مشتركة على مستوى العملية كلها (كل الجلسات):
+    WHATSAPP_GLOBAL_RATE          أقصى عدد رسائل في الثانية (None = بلا حد)
+    WHATSAPP_RECIPIENT_INTERVAL   أقل زمن بالثواني بين رسالتين لنفس الرقم (0 = بلا حد)
+"""
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_RATE_MIN = 0.05   # رسالة كل 20 ثانية كحد أدنى
+DEFAULT_RATE_MAX = 2.0
+DEFAULT_SLOW_SEND_SECONDS = 15
+RATE_STEP = 0.05          # زيادة المعدل بعد كل إرسال ناجح
+BACKOFF_FACTOR = 0.5      # ضرب المعدل عند الاختناق
+LATENCY_SMOOTHING = 0.2
+
+
+class TokenBucket:
+    """دلو رموز بسعة burst يمتلئ بمعدل rate رمز/ثانية. آمن للاستخدام من عدة خيوط."""
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = rate
+
+    def reserve(self):
+        """يحجز رمزاً ويعيد عدد الثواني الواجب انتظارها قبل استخدامه (0 إن كان متاحاً)."""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class RecipientThrottle:
+    """أقل فاصل زمني بين رسالتين لنفس الرقم."""
+
+    def __init__(self, interval, clock=time.monotonic):
+        self.interval = interval
+        self._clock = clock
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, phone):
+        """يعيد 0 ويسجل الإرسال إذا كان مسموحاً، وإلا عدد الثواني المتبقية."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            last = self._last.get(phone)
+            if last is not None and now - last < self.interval:
+                return self.interval - (now - last)
+            self._last[phone] = now
+            if len(self._last) > 10000:
+                # حذف الأرقام التي انتهت مدتها حتى لا يكبر القاموس بلا حد
+                self._last = {p: t for p, t in self._last.items() if now - t < self.interval}
+            return 0.0
+
+
+class AdaptiveRateLimiter:
+    """
+    حد سرعة جلسة واحدة مع تكيّف تلقائي (زيادة خطية، تخفيض بالنصف).
+    rate=None: بلا حد للجلسة (يبقى الحد العام فقط)، مثل WHATSAPP_SEND_INTERVAL = 0.
+    """
+
+    def __init__(self, rate=None, min_rate=DEFAULT_RATE_MIN, max_rate=DEFAULT_RATE_MAX,
+                 slow_send_seconds=DEFAULT_SLOW_SEND_SECONDS, global_bucket=None, clock=time.monotonic):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.slow_send_seconds = slow_send_seconds
+        self.global_bucket = global_bucket
+        self._bucket = None
+        if rate is not None:
+            self._bucket = TokenBucket(self._clamp(rate), clock=clock)
+        self.sent = 0
+        self.failed = 0
+        self.backoffs = 0
+        self.latency = None
+
+    def _clamp(self, rate):
+        return max(self.min_rate, min(self.max_rate, rate))
+
+    @property
+    def rate(self):
+        return self._bucket.rate if self._bucket else None
+
+    def reserve(self):
+        """يحجز مكاناً للرسالة التالية ويعيد عدد الثواني الواجب انتظارها."""
+        waits = [0.0]
+        if self._bucket:
+            waits.append(self._bucket.reserve())
+        if self.global_bucket:
+            waits.append(self.global_bucket.reserve())
+        return max(waits)
+
+    def record(self, ok, latency, congestion=0):
+        """يحدّث المعدل حسب نتيجة الإرسال وزمنه وعدد إشارات الاختناق."""
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if congestion or latency > self.slow_send_seconds:
+            self._backoff()
+        elif ok and self._bucket:
+            self._bucket.set_rate(self._clamp(self._bucket.rate + RATE_STEP))
+        # فشل سريع بدون إشارة اختناق (رقم غير صالح مثلاً) لا يغيّر المعدل
+
+    def penalize(self):
+        """إشارة اختناق بدون إرسال (مثل فشل فحص الجاهزية)."""
+        self._backoff()
+
+    def _backoff(self):
+        self.backoffs += 1
+        if self._bucket:
+            self._bucket.set_rate(self._clamp(self._bucket.rate * BACKOFF_FACTOR))
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'sent': self.sent,
+            'failed': self.failed,
+            'backoffs': self.backoffs,
+            'latency': self.latency,
+        }
+
+
+_global_bucket = None
+_recipient_throttle = None
+_lock = threading.Lock()
+
+
+def global_bucket():
+    """الحد العام المشترك بين كل الجلسات في هذه العملية (None إن لم يُضبط)."""
+    global _global_bucket
+    rate = getattr(settings, 'WHATSAPP_GLOBAL_RATE', None)
+    if not rate:
+        return None
+    with _lock:
+        if _global_bucket is None:
+            _global_bucket = TokenBucket(rate)
+        return _global_bucket
+
+
+def recipient_throttle():
+    global _recipient_throttle
+    with _lock:
+        if _recipient_throttle is None:
+            _recipient_throttle = RecipientThrottle(getattr(settings, 'WHATSAPP_RECIPIENT_INTERVAL', 0))
+        return _recipient_throttle
+
+
+def reset_limits():
+    """يلغي الحدود المشتركة المحفوظة (بعد تغيير الإعدادات، وفي الاختبارات)."""
+    global _global_bucket, _recipient_throttle
+    with _lock:
+        _global_bucket = None
+        _recipient_throttle = None
+
+
+def build_rate_limiter(send_interval):
+    """حد سرعة لجلسة جديدة يبدأ من send_interval ثانية بين الرسائل."""
+    return AdaptiveRateLimiter(
+        rate=1 / send_interval if send_interval else None,
+        min_rate=getattr(settings, 'WHATSAPP_RATE_MIN', DEFAULT_RATE_MIN),
+        max_rate=getattr(settings, 'WHATSAPP_RATE_MAX', DEFAULT_RATE_MAX),
+        slow_send_seconds=getattr(settings, 'WHATSAPP_SLOW_SEND_SECONDS', DEFAULT_SLOW_SEND_SECONDS),
+        global_bucket=global_bucket(),
+    )
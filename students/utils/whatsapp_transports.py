@@ -0,0 +1,213 @@
+# students/utils/whatsapp_transports.py
+"""
+وسائل نقل رسائل WhatsApp القابلة للاستبدال.
+
+تُختار الوسيلة من settings.py:
+
+    WHATSAPP_TRANSPORT = 'selenium'          # أو 'pywhatkit' أو 'fake' أو 'http' أو مسار كلاس
+    WHATSAPP_TRANSPORT_OPTIONS = {}          # تمرر كما هي لمُنشئ الكلاس
+
+جميع الوسائل تعيد True عند نجاح الإرسال و False عند الفشل، مثل send_whatsapp_message.
+"""
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseTransport:
+    """الواجهة المشتركة: send(phone, message) -> bool"""
+
+    name = 'base'
+
+    def send(self, phone, message):
+        raise NotImplementedError
+
+    def health_check(self):
+        """هل الوسيلة جاهزة للإرسال؟ (يستدعيها المُرسِل قبل كل دفعة)"""
+        return True
+
+    def close(self):
+        pass
+
+    def pop_congestion(self):
+        """عدد إشارات الاختناق منذ آخر استدعاء (مهلة زر الإرسال، إعادة تشغيل الجلسة)."""
+        return 0
+
+
+class SeleniumTransport(BaseTransport):
+    """
+    جلسة WhatsApp Web عبر Chrome (السلوك الافتراضي).
+    الخيارات تمرر لـ WhatsAppSession: profile_dir لرقم مرتبط آخر، send_mode
+    ('in_app' أو 'reload')، post_send_timeout، base_url، headless.
+    بدون خيارات تُستخدم الجلسة الافتراضية.
+    """
+
+    name = 'selenium'
+
+    def __init__(self, **options):
+        from . import whatsapp_Sel
+        options = {key: value for key, value in options.items() if value is not None}
+        if options:
+            self.session = whatsapp_Sel.WhatsAppSession(**options)
+        else:
+            self.session = whatsapp_Sel._default_session
+
+    def send(self, phone, message):
+        return self.session.send(phone, message)
+
+    def health_check(self):
+        return self.session.is_healthy()
+
+    def close(self):
+        self.session.close()
+
+    def pop_congestion(self):
+        return self.session.pop_congestion()
+
+
+class PyWhatKitTransport(BaseTransport):
+    """الإرسال عبر pywhatkit (يفتح تبويباً جديداً لكل رسالة)."""
+
+    name = 'pywhatkit'
+
+    def __init__(self, wait_time=20, tab_close=True):
+        self.wait_time = wait_time
+        self.tab_close = tab_close
+
+    def send(self, phone, message):
+        import pywhatkit  # اعتماد اختياري
+        # تأخير لتحميل WhatsApp Web
+        pywhatkit.sendwhatmsg_instantly(phone, message, wait_time=self.wait_time, tab_close=self.tab_close)
+        return True
+
+
+class FakeTransport(BaseTransport):
+    """
+    وسيلة محلية لا ترسل شيئاً، لقياس أداء الطابور وضبطه دون هاتف.
+    latency/jitter بالثواني، و failure_rate بين 0 و 1.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, phone, message):
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            ok = self._random.random() >= self.failure_rate
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+        return ok
+
+
+class HttpStubTransport(BaseTransport):
+    """يرسل الرسالة كـ JSON إلى خادم HTTP (خادم وهمي أو بوابة خارجية)."""
+
+    name = 'http'
+
+    def __init__(self, url='http://127.0.0.1:8765/send', timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, phone, message):
+        body = json.dumps({'phone': phone, 'message': message}).encode('utf-8')
+        request = urllib.request.Request(
+            self.url, data=body, headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return 200 <= response.status < 300
+        except (urllib.error.URLError, OSError):
+            return False
+
+
+TRANSPORTS = {
+    SeleniumTransport.name: SeleniumTransport,
+    PyWhatKitTransport.name: PyWhatKitTransport,
+    FakeTransport.name: FakeTransport,
+    HttpStubTransport.name: HttpStubTransport,
+}
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def build_transport(backend=None, **options):
+    """ينشئ وسيلة نقل من اسم مختصر أو مسار كلاس."""
+    if backend is None:
+        backend = getattr(settings, 'WHATSAPP_TRANSPORT', SeleniumTransport.name)
+        options = {**getattr(settings, 'WHATSAPP_TRANSPORT_OPTIONS', {}), **options}
+    cls = TRANSPORTS.get(backend) or import_string(backend)
+    return cls(**options)
+
+
+def get_transport():
+    """يعيد وسيلة النقل المختارة في الإعدادات (تُنشأ مرة واحدة لكل عملية)."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = build_transport()
+    return _transport
+
+
+def set_transport(transport):
+    """يستبدل وسيلة النقل الحالية ويعيد السابقة (لاختبارات الحمل)."""
+    global _transport
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
+
+
+def reset_transport():
+    """يعيد القراءة من الإعدادات عند الاستخدام التالي."""
+    set_transport(None)
+
+
+def session_profiles(count=None):
+    """
+    ملفات تعريف Chrome للجلسات المتوازية: WHATSAPP_SESSION_PROFILES إن وُجدت،
+    وإلا whatsapp_profile ثم whatsapp_profile_2 و whatsapp_profile_3 …
+    """
+    from .whatsapp_Sel import PROFILE_DIR
+    profiles = list(getattr(settings, 'WHATSAPP_SESSION_PROFILES', []) or [PROFILE_DIR])
+    count = count or getattr(settings, 'WHATSAPP_SESSIONS', 1)
+    while len(profiles) < count:
+        profiles.append(f"{PROFILE_DIR}_{len(profiles) + 1}")
+    return profiles[:count]
+
+
+def build_session_transports(count=None):
+    """
+    وسيلة نقل مستقلة لكل جلسة: مع selenium لكل جلسة ملف تعريف Chrome خاص بها،
+    ومع الوسائل الأخرى نسخة مستقلة من نفس الوسيلة.
+    """
+    backend = getattr(settings, 'WHATSAPP_TRANSPORT', SeleniumTransport.name)
+    count = count or getattr(settings, 'WHATSAPP_SESSIONS', 1)
+    if TRANSPORTS.get(backend) is SeleniumTransport:
+        options = {k: v for k, v in getattr(settings, 'WHATSAPP_TRANSPORT_OPTIONS', {}).items() if k != 'profile_dir'}
+        return [SeleniumTransport(profile_dir=profile, **options) for profile in session_profiles(count)]
+    return [build_transport() for _ in range(count)]
+
+
+def send_whatsapp_message(phone, message):
+    """يرسل عبر وسيلة النقل المختارة في الإعدادات."""
+    return get_transport().send(phone, message)
@@ -1,21 +1,33 @@
 from django.shortcuts import render,redirect
-from django.http import FileResponse
-from .utils.pdf_generator import generate_barcodes_pdf
-from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-from .models import Students,Attendance,Payment,Basics
-from .utils.barcode_utils import generate_barcode_image
-from .utils.whatsapp_queue import queue_whatsapp_message,log_failed_delivery
+from django.http import FileResponse, StreamingHttpResponse
+from .utils.pdf_generator import generate_barcodes_pdf, PDF_MODES
+from django.http import Http404, HttpResponse, JsonResponse
+from .models import Students,Attendance,Payment,MonthlyRevenue,BroadcastMessage
+from . import barcode_index, settings_provider
+from .scan_batch import apply_scan_events
+from .utils.barcode_utils import barcode_cache_key, render_barcode_png
+from .utils.income_export import iter_income_csv, write_income_xlsx
+from .utils.broadcast import enqueue_broadcast
+from .utils.whatsapp_queue import queue_whatsapp_message, queue_whatsapp_messages, log_failed_delivery
+import json
 import os
 from django.conf import settings
 from django.contrib import messages
 from django.utils import timezone
+from django.db import DatabaseError, IntegrityError
+from django.db.models import Q, Sum
+from urllib.parse import urlencode
 import threading
 from datetime import date, datetime,timedelta
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 from .util import (
     get_daily_attendance_summary, get_students_with_overdue_payments, # Kept existing ones
     get_attendance_trends, get_revenue_trends,
-    get_monthly_attendance_rate, get_student_payment_history
+    get_monthly_attendance_rate, get_student_payment_history, get_latest_payments,
+    mark_absentees, record_presence,
+    consume_free_try, pay_and_record_presence,
 )
 import logging
 
@@ -32,23 +44,46 @@ if not whatsapp_issue_logger.handlers:
     issue_file_handler.setFormatter(issue_formatter)
     whatsapp_issue_logger.addHandler(issue_file_handler)
 
-INITIAL_FREE_TRIES = 3
+def _student_barcode(request, student_id):
+    # استعلام واحد لكل طلب يتشاركه حساب ETag والعرض نفسه
+    if not hasattr(request, '_student_barcode'):
+        request._student_barcode = (
+            Students.objects.filter(id=student_id).values_list('barcode', flat=True).first()
+        )
+    return request._student_barcode
 
-def print_barcode(request, student_id):
-    student = get_object_or_404(Students, id=student_id)
-    full_path = os.path.join(settings.MEDIA_ROOT, 'barcodes', f"{student.barcode}.png")
 
-    # إذا لم يكن الباركود موجوداً، نقوم بتوليده
-    if not os.path.exists(full_path):
-        generate_barcode_image(student.barcode)
+def _barcode_etag(request, student_id):
+    # مفتاح المحتوى يتحدد بالكامل من قيمة الباركود وإعدادات الرسم
+    barcode_value = _student_barcode(request, student_id)
+    return barcode_cache_key(barcode_value) if barcode_value else None
 
-    if os.path.exists(full_path):
-        return FileResponse(open(full_path, "rb"), content_type="image/png")
-    else:
+
+@condition(etag_func=_barcode_etag)
+def print_barcode(request, student_id):
+    barcode_value = _student_barcode(request, student_id)
+    if barcode_value is None:
+        raise Http404("No Students matches the given query.")
+    try:
+        # الرسم في الذاكرة مباشرة دون ملف وسيط
+        png = render_barcode_png(barcode_value)
+    except Exception:
         return HttpResponse("فشل في توليد الباركود", status=404)
-    
+
+    response = HttpResponse(png, content_type="image/png")
+    # المتصفح يحتفظ بالصورة لكن يتحقق منها (ETag) قبل إعادة استخدامها
+    patch_cache_control(response, no_cache=True)
+    return response
+
 def download_barcodes_pdf(request):
-    pdf = generate_barcodes_pdf()
+    # ?ids=1,2,3 لطباعة ملصقات طلاب محددين فقط
+    students = Students.objects.all()
+    ids = [value for value in request.GET.get('ids', '').split(',') if value.strip().isdigit()]
+    if ids:
+        students = students.filter(id__in=ids)
+    # ?mode=raster لاستخدام صور PNG بدلاً من الرسم المتجه
+    mode = request.GET.get('mode')
+    pdf = generate_barcodes_pdf(students, mode=mode if mode in PDF_MODES else None)
     return FileResponse(pdf, as_attachment=True, filename='barcodes.pdf')
 
 
@@ -56,7 +91,12 @@ def download_barcodes_pdf(request):
 
 
 # Helper to queue or log failures without altering message content
-def send_or_log(student, text, message_type):
+def _outbox_item(student, text, message_type):
+    """
+    عنصر (phone, text, ctx) لطابور الرسائل، أو None إن لم يكن للطالب رقم أو WhatsApp.
+    الحالة الأخيرة تُسجل كفشل هنا مرة واحدة ولا تدخل الطابور (المُرسِل كان سيعيد
+    محاولتها حتى WHATSAPP_MAX_ATTEMPTS ثم يسجل فشلاً ثانياً لنفس الرسالة).
+    """
     phone = student.father_phone or ''
     ctx = {
         'student_id': student.id,
@@ -64,10 +104,19 @@ def send_or_log(student, text, message_type):
         'message_type': message_type,
         'reason': ''
     }
-    queue_whatsapp_message(phone, text, **ctx)
     if not phone or not student.has_whatsapp:
         reason = 'Missing phone or WhatsApp disabled'
-        log_failed_delivery(phone, message_type, reason, 'View-level skip')
+        log_failed_delivery(phone, message_type, reason, 'View-level skip',
+                            student_id=student.id, student_name=student.name)
+        return None
+    return phone, text, ctx
+
+
+def send_or_log(student, text, message_type):
+    item = _outbox_item(student, text, message_type)
+    if item is not None:
+        phone, text, ctx = item
+        queue_whatsapp_message(phone, text, **ctx)
 
 # def send_or_log(student, text, message_type):
 #     phone = student.father_phone or ''
@@ -85,6 +134,58 @@ def send_or_log(student, text, message_type):
 #         ctx['reason'] = reason
 #         queue_whatsapp_message(phone, text, **ctx)
 
+def _lateness_text(student, arrival_time):
+    return (
+        f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
+        f"تم تسجيل حضور ابنكم/ابنتكم اليوم الساعة {arrival_time.strftime('%H:%M')}\.\n"
+        "نأمل الالتزام بالحضور...\n\n"
+        "مع تحيات،\n*م. عبدالله عمر* 😎"
+    )
+
+
+def _attendance_text(student, scanned_at):
+    return (
+        f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
+        f"📌 *تم تسجيل الحضور بنجاح.*\n"
+        f"🗓️ التاريخ: `{scanned_at.strftime('%Y-%m-%d')}`\n"
+        f"⏰ الوقت: `{scanned_at.strftime('%H:%M')}`\n\n"
+        "📚 نتمنى له يوماً موفقاً!\n\n"
+        "مع تحيات،\n*م. عبدالله عمر* 😎"
+    )
+
+
+def _free_try_text(student, remaining):
+    return (
+        f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
+        f"✅ سجلنا حضور اليوم كفرصة مجانية.\n"
+        f"📌 تبقى {remaining} {'فرصة' if remaining==1 else 'فرص'} لهذا الشهر.\n\n"
+        "🎯 ننصح بسداد الاشتراك لضمان استمرار الحضور دون حدود.\n\n"
+        "– م. عبدالله عمر"
+    )
+
+
+def _payment_texts(student, payment, created, present, day):
+    """(رسالة الدفع، رسالة الحضور، رسالة WhatsApp المجمعة)"""
+    dp_msg = (
+        f"✅ تم استلام اشتراك شهر {payment.month:%B %Y}. بمبلغ {payment.amount} فقط لا غير"
+        if created else
+        f"ℹ️ دفعتك لشهر {payment.month:%B %Y} مسجلّة مسبقاً."
+    )
+    at_msg = (
+        f"✅ تم تسجيل حضور {student.name} اليوم {day:%Y-%m-%d}."
+        if present else
+        f"ℹ️ حضور {student.name} اليوم {day:%Y-%m-%d} مسجّل مسبقاً."
+    )
+    combined_text = (
+        f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
+        f"{dp_msg}\n"
+        f"{at_msg}\n\n"
+        "📚 شكراً لتعاونكم!\n\n"
+        "مع تحيات،\n*م. عبدالله عمر* 😎"
+    )
+    return dp_msg, at_msg, combined_text
+
+
 def barcode_attendance_view(request):
     today = timezone.localdate()
     context = {'now': today}
@@ -93,53 +194,39 @@ def barcode_attendance_view(request):
         action  = request.POST.get('action', 'scan')
         barcode = request.POST.get('barcode', '').strip()
 
-        try:
-            student = Students.objects.get(barcode=barcode)
-        except Students.DoesNotExist:
+        # الفهرس داخل الذاكرة يجيب عن الباركود المكرر أو غير المدفوع دون الرجوع لقاعدة البيانات
+        student = barcode_index.get_student(barcode)
+        if student is None:
             messages.error(request, "❌ هذا الباركود غير صالح. الرجاء المحاولة مرة أخرى.")
             return redirect('barcode_attendance')
 
-        if Attendance.objects.filter(student=student, attendance_date=today).exists():
+        if barcode_index.is_scanned(student.id, today):
             messages.warning(request, f"⚠️ حضور {student.name} اليوم مسجّل مسبقاً.")
             return redirect('barcode_attendance')
 
         month_start = date(today.year, today.month, 1)
-        paid = Payment.objects.filter(student=student, month=month_start).exists()
+        paid = barcode_index.has_paid(student.id, month_start)
 
         if action == 'scan':
-            try:
-                basics = Basics.objects.first()
-                late_arrival_time = basics.late_arrival_time
-            except:
-                late_arrival_time = None
+            late_arrival_time = settings_provider.get_late_arrival_time()
 
             if late_arrival_time:
                 current_time = timezone.localtime().time()
                 if current_time > late_arrival_time:
-                    lateness_message = (
-                        f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
-                        f"تم تسجيل حضور ابنكم/ابنتكم اليوم الساعة {current_time.strftime('%H:%M')}\.\n"
-                        "نأمل الالتزام بالحضور...\n\n"
-                        "مع تحيات،\n*م. عبدالله عمر* 😎"
-                    )
-                    phone = student.father_phone or ''
-                    reason = '' if student.father_phone and student.has_whatsapp else 'No WhatsApp or Missing phone'
-                    send_or_log(phone, lateness_message, student.id, student.name, 'Lateness Alert', reason)
+                    send_or_log(student, _lateness_text(student, current_time), 'Lateness Alert')
 
             if paid:
-                Attendance.objects.create(student=student, attendance_date=today)
+                try:
+                    record_presence(student, today)
+                except IntegrityError:
+                    if barcode_index.is_gone(student.id):
+                        messages.error(request, "❌ هذا الباركود غير صالح. الرجاء المحاولة مرة أخرى.")
+                    else:
+                        # سجّله مكتب آخر في نفس اللحظة
+                        messages.warning(request, f"⚠️ حضور {student.name} اليوم مسجّل مسبقاً.")
+                    return redirect('barcode_attendance')
                 messages.success(request, f"✅ تم تسجيل حضور {student.name} بنجاح.")
-                attendance_text = (
-                    f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
-                    f"📌 *تم تسجيل الحضور بنجاح.*\n"
-                    f"🗓️ التاريخ: `{today.strftime('%Y-%m-%d')}`\n"
-                    f"⏰ الوقت: `{timezone.localtime().strftime('%H:%M')}`\n\n"
-                    "📚 نتمنى له يوماً موفقاً!\n\n"
-                    "مع تحيات،\n*م. عبدالله عمر* 😎"
-                )
-                phone = student.father_phone or ''
-                reason = '' if student.father_phone and student.has_whatsapp else 'No WhatsApp or Missing phone'
-                send_or_log(phone, attendance_text, student.id, student.name, 'Attendance', reason)
+                send_or_log(student, _attendance_text(student, timezone.localtime()), 'Attendance')
                 return redirect('barcode_attendance')
             else:
                 context.update({'pending_student': student, 'barcode': barcode})
@@ -149,58 +236,118 @@ def barcode_attendance_view(request):
                     messages.warning(request, "⚠️ انتهت فرصك المجانية لهذا الشهر، الرجاء الدفع.")
 
         elif action == 'free':
-            if student.free_tries > 0:
-                student.free_tries -= 1
-                student.save()
-                Attendance.objects.create(student=student, attendance_date=today)
-                messages.success(request, f"✅ حضور مجانيّ. تبقى لديك {student.free_tries} {'فرصة' if student.free_tries==1 else 'فرص'}.")
-
-                free_text = (
-                    f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
-                    f"✅ سجلنا حضور اليوم كفرصة مجانية.\n"
-                    f"📌 تبقى {student.free_tries} {'فرصة' if student.free_tries==1 else 'فرص'} لهذا الشهر.\n\n"
-                    "🎯 ننصح بسداد الاشتراك لضمان استمرار الحضور دون حدود.\n\n"
-                    "– م. عبدالله عمر"
-                )
-                phone = student.father_phone or ''
-                reason = '' if student.father_phone and student.has_whatsapp else 'No WhatsApp or Missing phone'
-                send_or_log(phone, free_text, student.id, student.name, 'FreeTry', reason)
+            # خصم الفرصة بتحديث مشروط وتسجيل الحضور في نفس المعاملة: لا يخصم مكتبان نفس الفرصة
+            try:
+                remaining = consume_free_try(student, today)
+            except IntegrityError:
+                if barcode_index.is_gone(student.id):
+                    messages.error(request, "❌ هذا الباركود غير صالح. الرجاء المحاولة مرة أخرى.")
+                else:
+                    messages.warning(request, f"⚠️ حضور {student.name} اليوم مسجّل مسبقاً.")
+                return redirect('barcode_attendance')
+            if remaining is not None:
+                messages.success(request, f"✅ حضور مجانيّ. تبقى لديك {remaining} {'فرصة' if remaining==1 else 'فرص'}.")
+                send_or_log(student, _free_try_text(student, remaining), 'FreeTry')
             else:
                 messages.error(request, "❌ لا توجد فرص مجانية متبقية، الرجاء الدفع.")
             return redirect('barcode_attendance')
 
         elif action == 'pay':
-            payment, created = Payment.objects.get_or_create(student=student, month=month_start)
-            student.free_tries = INITIAL_FREE_TRIES
-            student.last_reset_month = today.replace(day=1)
-            student.save()
-
-            Attendance.objects.create(student=student, attendance_date=today)
-            basics = Basics.objects.first()
-            pay_amount = basics.month_price if basics else 0
-            dp_msg = (
-                f"✅ تم استلام اشتراك شهر {payment.month:%B %Y}. بمبلغ {pay_amount} فقط لا غير"
-                if created else
-                f"ℹ️ دفعتك لشهر {payment.month:%B %Y} مسجلّة مسبقاً."
-            )
-            at_msg = f"✅ تم تسجيل حضور {student.name} اليوم {today:%Y-%m-%d}."
-
-            combined_text = (
-                f"👋 *مرحباً ولي أمر الطالب {student.name}،*\n\n"
-                f"{dp_msg}\n"
-                f"{at_msg}\n\n"
-                "📚 شكراً لتعاونكم!\n\n"
-                "مع تحيات،\n*م. عبدالله عمر* 😎"
-            )
-            phone = student.father_phone or ''
-            reason = '' if student.father_phone and student.has_whatsapp else 'No WhatsApp or Missing phone'
-            send_or_log(phone, combined_text, student.id, student.name, 'PaymentAttendance', reason)
+            # الدفعة وإيراد الشهر وإعادة الفرص والحضور في معاملة واحدة
+            try:
+                payment, created, present = pay_and_record_presence(student, month_start, today)
+            except DatabaseError:
+                # طالب حُذف من عملية أخرى: فشل حفظ الفرص (update_fields) أو قيد المفتاح الأجنبي
+                if not barcode_index.is_gone(student.id):
+                    raise
+                messages.error(request, "❌ هذا الباركود غير صالح. الرجاء المحاولة مرة أخرى.")
+                return redirect('barcode_attendance')
+            dp_msg, at_msg, combined_text = _payment_texts(student, payment, created, present, today)
+            send_or_log(student, combined_text, 'PaymentAttendance')
             messages.success(request, dp_msg)
             messages.success(request, at_msg)
             return redirect('barcode_attendance')
 
+    # تحميل الفهرس عند فتح صفحة المسح حتى لا يدفع أول طالب ثمنه
+    barcode_index.ensure_warm()
     return render(request, 'attendance.html', context)
 
+SCAN_BATCH_MAX_EVENTS = getattr(settings, 'SCAN_BATCH_MAX_EVENTS', 1000)
+
+
+def _scan_batch_outbox(result):
+    """رسائل WhatsApp لنتيجة حدث واحد، بنفس نصوص صفحة المسح وبوقت المسح الأصلي."""
+    student, scanned_at, status = result.get('student'), result.get('scanned_at'), result['status']
+    if status == 'present':
+        items = [_outbox_item(student, _attendance_text(student, scanned_at), 'Attendance')]
+        if result['late']:
+            items.insert(0, _outbox_item(student, _lateness_text(student, scanned_at.time()), 'Lateness Alert'))
+        return items
+    if status == 'free':
+        return [_outbox_item(student, _free_try_text(student, result['free_tries']), 'FreeTry')]
+    if status == 'paid':
+        combined_text = _payment_texts(
+            student, result['payment'], result['created'], result['present'], scanned_at.date()
+        )[2]
+        return [_outbox_item(student, combined_text, 'PaymentAttendance')]
+    return []
+
+
+def _scan_batch_result(result):
+    public = {key: result[key] for key in ('index', 'id', 'barcode', 'status')}
+    for key in ('student_id', 'student_name', 'action', 'late', 'free_tries', 'created', 'present'):
+        if key in result:
+            public[key] = result[key]
+    if 'scanned_at' in result:
+        public['scanned_at'] = result['scanned_at'].isoformat()
+    if 'payment' in result:
+        public['payment_month'] = f"{result['payment'].month:%Y-%m}"
+        public['amount'] = result['payment'].amount
+    return public
+
+
+@csrf_exempt
+@require_POST
+def scan_batch_view(request):
+    """
+    واجهة JSON لرفع دفعة مسحات مسجلة دون اتصال (انظر students/scan_batch.py).
+
+    الطلب: {"events": [{"barcode": "12345", "action": "scan", "scanned_at": "2025-06-01T08:05:00+03:00", "id": ...}]}
+    action اختياري (scan افتراضياً)، و scanned_at بصيغة ISO 8601 (بدونه = الآن)، و id يُعاد كما هو.
+    الرد: {"results": [...], "summary": {status: count}} بنتيجة لكل حدث بنفس الترتيب.
+    الطلب يحتاج الترويسة Authorization: Bearer <SCAN_API_TOKEN> (بدون csrf)، والواجهة معطلة
+    إن لم يُضبط الرمز. Content-Type يجب أن يكون application/json.
+    """
+    token = getattr(settings, 'SCAN_API_TOKEN', None)
+    if not token:
+        return JsonResponse({'error': 'scan_api_disabled'}, status=403)
+    if request.headers.get('Authorization') != f"Bearer {token}":
+        return JsonResponse({'error': 'unauthorized'}, status=401)
+    # نموذج من موقع آخر لا يستطيع إرسال application/json بدون preflight
+    if request.content_type != 'application/json':
+        return JsonResponse({'error': 'unsupported_media_type'}, status=415)
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'error': 'invalid_json'}, status=400)
+    events = payload.get('events') if isinstance(payload, dict) else payload
+    if not isinstance(events, list):
+        return JsonResponse({'error': 'events_must_be_a_list'}, status=400)
+    if len(events) > SCAN_BATCH_MAX_EVENTS:
+        return JsonResponse({'error': 'too_many_events', 'max_events': SCAN_BATCH_MAX_EVENTS}, status=413)
+
+    results = apply_scan_events(events)
+    # كل إشعارات الدفعة في إدخال جماعي واحد
+    queue_whatsapp_messages([
+        item for result in results for item in _scan_batch_outbox(result) if item is not None
+    ])
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return JsonResponse({'results': [_scan_batch_result(result) for result in results], 'summary': summary})
+
+
 def _send_whatsapp_attendance(student, today):
     date_str = today.strftime('%Y-%m-%d')
     time_str = timezone.localtime().strftime('%H:%M')
@@ -241,8 +388,9 @@ def _send_whatsapp_attendance(student, today):
         queue_whatsapp_message(student.father_phone, text, **ctx)
     else:
         reason = 'No WhatsApp or Missing phone'
-        # سجّل الفشل مباشرةً في الـ CSV
-        log_failed_delivery(student.father_phone or '', 'Attendance', reason, 'View-level skip')
+        # سجّل الفشل مباشرةً في جدول حالات الفشل
+        log_failed_delivery(student.father_phone or '', 'Attendance', reason, 'View-level skip',
+                            student_id=student.id, student_name=student.name)
         # ما زلنا نمرّر ليتضح في اللوج العادي
         ctx['reason'] = reason
         queue_whatsapp_message(student.father_phone or '', text, **ctx)
@@ -284,8 +432,9 @@ def _send_whatsapp_combined(student, dp_msg, at_msg):
         queue_whatsapp_message(student.father_phone, text, **ctx)
     else:
         reason = 'No WhatsApp or Missing phone'
-        # سجّل الفشل مباشرةً في الـ CSV
-        log_failed_delivery(student.father_phone or '', 'Attendance', reason, 'View-level skip')
+        # سجّل الفشل مباشرةً في جدول حالات الفشل
+        log_failed_delivery(student.father_phone or '', 'Attendance', reason, 'View-level skip',
+                            student_id=student.id, student_name=student.name)
         # ما زلنا نمرّر ليتضح في اللوج العادي
         ctx['reason'] = reason
         queue_whatsapp_message(student.father_phone or '', text, **ctx)
@@ -360,72 +509,16 @@ def mark_absentees_view(request):
         return redirect('barcode_attendance')
 
     today = timezone.localdate()
-    # بداية الشهر لحساب إجمالي الغيابات
-    month_start = today.replace(day=1)
-
-    # جميع الطلاب
-    all_students = Students.objects.all()
-    # الطلاب الذين حضروا اليوم
-    attended_ids = Attendance.objects.filter(
-        attendance_date=today,
-        is_absent=False
-    ).values_list('student_id', flat=True)
-    # الطلاب الغائبون اليوم
-    absentees = all_students.exclude(id__in=attended_ids)
-
-    for student in absentees:
-        # إذا لم نسجل للطالب شيئاً اليوم
-        if Attendance.objects.filter(student=student, attendance_date=today).exists():
-            continue
-
-        # ضع علامة غياب
-        Attendance.objects.create(
-            student=student,
-            attendance_date=today,
-            is_absent=True
-        )
-
-        # حساب الأيام المتتابعة للغياب
-        consecutive_days = 1
-        yesterday = today - timedelta(days=1)
-        # تحقق من الغياب أمس
-        if Attendance.objects.filter(student=student, attendance_date=yesterday, is_absent=True).exists():
-            consecutive_days += 1
-            # غياب اليوم قبل أمس
-            day_before = today - timedelta(days=2)
-            if Attendance.objects.filter(student=student, attendance_date=day_before, is_absent=True).exists():
-                consecutive_days += 1
-
-        # حساب إجمالي الغيابات منذ بداية الشهر
-        total_absences = Attendance.objects.filter(
-            student=student,
-            attendance_date__gte=month_start,
-            is_absent=True
-        ).count()
 
+    # تسجيل الغياب جماعياً وحساب الأيام المتتابعة وإجمالي الشهر باستعلامات ثابتة العدد
+    outbox = []
+    for entry in mark_absentees(today):
+        student = entry['student']
         # بناء الرسالة المناسبة
-        text = get_absence_message(student, today, consecutive_days, total_absences)
-
-        # أرسل الرسالة في Thread منفصل
-        if student.father_phone and student.has_whatsapp:
-            queue_whatsapp_message(
-            student.father_phone,
-            text,
-            student_id=student.id,
-            student_name=student.name,
-            message_type='Lateness Alert',
-            reason=''
-        )
-    else:
-        # الكود الذي يسجّل أسباب عدم الإرسال
-        queue_whatsapp_message(
-            student.father_phone or 'None',
-            text,
-            student_id=student.id,
-            student_name=student.name,
-            message_type='Lateness Alert',
-            reason='No WhatsApp or Missing phone'
-        )
+        text = get_absence_message(student, today, entry['consecutive_days'], entry['total_absences'])
+        outbox.append(_outbox_item(student, text, 'Absence'))
+    # إدخال جميع الرسائل في الطابور الدائم دفعة واحدة
+    queue_whatsapp_messages([item for item in outbox if item is not None])
 
     messages.success(request, "✅ تم تسجيل غياب اليوم وإرسال إشعارات مخصصة لأولياء الأمور.")
     return redirect('barcode_attendance')
@@ -439,10 +532,11 @@ def daily_dashboard_view(request):
     Displays a daily dashboard with attendance summary and students with overdue payments.
 
     Retrieves data for the current day using utility functions:
-    - `get_daily_attendance_summary`: For counts of present, absent, and unmarked students,
-      and lists of these students.
+    - `get_daily_attendance_summary`: For counts of present, absent, and unmarked students.
+      The lists of these students are only fetched when the `details=1` GET parameter is set.
     - `get_students_with_overdue_payments`: For a list of students who haven't paid
       for the current month.
+    - `get_latest_payments`: For the last payment of each overdue student (one query).
 
     Args:
         request: HttpRequest object.
@@ -452,19 +546,28 @@ def daily_dashboard_view(request):
         with the following context:
         - 'dashboard_date' (date): The current date for which the dashboard is displayed.
         - 'attendance_summary' (dict): Data from `get_daily_attendance_summary`.
-        - 'overdue_payment_students' (QuerySet[Students]): Students with overdue payments.
+        - 'overdue_payment_students' (list[Students]): Students with overdue payments, each with a
+          `last_payment` attribute (Payment or None).
+        - 'show_details' (bool): Whether the per-student lists were loaded.
         - 'page_title' (str): The title for the page ("لوحة المتابعة اليومية").
     """
     today = timezone.localdate()
+    # Student name lists are only loaded on demand (?details=1); the counts need one aggregate query
+    show_details = request.GET.get('details') == '1'
     # Fetch daily attendance summary (present, absent, unmarked students)
-    attendance_summary = get_daily_attendance_summary(today)
+    attendance_summary = get_daily_attendance_summary(today, counts_only=not show_details)
     # Fetch students who have not paid for the current month
-    overdue_payment_students = get_students_with_overdue_payments()
+    overdue_queryset = get_students_with_overdue_payments()
+    last_payments = get_latest_payments(overdue_queryset.values('id'))
+    overdue_payment_students = list(overdue_queryset)
+    for student in overdue_payment_students:
+        student.last_payment = last_payments.get(student.id)
 
     context = {
         'dashboard_date': today,
         'attendance_summary': attendance_summary,
         'overdue_payment_students': overdue_payment_students,
+        'show_details': show_details,
         'page_title': 'لوحة المتابعة اليومية' # Daily Dashboard
     }
     return render(request, 'students/daily_dashboard.html', context)
@@ -591,37 +694,21 @@ def broadcast_message_view(request):
             messages.error(request, "❌ لا يمكن إرسال رسالة فارغة.")
             return redirect('broadcast_message')
 
-        all_students = Students.objects.all()
-        if not all_students:
+        if not Students.objects.exists():
             messages.warning(request, "⚠️ لا يوجد طلاب مسجلين لإرسال الرسالة إليهم.")
             return redirect('broadcast_message')
 
-        broadcast_header = "📢 *رسالة عامة من الإدارة:*\n\n"
-        broadcast_signature = "\n\nمع تحيات،\n*م. عبدالله عمر وفريق العمل* 👨‍🏫"
-
-        send_count = 0
-        for student in all_students:
-            phone = student.father_phone or ''
-            reason = '' if phone and student.has_whatsapp else 'No WhatsApp or Missing phone'
-            if phone:
-                personalized_content = message_content.replace('{student_name}', student.name)
-                full_message = broadcast_header + personalized_content + broadcast_signature
-                # Use send_or_log to queue and log failures
-                send_or_log(
-                    phone,
-                    full_message,
-                    student.id,
-                    student.name,
-                    'Broadcast Message',
-                    reason
-                )
-                send_count += 1
-            else:
-                # Log missing phone case
-                log_failed_delivery(phone, 'Broadcast Message', reason, '')
+        # سجل للرسالة يتابع المشرف من خلاله عدادات الإرسال
+        broadcast = BroadcastMessage.objects.create(
+            title=message_content.splitlines()[0][:100],
+            content=message_content,
+            send_to_all=True,
+        )
+        # الرسائل تُوضع في الطابور دفعات، والمُرسِل يرسلها في الخلفية
+        send_count = enqueue_broadcast(broadcast)
 
         if send_count > 0:
-            messages.success(request, f"✅ تم إرسال الرسالة إلى {send_count} ولي أمر بنجاح.")
+            messages.success(request, f"✅ تم وضع الرسالة في طابور الإرسال لـ {send_count} ولي أمر.")
         else:
             messages.warning(request, "⚠️ لم يتم إرسال الرسالة لأي ولي أمر (قد لا يكون هناك أرقام هواتف مسجلة).")
         return redirect('broadcast_message')
@@ -672,34 +759,103 @@ def broadcast_message_view(request):
     
 #     return render(request, 'broadcast_message.html')
 
+INCOME_PAGE_SIZE = 50
+
+
+def _parse_income_cursor(cursor):
+    """يفك مؤشر الصفحة 'paid_on|id' ويعيد (None, None) إذا كان غير صالح."""
+    try:
+        paid_on_str, payment_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(paid_on_str), int(payment_id)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def _income_payments(year=None, month=None):
+    """مدفوعات تقرير الدخل، الأحدث أولاً، مفلترة بشهر الدفع (سنة كاملة إن لم يُحدد الشهر)."""
+    payments = Payment.objects.select_related('student').order_by('-paid_on', '-id')
+    if year and month:
+        return payments.filter(month=date(year, month, 1))
+    if year:
+        return payments.filter(month__gte=date(year, 1, 1), month__lte=date(year, 12, 1))
+    return payments
+
+
 def income_report_view(request):
     """
     يعرض تقرير الدخل بناءً على المدفوعات المسجلة.
+
+    - فلترة اختيارية بالسنة (year) والشهر (month) حسب شهر الدفع؛ الشهر بدون سنة يعني السنة الحالية.
+    - ترقيم صفحات بالمؤشر (cursor) على (paid_on, id) بدلاً من OFFSET.
+    - export=csv أو export=xlsx لتصدير السجل كاملاً دون تحميله في الذاكرة.
     """
-    payments = Payment.objects.all().order_by('-paid_on')
-    
+    revenue = MonthlyRevenue.objects.all()
+
     try:
-        basics = Basics.objects.get(id=1)
-        month_price = basics.month_price
-    except Basics.DoesNotExist:
+        year = int(request.GET['year']) if request.GET.get('year') else None
+        month = int(request.GET['month']) if request.GET.get('month') else None
+        if year is not None and not 1 <= year <= 9999:
+            raise ValueError
+        if month is not None and not 1 <= month <= 12:
+            raise ValueError
+        if month is not None and year is None:
+            year = timezone.localdate().year
+    except ValueError:
+        messages.error(request, "سنة أو شهر غير صالح.")
+        year = month = None
+
+    payments = _income_payments(year, month)
+    if year and month:
+        revenue = revenue.filter(month=date(year, month, 1))
+        period_label = f"{year}-{month:02d}"
+    elif year:
+        revenue = revenue.filter(month__gte=date(year, 1, 1), month__lte=date(year, 12, 1))
+        period_label = str(year)
+    else:
+        period_label = "كل الفترات"
+
+    export_format = request.GET.get('export')
+    if export_format == 'csv':
+        response = StreamingHttpResponse(iter_income_csv(payments), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="income.csv"'
+        return response
+    if export_format == 'xlsx':
+        return FileResponse(write_income_xlsx(payments), as_attachment=True, filename='income.xlsx')
+
+    month_price = settings_provider.get_month_price()
+    if settings_provider.get_basics() is None:
         # Fallback or error handling if Basics instance is not found
         messages.error(request, "لم يتم تحديد سعر الشهر الأساسي. يرجى مراجعة الإعدادات.")
-        month_price = 0 # Default to 0 if not set, to avoid further errors
+        # month_price falls back to 0 if not set, to avoid further errors
         # Or redirect to an admin/setup page
         # return redirect('some_admin_setup_page')
 
-    total_income = payments.count() * month_price
-    
-    now = timezone.now()
-    month_year = now.strftime("%B %Y") # Example: "October 2023"
-    # For Arabic month names, you might need a custom mapping or locale settings
-    # For simplicity, using English month names as strftime default
-    
+    # الإجمالي من جدول الإيرادات الشهرية (المبالغ المدفوعة فعلياً) بدلاً من العدد × السعر الحالي
+    total_income = revenue.aggregate(total=Sum('total_amount'))['total'] or 0
+
+    # صفحة واحدة بعد المؤشر، ونجلب عنصراً إضافياً لنعرف إن كانت هناك صفحة تالية
+    cursor_paid_on, cursor_id = _parse_income_cursor(request.GET.get('cursor'))
+    if cursor_paid_on is not None:
+        payments = payments.filter(
+            Q(paid_on__lt=cursor_paid_on) | Q(paid_on=cursor_paid_on, id__lt=cursor_id)
+        )
+    page = list(payments[:INCOME_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(page) > INCOME_PAGE_SIZE:
+        page = page[:INCOME_PAGE_SIZE]
+        next_cursor = f"{page[-1].paid_on.isoformat()}|{page[-1].id}"
+
+    filter_params = {key: value for key, value in (('year', year), ('month', month)) if value}
     context = {
-        'payments': payments,
-        'month_price': month_price, # This is the price for EACH payment listed
+        'payments': page,
+        'month_price': month_price, # Current price; each payment shows its own stored amount
         'total_income': total_income,
-        'month_year': month_year,
+        'month_year': period_label,
+        'selected_year': year,
+        'selected_month': month,
+        'is_first_page': cursor_paid_on is None,
+        'next_page_query': urlencode({**filter_params, 'cursor': next_cursor}) if next_cursor else None,
+        'filter_query': urlencode(filter_params),
     }
     
     return render(request, 'income.html', context)